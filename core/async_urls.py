@@ -0,0 +1,14 @@
+"""
+URL configuration for read requests served under ASGI.
+
+AsyncReadRoutingMiddleware switches GET/HEAD requests to this URLconf when the project runs
+through core/asgi.py. The async read views come first; every other URL falls through to the
+regular patterns in core.urls.
+"""
+from django.urls import path, include
+
+from core.urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include('restaurantAPI.async_urls')),
+] + sync_urlpatterns
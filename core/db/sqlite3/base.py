@@ -0,0 +1,33 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The stock SQLite backend, tuned for several concurrent writers.
+
+    Two extra OPTIONS are read (and kept away from sqlite3.connect()):
+
+    * `pragmas`: PRAGMA name -> value, run on every new connection (WAL journal, synchronous,
+      busy_timeout, cache and mmap sizes, ...).
+    * `transaction_mode`: how atomic() opens its transaction, e.g. 'IMMEDIATE'. A deferred
+      transaction that reads before it writes has to upgrade its lock, and SQLite fails that
+      upgrade with "database is locked" instead of waiting; an immediate one takes the write
+      lock up front and waits for it through busy_timeout.
+    """
+    custom_options = ('pragmas', 'transaction_mode')
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for name in self.custom_options:
+            params.pop(name, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute(f'BEGIN {mode}' if mode else 'BEGIN')
@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'restaurantAPI.middleware.ProfilingMiddleware',
+    'restaurantAPI.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,10 +56,29 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'restaurantAPI.middleware.IssuedTokenMiddleware',
+    'restaurantAPI.middleware.AsyncReadRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
 
+# Share of requests (0 to 1) that ProfilingMiddleware profiles: a Server-Timing header with query, auth, view,
+# serializer and render time, and a log line on 'restaurantAPI.profiling' when slower than PROFILING_SLOW_REQUEST_MS
+PROFILING_SAMPLE_RATE = 0
+PROFILING_SLOW_REQUEST_MS = 500
+# Statements included in a slow-request log line, slowest first
+PROFILING_SLOWEST_QUERIES = 5
+
+# Every process writes its request metrics to its own file here (at most every METRICS_FLUSH_INTERVAL seconds);
+# /metrics adds them up and folds the files of exited processes into one totals file. Required
+METRICS_DIR = BASE_DIR / 'metrics'
+METRICS_FLUSH_INTERVAL = 1
+# Client addresses allowed to read /metrics; None allows everyone
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# GET/HEAD requests coming through core/asgi.py are routed here, to the async read views; None disables it
+ASYNC_READ_URLCONF = 'core.async_urls'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -81,11 +102,117 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # 'core.db.sqlite3' is the stock backend plus the PRAGMAs and transaction mode below; switch
+        # back to 'django.db.backends.sqlite3' (and drop OPTIONS) for the untuned behaviour
+        'ENGINE': 'core.db.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+                'cache_size': -65536,  # KiB, i.e. 64 MiB
+                'mmap_size': 268435456,
+                'temp_store': 'MEMORY',
+            },
+        },
+        # Keep connections across requests; a connection that went bad is replaced before it is reused
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# `manage.py serve`: prefork workers, each replaced after SERVE_MAX_REQUESTS (+ up to the jitter) requests
+SERVE_BIND = '127.0.0.1:8000'
+SERVE_WORKERS = 4
+SERVE_MAX_REQUESTS = 1000
+SERVE_MAX_REQUESTS_JITTER = 50
+# Seconds a WSGI worker waits on a client that sends nothing (or too slowly) before it drops the connection.
+# Each worker serves one connection at a time, so put a buffering proxy such as nginx in front for slow clients
+SERVE_TIMEOUT = 10
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2048,
+        },
+    },
+    # Kept apart from 'default' so sales analytics can't evict menu responses, or the other way round
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analytics',
+        'OPTIONS': {
+            'MAX_ENTRIES': 4096,  # about eleven years of days
+        },
+    },
+}
+
+# Serialized menu and category responses, invalidated by bumping a version on every write. The version lives
+# in MENU_CACHE_ALIAS, so with a per-process backend like LocMemCache a write only invalidates the process that
+# made it: other `serve` workers keep answering with the old menu until their entries are MENU_CACHE_TIMEOUT
+# seconds old. Point MENU_CACHE_ALIAS at a shared backend (file, Redis, Memcached) to invalidate everywhere
+MENU_CACHE_ALIAS = 'default'
+MENU_CACHE_MAX_ENTRIES = 512
+MENU_CACHE_TIMEOUT = 60
+
+# Per-day sales breakdowns of closed days. They only change when orders are edited outside the API, which shows
+# after at most ANALYTICS_CACHE_TIMEOUT seconds
+ANALYTICS_CACHE_ALIAS = 'analytics'
+ANALYTICS_CACHE_TIMEOUT = 86400
+
+# How list endpoints serialize menu items, cart rows, orders and order items: 'projection' reads only the
+# serialized columns with values_list() (restaurantAPI/fast_serializers.py), 'model' uses the ModelSerializers.
+# LIST_SERIALIZERS overrides the default per view class name, e.g. {'ListMenuItems': 'model'}; the ASGI views
+# (AsyncListMenuItems, ...) follow the sync view of the same URL
+LIST_SERIALIZER_DEFAULT = 'projection'
+LIST_SERIALIZERS = {}
+
+# Orders per server-side fetch (and per prefetch of their items) in /api/orders/export
+ORDER_EXPORT_CHUNK_SIZE = 2000
+
+# Group names per user, shared by the permission classes and views
+ROLE_CACHE_TTL = 300
+ROLE_CACHE_MAX_ENTRIES = 10000
+
+# Token -> user lookups kept by CachedTokenAuthentication; a revoked token keeps working in
+# other worker processes for at most TOKEN_AUTH_CACHE_TTL seconds
+TOKEN_AUTH_CACHE_TTL = 60
+TOKEN_AUTH_CACHE_MAX_ENTRIES = 10000
+
+# Verified Basic-auth credentials, so repeat requests skip the password hasher
+BASIC_AUTH_CACHE_TTL = 30
+BASIC_AUTH_CACHE_MAX_ENTRIES = 10000
+# Answer Basic-auth requests with the user's API token in an X-Auth-Token header
+BASIC_AUTH_ISSUE_TOKEN = False
+
+# Seconds between reloads of the delivery dispatcher's crew index from the database
+DISPATCHER_REFRESH_SECONDS = 300
+# Queued orders (placed while no crew was ready) are handed out until each crew member holds this many
+# undelivered orders; the rest are handed out as orders are delivered or more crew get ready
+DISPATCHER_DRAIN_MAX_OPEN_ORDERS = 10
+
+# Server-sent event streams (restaurantAPI/events.py). InProcessBroker only reaches the streams of the process that
+# made the change; `serve` switches to SQLiteBroker when it forks several workers. SQLiteBroker passes events between
+# the processes through the EVENTS_DB file (required), read every EVENTS_POLL_INTERVAL seconds and keeping the last
+# EVENTS_RETAIN events
+EVENTS_BROKER = 'restaurantAPI.events.InProcessBroker'
+EVENTS_DB = BASE_DIR / 'events.sqlite3'
+EVENTS_POLL_INTERVAL = 0.1
+EVENTS_RETAIN = 10000
+# Events kept per stream for clients that reconnect with Last-Event-ID, for the most recently used
+# EVENTS_MAX_CHANNELS streams (one per crew member or customer)
+EVENTS_BUFFER_SIZE = 100
+EVENTS_MAX_CHANNELS = 10000
+# Events a connection may fall behind by before it is closed; the client resumes with Last-Event-ID
+EVENTS_QUEUE_SIZE = 100
+# Seconds between keepalive comments on an idle stream
+EVENTS_KEEPALIVE_SECONDS = 15
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
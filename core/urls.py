@@ -19,6 +19,8 @@ from django.urls import path, include
 
 from rest_framework.authtoken import views
 
+from restaurantAPI.views import Metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),  # browsable API login and logout
@@ -26,4 +28,5 @@ urlpatterns = [
     path('auth/', include('djoser.urls')),
 
     path('api/', include('restaurantAPI.urls')),
+    path('metrics', Metrics.as_view()),  # Prometheus scrape endpoint
 ]
@@ -15,7 +15,9 @@ class Rate(models.Model):
 
     class Meta:
         indexes = [
-            models.Index(fields=['content_type', 'object_id'])
+            models.Index(fields=['content_type', 'object_id']),
+            # "Has this user rated this item already?" in MenuItemRatings.post.
+            models.Index(fields=['user', 'object_id'], name='rates_user_object_idx'),
         ]
         db_table = 'rates'
         verbose_name = 'rate'
@@ -0,0 +1,115 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from .cache import CacheStats
+from .models import OrderItem
+
+_stats = CacheStats('sales_analytics')
+
+
+def _cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]
+
+
+def _cache_key(day):
+    return f'sales-analytics:{day.isoformat()}'
+
+
+def _empty_day():
+    return {'menu_items': {}, 'categories': {}, 'hours': {}}
+
+
+def _add(bucket, key, label, quantity, revenue):
+    entry = bucket.setdefault(key, [label, 0, Decimal(0)])
+    entry[1] += quantity or 0
+    entry[2] += revenue or 0
+
+
+def _query_days(dates):
+    """Per-day breakdowns for `dates` (and no other day), three grouped queries in total."""
+    days = defaultdict(_empty_day)
+    items = OrderItem.objects.filter(order__date__in=dates)
+
+    by_item = (items.values('order__date', 'menuitem', 'menuitem__title', 'menuitem__category__title')
+               .annotate(quantity=Sum('quantity'), revenue=Sum('price')).order_by())
+    for row in by_item:
+        label = (row['menuitem__title'], row['menuitem__category__title'])
+        _add(days[row['order__date']]['menu_items'], row['menuitem'], label, row['quantity'], row['revenue'])
+
+    by_category = (items.values('order__date', 'menuitem__category', 'menuitem__category__title')
+                   .annotate(quantity=Sum('quantity'), revenue=Sum('price')).order_by())
+    for row in by_category:
+        _add(days[row['order__date']]['categories'], row['menuitem__category'], row['menuitem__category__title'],
+             row['quantity'], row['revenue'])
+
+    by_hour = (items.filter(order__ordered_time__isnull=False)
+               .annotate(hour=ExtractHour('order__ordered_time'))
+               .values('order__date', 'hour')
+               .annotate(quantity=Sum('quantity'), revenue=Sum('price')).order_by())
+    for row in by_hour:
+        _add(days[row['order__date']]['hours'], row['hour'], None, row['quantity'], row['revenue'])
+
+    return days
+
+
+def _money(value):
+    return str(Decimal(value).quantize(Decimal('0.01')))
+
+
+def sales_breakdown(start_date, end_date, top=10):
+    """
+    Revenue and quantity sold per menu item, per category and per hour of day (in TIME_ZONE)
+    between two dates, inclusive; items and categories are cut to the `top` best by revenue.
+
+    Closed days (before today) can't change through the API any more, so their breakdowns are cached
+    for ANALYTICS_CACHE_TIMEOUT seconds and only the uncached days, plus today, are aggregated in the database.
+    """
+    today = timezone.now().date()
+    days = [start_date + datetime.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    closed_days = [day for day in days if day < today]
+
+    cached = _cache().get_many([_cache_key(day) for day in closed_days])
+    _stats.hits += len(cached)
+    _stats.misses += len(closed_days) - len(cached)
+    breakdowns = {day: cached[_cache_key(day)] for day in closed_days if _cache_key(day) in cached}
+
+    missing = [day for day in days if day not in breakdowns]
+    if missing:
+        queried = _query_days(missing)
+        fresh = {day: queried.get(day, _empty_day()) for day in missing}
+        _cache().set_many({_cache_key(day): data for day, data in fresh.items() if day < today},
+                          timeout=getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 86400))
+        breakdowns.update(fresh)
+
+    totals = _empty_day()
+    for data in breakdowns.values():
+        for dimension in ('menu_items', 'categories', 'hours'):
+            for key, (label, quantity, revenue) in data[dimension].items():
+                _add(totals[dimension], key, label, quantity, revenue)
+
+    def ranked(bucket):
+        return sorted(bucket.items(), key=lambda entry: entry[1][2], reverse=True)[:top]
+
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'menu_items': [
+            {'id': key, 'title': title, 'category': category, 'quantity': quantity, 'revenue': _money(revenue)}
+            for key, ((title, category), quantity, revenue) in ranked(totals['menu_items'])
+        ],
+        'categories': [
+            {'id': key, 'title': title, 'quantity': quantity, 'revenue': _money(revenue)}
+            for key, (title, quantity, revenue) in ranked(totals['categories'])
+        ],
+        'hours': [
+            {'hour': hour, 'quantity': quantity, 'revenue': _money(revenue)}
+            for hour, (_, quantity, revenue) in sorted(totals['hours'].items())
+        ],
+    }
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RestaurantapiConfig(AppConfig):
@@ -7,3 +8,7 @@ class RestaurantapiConfig(AppConfig):
 
     def ready(self):
         import restaurantAPI.signals
+
+        if getattr(settings, 'PROFILING_SAMPLE_RATE', 0) > 0:
+            from restaurantAPI.profiling import instrument
+            instrument()
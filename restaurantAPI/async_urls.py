@@ -0,0 +1,21 @@
+from django.urls import path
+
+from .async_views import AsyncListMenuItems, AsyncListCategory, AsyncUserCart, AsyncOrderManagement, \
+    AsyncDeliveryEvents, AsyncOrderEvents
+
+urlpatterns = [
+    path('menu-items', AsyncListMenuItems.as_view()),
+    path('menu-items/<int:pk>', AsyncListMenuItems.as_view()),
+
+    path('category', AsyncListCategory.as_view()),
+    path('category/<int:pk>', AsyncListCategory.as_view()),
+
+    path('cart/menu-items', AsyncUserCart.as_view()),
+    path('cart/menu-items/<int:pk>', AsyncUserCart.as_view()),
+
+    path('orders', AsyncOrderManagement.as_view()),
+    path('orders/<int:pk>', AsyncOrderManagement.as_view()),
+    path('orders/events', AsyncOrderEvents.as_view()),
+
+    path('delivery/events', AsyncDeliveryEvents.as_view()),
+]
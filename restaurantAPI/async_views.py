@@ -0,0 +1,237 @@
+from contextlib import aclosing
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Sum, Count
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .authentication import CachedTokenAuthentication, CachedBasicAuthentication
+from . import events
+from .cache import menu_cache, normalize_menu_params
+from .fast_serializers import aserialize_list, serialize_list
+from .models import MenuItem, Cart, Order, Category
+from .pagination import KeysetPagination
+from .profiling import span
+from .roles import aget_roles
+from .search import menu_search
+from .serializers import MenuItemSerializer, CartSerializer, OrderSerializer, CategorySerializer
+from .views import filter_menu_items, order_menu_items
+
+
+async def alist(queryset):
+    return [row async for row in queryset]
+
+
+class AsyncReadView(View):
+    """
+    Base for the async GET endpoints that ASGI deployments serve through ASYNC_READ_URLCONF.
+
+    Authenticates like the sync views (token, then Basic, then session) and requires an authenticated
+    user, which is all the sync views' permission classes ask of a GET; role checks are left to the
+    handlers. Responses are always JSON, so the browsable API stays on the sync views.
+    """
+    authenticators = (CachedTokenAuthentication(), CachedBasicAuthentication())
+    renderer = JSONRenderer()
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request)
+        try:
+            with span('auth'):
+                await self.authenticate(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Http404 as exc:
+            return self.error(exceptions.NotFound(*exc.args))
+        except exceptions.APIException as exc:
+            return self.error(exc)
+
+    async def authenticate(self, request):
+        for authenticator in self.authenticators:
+            user_auth = await authenticator.aauthenticate(request)
+            if user_auth is not None:
+                request.user, request.auth = user_auth
+                return
+
+        user = await request._request.auser()
+        if not user.is_authenticated or not user.is_active:
+            raise exceptions.NotAuthenticated()
+        request.user, request.auth = user, None
+
+    def error(self, exc):
+        headers = {}
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            headers['WWW-Authenticate'] = self.authenticators[0].authenticate_header(None)
+        return self.render({'detail': exc.detail}, exc.status_code, headers)
+
+    def render(self, data, status_code=status.HTTP_200_OK, headers=None):
+        with span('render'):
+            content = self.renderer.render(data)
+        response = HttpResponse(content, status=status_code, headers=headers, content_type='application/json')
+        response['Vary'] = 'Accept'
+        return response
+
+
+class AsyncListCategory(AsyncReadView):
+    async def get(self, request: Request, pk=None):
+        cache_key = await menu_cache.akey('category', pk)
+        cached = await menu_cache.aget(cache_key)
+        if cached is not None:
+            return self.render(cached, headers={'X-Cache': 'HIT'})
+
+        if pk:
+            data = CategorySerializer(await aget_object_or_404(Category, pk=pk)).data
+        else:
+            data = CategorySerializer(await alist(Category.objects.all()), many=True).data
+        await menu_cache.aset(cache_key, data)
+        return self.render(data, headers={'X-Cache': 'MISS'})
+
+
+class AsyncListMenuItems(AsyncReadView):
+    list_serializer_key = 'ListMenuItems'
+
+    async def get(self, request: Request, pk=None):
+        params = normalize_menu_params(request.query_params)
+        cache_key = await menu_cache.akey('menu-items', pk, params)
+        cached = await menu_cache.aget(cache_key)
+        if cached is not None:
+            return self.render(cached, headers={'X-Cache': 'HIT'})
+
+        queryset = MenuItem.objects.select_related('category')
+        if pk:
+            data = MenuItemSerializer(await aget_object_or_404(queryset, pk=pk)).data
+        else:
+            if 'search' in request.query_params or 'category' in request.query_params:
+                # The first search of a process checks whether the FTS5 index exists.
+                await sync_to_async(menu_search.available)()
+            queryset = order_menu_items(filter_menu_items(queryset, request.query_params))
+            data = await aserialize_list(self, MenuItemSerializer, queryset)
+        await menu_cache.aset(cache_key, data)
+        return self.render(data, headers={'X-Cache': 'MISS'})
+
+
+class AsyncUserCart(AsyncReadView):
+    list_serializer_key = 'UserCartManager'
+
+    async def get(self, request: Request, pk=None):
+        roles = await aget_roles(request.user)
+        cart = Cart.objects.select_related('menuitem__category')
+
+        if 'manager' in roles:
+            if pk:
+                queryset = cart.filter(user__id=pk)
+                user_total_cart_info = await queryset.aaggregate(
+                    total_price=Sum("price"),
+                    number_of_items=Count("id"),
+                    total_quantity=Sum("quantity")
+                )
+                return self.render([await aserialize_list(self, CartSerializer, queryset), user_total_cart_info])
+
+            queryset = cart.order_by('user')
+            paginator = KeysetPagination(('user', 'id'))
+            if paginator.is_requested(request):
+                page = await paginator.apaginate_queryset(queryset, request)
+                each_user_cart = Cart.objects.filter(user__in={item.user_id for item in page}) \
+                    .values('user').annotate(total_price=Sum('price')).order_by('user')
+                response = paginator.get_paginated_response(
+                    [serialize_list(self, CartSerializer, page), await alist(each_user_cart)])
+                return self.render(response.data)
+            each_user_cart = queryset.values('user').annotate(total_price=Sum('price'))
+            return self.render([await aserialize_list(self, CartSerializer, queryset), await alist(each_user_cart)])
+
+        if 'customer' in roles:
+            queryset = cart.filter(user=request.user)
+            total_items = await queryset.aaggregate(
+                total_price=Sum("price"),
+                number_of_items=Count("id"),
+                total_quantity=Sum("quantity")
+            )
+            return self.render([{"items in your cart": await aserialize_list(self, CartSerializer, queryset)},
+                                {"total order": total_items}])
+
+        return self.render({'error': 'User is not in the "manager" or "customer" group.'}, status.HTTP_403_FORBIDDEN)
+
+
+class AsyncOrderManagement(AsyncReadView):
+    list_serializer_key = 'OrderManagement'
+
+    async def get(self, request: Request, pk=None):
+        roles = await aget_roles(request.user)
+
+        if 'manager' in roles:
+            if pk:
+                return self.render(OrderSerializer(await aget_object_or_404(Order, pk=pk)).data)
+            queryset = Order.objects.order_by('-date', 'user')
+            paginator = KeysetPagination(('-date', 'user', 'id'))
+            if paginator.is_requested(request):
+                page = await paginator.apaginate_queryset(queryset, request)
+                return self.render(paginator.get_paginated_response(serialize_list(self, OrderSerializer, page)).data)
+            return self.render(await aserialize_list(self, OrderSerializer, queryset))
+
+        if 'customer' in roles:
+            if pk:
+                return self.render(OrderSerializer(await aget_object_or_404(Order, pk=pk, user=request.user)).data)
+            queryset = Order.objects.filter(user=request.user).order_by('date')
+            return self.render(await aserialize_list(self, OrderSerializer, queryset))
+
+        return self.render({"error": "403 Forbidden"}, status.HTTP_403_FORBIDDEN)
+
+
+def _release_connections():
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+async def _idle_stream(channel, last_event_id):
+    """
+    events.stream() without the database connections authentication may have opened, which an idle
+    stream doesn't need. Runs once the middleware is done with the response. The connections are
+    closed in the request's thread, which owns them.
+    """
+    await sync_to_async(_release_connections)()
+    async with aclosing(events.stream(channel, last_event_id)) as stream:
+        async for chunk in stream:
+            yield chunk
+
+
+class AsyncEventStream(AsyncReadView):
+    """
+    Base for the server-sent event endpoints: users with `role` get the stream of the channel that
+    `channel` (a function of the user's id) names. Only served under ASGI; a WSGI worker would be held
+    for the life of the stream.
+    """
+    role = None
+    channel = None
+
+    async def get(self, request: Request):
+        if self.role not in await aget_roles(request.user):
+            return self.render({'error': f'User is not in the "{self.role}" group.'}, status.HTTP_403_FORBIDDEN)
+        channel = self.channel(request.user.id)
+        response = StreamingHttpResponse(_idle_stream(channel, request.headers.get('Last-Event-ID')),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class AsyncDeliveryEvents(AsyncEventStream):
+    """
+    `assigned` when an order is given to the crew member, `unassigned` when a manager moves it to
+    someone else, each with the order as data.
+    """
+    role = 'delivery'
+    channel = staticmethod(events.delivery_channel)
+
+
+class AsyncOrderEvents(AsyncEventStream):
+    """
+    The customer's order changes: `assigned` when an order gets a (new) delivery crew member and
+    `delivered` when it is delivered, each with the order as data.
+    """
+    role = 'customer'
+    channel = staticmethod(events.orders_channel)
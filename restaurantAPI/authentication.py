@@ -0,0 +1,154 @@
+import copy
+import hashlib
+import hmac
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from .cache import LRUCache
+
+_token_cache = LRUCache('token_auth',
+                        maxsize=getattr(settings, 'TOKEN_AUTH_CACHE_MAX_ENTRIES', 10000),
+                        ttl=getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 60))
+
+_basic_cache = LRUCache('basic_auth',
+                        maxsize=getattr(settings, 'BASIC_AUTH_CACHE_MAX_ENTRIES', 10000),
+                        ttl=getattr(settings, 'BASIC_AUTH_CACHE_TTL', 30))
+# Never leaves the process, so the cached digests can't be checked against guessed passwords elsewhere.
+_credential_salt = secrets.token_bytes(32)
+
+
+def invalidate_token(key):
+    _token_cache.pop(key)
+
+
+def invalidate_user_tokens(user_id=None):
+    """Forget the cached tokens of one user, or of everyone when user_id is None."""
+    if user_id is None:
+        _token_cache.clear()
+    else:
+        _token_cache.pop_matching(lambda entry: entry[0].pk == user_id)
+
+
+def invalidate_user_credentials(user_id=None):
+    if user_id is None:
+        _basic_cache.clear()
+    else:
+        _basic_cache.pop_matching(lambda entry: entry[0] == user_id)
+
+
+def token_cache_stats():
+    return _token_cache.stats()
+
+
+def basic_cache_stats():
+    return _basic_cache.stats()
+
+
+def _request_copy(user):
+    """
+    A copy of a cached user for one request. Per-request state (e.g. memoized roles) and cached
+    relations (`profile`, ...) set on it never reach the cached instance or other requests.
+    """
+    user = copy.copy(user)
+    user._state = copy.copy(user._state)
+    user._state.fields_cache = {}
+    user._state.related_managers_cache = {}
+    return user
+
+
+def _credential_digest(username, password):
+    return hmac.new(_credential_salt, f'{username}\0{password}'.encode(), hashlib.sha256).hexdigest()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in TokenAuthentication that keeps token -> user lookups in a bounded in-process cache.
+
+    Deleting a token, saving a user (deactivation included) or changing their groups evicts the
+    entry in the process that made the change; other processes keep accepting the token for up to
+    TOKEN_AUTH_CACHE_TTL seconds.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = _token_cache.get(key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            _token_cache.set(key, cached)
+        user, token = cached
+        return _request_copy(user), token
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views: the same header checks, with the token looked up through aget()."""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        cached = _token_cache.get(key)
+        if cached is None:
+            model = self.get_model()
+            try:
+                token = await model.objects.select_related('user').aget(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            cached = (token.user, token)
+            _token_cache.set(key, cached)
+        user, token = cached
+        return _request_copy(user), token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    BasicAuthentication that runs the password hasher only on the first request of a client.
+
+    Verified credentials are remembered for BASIC_AUTH_CACHE_TTL seconds under a salted digest of
+    username and password, together with the user's password hash. A later request with the same
+    credentials only reloads the user and compares the stored hash, so a password change (or
+    deactivation) invalidates the entry in every process at once.
+
+    With BASIC_AUTH_ISSUE_TOKEN enabled, responses to Basic-auth requests carry the user's API token
+    in an X-Auth-Token header (see IssuedTokenMiddleware) so clients can switch to token auth.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        digest = _credential_digest(userid, password)
+        cached = _basic_cache.get(digest)
+        if cached is not None:
+            user_id, password_hash, token_key = cached
+            user = get_user_model()._default_manager.filter(pk=user_id).first()
+            if user is not None and user.is_active and user.password == password_hash:
+                self.issue_token(request, token_key)
+                return user, None
+            _basic_cache.pop(digest)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        token_key = None
+        if getattr(settings, 'BASIC_AUTH_ISSUE_TOKEN', False):
+            token_key = Token.objects.get_or_create(user=user)[0].key
+        _basic_cache.set(digest, (user.pk, user.password, token_key))
+        self.issue_token(request, token_key)
+        return user, auth
+
+    async def aauthenticate(self, request):
+        # A cache hit is one primary-key query, a miss runs the password hasher; neither has an async API.
+        return await sync_to_async(self.authenticate)(request)
+
+    def issue_token(self, request, token_key):
+        if token_key and request is not None:
+            request._request.issued_auth_token = token_key
@@ -0,0 +1,235 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+_registry = {}
+
+
+def cache_stats():
+    """Hit/miss counters of every cache created in this process, keyed by cache name."""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+class CacheStats:
+    """Hit/miss counters for a cache that lives outside this module (e.g. a Django cache alias)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        _registry[name] = self
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class LRUCache:
+    """
+    Thread-safe in-process mapping bounded to `maxsize` entries, evicting the least recently used
+    one first. Entries older than `ttl` seconds (if given) are treated as misses.
+    """
+
+    def __init__(self, name, maxsize, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (self.ttl is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            evicted = []
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[0])
+        return evicted
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def pop_matching(self, predicate):
+        """Drop every entry whose value satisfies `predicate`."""
+        with self._lock:
+            stale = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in stale:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+
+class VersionedResponseCache:
+    """
+    Serialized responses stored in a Django cache backend under a version counter kept in the same
+    backend. bump() moves every process sharing the backend to a new version, so stale entries are
+    never read again; the entries this process wrote are tracked in an LRUCache and deleted from the
+    backend when they are evicted or superseded. With a per-process backend (LocMemCache) a bump
+    only reaches this process, and `timeout` bounds how long the others serve stale entries.
+    """
+
+    def __init__(self, name, alias='default', max_entries=512, timeout=None):
+        self.name = name
+        self.alias = alias
+        self.timeout = timeout
+        self._version_key = f'{name}:version'
+        self._index = LRUCache(name, max_entries)
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @property
+    def process_local(self):
+        return isinstance(self.backend, LocMemCache)
+
+    def version(self):
+        version = self.backend.get(self._version_key)
+        if version is None:
+            self.backend.add(self._version_key, 1, timeout=None)
+            version = self.backend.get(self._version_key, 1)
+        return version
+
+    def bump(self):
+        try:
+            self.backend.incr(self._version_key)
+        except ValueError:
+            self.backend.add(self._version_key, 2, timeout=None)
+        stale = self._index.keys()
+        self._index.clear()
+        self.backend.delete_many(stale)
+
+    def key(self, *parts):
+        """
+        The entry key for `parts` under the current version. Take it before reading the rows the entry is
+        built from, and pass the same key to get() and set(): if a write commits in between, the entry goes
+        under the old version, which nothing reads any more.
+        """
+        return f'{self.name}:{self.version()}:{self._digest(parts)}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self._index.misses += 1
+            return None
+        self._index.hits += 1
+        self._touch(key)
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, timeout=self.timeout)
+        self._touch(key)
+
+    # The same for async views. A process-local backend is a dict behind a lock and is called directly; any
+    # other goes through its async API, so a file or network cache doesn't block the event loop.
+
+    async def aversion(self):
+        if self.process_local:
+            return self.version()
+        version = await self.backend.aget(self._version_key)
+        if version is None:
+            await self.backend.aadd(self._version_key, 1, timeout=None)
+            version = await self.backend.aget(self._version_key, 1)
+        return version
+
+    async def akey(self, *parts):
+        return f'{self.name}:{await self.aversion()}:{self._digest(parts)}'
+
+    async def aget(self, key):
+        if self.process_local:
+            return self.get(key)
+        value = await self.backend.aget(key)
+        if value is None:
+            self._index.misses += 1
+            return None
+        self._index.hits += 1
+        await self._atouch(key)
+        return value
+
+    async def aset(self, key, value):
+        if self.process_local:
+            return self.set(key, value)
+        await self.backend.aset(key, value, timeout=self.timeout)
+        await self._atouch(key)
+
+    def _digest(self, parts):
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def _touch(self, key):
+        evicted = self._index.set(key, True)
+        if evicted:
+            self.backend.delete_many(evicted)
+
+    async def _atouch(self, key):
+        evicted = self._index.set(key, True)
+        if evicted:
+            await self.backend.adelete_many(evicted)
+
+    def stats(self):
+        return self._index.stats()
+
+
+def _as_number(value):
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
+
+def normalize_menu_params(query_params):
+    """
+    Reduce the ListMenuItems filters to a canonical tuple so equivalent queries share a cache entry.
+    Only rewrites that cannot change the result are applied: category order, duplicate categories
+    and the spelling of numbers.
+    """
+    categories = sorted(set(query_params.getlist('category', [])))
+    return (
+        ('search', query_params.get('search') or ''),
+        ('category', tuple(categories)),
+        ('from_price', _as_number(query_params.get('from_price') or '')),
+        ('to_price', _as_number(query_params.get('to_price') or '')),
+        ('featured', bool(query_params.get('featured'))),
+        ('from_rate', _as_number(query_params.get('from_rate') or '')),
+    )
+
+
+menu_cache = VersionedResponseCache(
+    'menu',
+    alias=getattr(settings, 'MENU_CACHE_ALIAS', 'default'),
+    max_entries=getattr(settings, 'MENU_CACHE_MAX_ENTRIES', 512),
+    timeout=getattr(settings, 'MENU_CACHE_TIMEOUT', 60),
+)
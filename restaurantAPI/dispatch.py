@@ -0,0 +1,165 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from auths.users.models import User
+from .models import Order
+
+
+class DeliveryDispatcher:
+    """
+    In-process index of the ready delivery crew and how many undelivered orders each one holds.
+
+    assign() finds the least-loaded crew member in O(log n) through a heap with lazy deletion: an
+    entry is only valid while its load still matches `_load`. The index is loaded from the database
+    on first use and again every `refresh_interval` seconds. Other worker processes change crew and
+    orders in between, so the pick is checked against the database before it is used, and new orders
+    only count against a crew member once their transaction commits.
+    """
+
+    def __init__(self, refresh_interval=300, drain_max_open_orders=10):
+        self.refresh_interval = refresh_interval
+        self.drain_max_open_orders = drain_max_open_orders
+        self._lock = threading.RLock()
+        self._load = {}
+        self._heap = []
+        self._built_at = None
+
+    def rebuild(self):
+        crew = (User.objects.filter(groups__name='delivery', is_active=True, ready_to_work=True)
+                .annotate(open_orders=Count('delivery_crew', filter=Q(delivery_crew__status=False)))
+                .values_list('id', 'open_orders'))
+        with self._lock:
+            self._load = dict(crew)
+            self._heap = [(load, crew_id) for crew_id, load in self._load.items()]
+            heapq.heapify(self._heap)
+            self._built_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._load = {}
+            self._heap = []
+            self._built_at = None
+
+    def _ensure_index(self):
+        if self._built_at is None or time.monotonic() - self._built_at > self.refresh_interval:
+            self.rebuild()
+
+    def _set_load(self, crew_id, load):
+        self._load[crew_id] = load
+        heapq.heappush(self._heap, (load, crew_id))
+        if len(self._heap) > 4 * len(self._load) + 64:
+            self._heap = [(load, crew_id) for crew_id, load in self._load.items()]
+            heapq.heapify(self._heap)
+
+    def assign(self):
+        """
+        Return the id of the least-loaded crew member who can still take an order, or None. Call it inside
+        the transaction that creates the order: the order counts against them when that transaction commits.
+        """
+        while True:
+            with self._lock:
+                self._ensure_index()
+                crew_id = self._least_loaded()
+            if crew_id is None:
+                return None
+            open_orders = self._open_orders(crew_id)
+            with self._lock:
+                if open_orders is None:
+                    # Off duty, deactivated or out of the delivery group, possibly through another process.
+                    self._load.pop(crew_id, None)
+                elif crew_id in self._load:
+                    loaded_elsewhere = open_orders > self._load[crew_id]
+                    if open_orders != self._load[crew_id]:
+                        self._set_load(crew_id, open_orders)
+                    if not loaded_elsewhere:
+                        transaction.on_commit(lambda: self._add_load(crew_id, 1))
+                        return crew_id
+                    # Another process loaded them up; someone else may be less busy now, so pick again.
+
+    def _least_loaded(self):
+        while self._heap:
+            load, crew_id = self._heap[0]
+            if self._load.get(crew_id) == load:
+                return crew_id
+            heapq.heappop(self._heap)
+        return None
+
+    def _open_orders(self, crew_id):
+        """crew_id's undelivered orders in the database, or None if they can't take orders."""
+        return (User.objects.filter(pk=crew_id, groups__name='delivery', is_active=True, ready_to_work=True)
+                .annotate(open_orders=Count('delivery_crew', filter=Q(delivery_crew__status=False)))
+                .values_list('open_orders', flat=True).first())
+
+    def _add_load(self, crew_id, orders):
+        with self._lock:
+            if crew_id in self._load:
+                self._set_load(crew_id, self._load[crew_id] + orders)
+
+    def crew_ready(self, crew_id, open_orders):
+        with self._lock:
+            self._ensure_index()
+            self._set_load(crew_id, open_orders)
+
+    def crew_unavailable(self, crew_id):
+        with self._lock:
+            self._load.pop(crew_id, None)
+
+    def order_closed(self, crew_id):
+        with self._lock:
+            if crew_id in self._load:
+                self._set_load(crew_id, max(self._load[crew_id] - 1, 0))
+
+    def order_moved(self, from_crew_id, to_crew_id):
+        with self._lock:
+            self.order_closed(from_crew_id)
+            if to_crew_id in self._load:
+                self._set_load(to_crew_id, self._load[to_crew_id] + 1)
+
+    def drain_queue(self):
+        """
+        Hand queued orders (undelivered, no crew) to ready crew, oldest first, spreading them over the crew
+        as loaded from the database now. Nobody is filled past `drain_max_open_orders`, so a lone crew member
+        coming online doesn't take the whole backlog; the rest waits for the next drain. Orders another
+        process assigns in the meantime are left to it. Returns {crew_id: [order_id, ...]} of the orders
+        this call assigned.
+        """
+        limit = self.drain_max_open_orders
+        with transaction.atomic():
+            self.rebuild()
+            with self._lock:
+                heap = [(load, crew_id) for crew_id, load in self._load.items() if load < limit]
+            heapq.heapify(heap)
+            planned = defaultdict(list)
+            capacity = sum(limit - load for load, _ in heap)
+            if capacity:
+                queued = (Order.objects.filter(status=False, delivery_crew__isnull=True)
+                          .order_by('date', 'id').values_list('id', flat=True)[:capacity])
+                for order_id in queued:
+                    load, crew_id = heap[0]
+                    if load + 1 < limit:
+                        heapq.heapreplace(heap, (load + 1, crew_id))
+                    else:
+                        heapq.heappop(heap)
+                    planned[crew_id].append(order_id)
+
+            assignments = {}
+            for crew_id, order_ids in planned.items():
+                updated = (Order.objects.filter(pk__in=order_ids, delivery_crew__isnull=True)
+                           .update(delivery_crew_id=crew_id))
+                if updated < len(order_ids):
+                    order_ids = list(Order.objects.filter(pk__in=order_ids, delivery_crew_id=crew_id)
+                                     .order_by('date', 'id').values_list('id', flat=True))
+                if order_ids:
+                    assignments[crew_id] = order_ids
+                    transaction.on_commit(lambda crew_id=crew_id, updated=updated: self._add_load(crew_id, updated))
+        return assignments
+
+
+dispatcher = DeliveryDispatcher(refresh_interval=getattr(settings, 'DISPATCHER_REFRESH_SECONDS', 300),
+                                drain_max_open_orders=getattr(settings, 'DISPATCHER_DRAIN_MAX_OPEN_ORDERS', 10))
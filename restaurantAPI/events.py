@@ -0,0 +1,298 @@
+import asyncio
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+
+def delivery_channel(crew_id):
+    return f'delivery:{crew_id}'
+
+
+def orders_channel(customer_id):
+    return f'orders:{customer_id}'
+
+
+class Event:
+    __slots__ = ('id', 'seq', 'type', 'data')
+
+    def __init__(self, id, seq, type, data):
+        self.id, self.seq, self.type, self.data = id, seq, type, data
+
+    def encode(self):
+        return f'id: {self.id}\nevent: {self.type}\ndata: {self.data}\n\n'.encode()
+
+
+class Subscription:
+    """
+    One stream's end of a channel. Events are handed over from any thread onto the stream's event loop
+    and wait there for the client to read them, at most `limit` at a time. A client that falls further
+    behind is cut off: get() returns None, the stream ends, and the client reconnects with its
+    Last-Event-ID to be sent the rest from the channel's buffer.
+    """
+
+    def __init__(self, broker, channel, loop, limit):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.limit = limit
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+        # Events to send before the live ones: what a reconnecting client missed.
+        self.backlog = []
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.limit:
+            self.overflowed = True
+            self.broker.unsubscribe(self)
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = None
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        async with asyncio.timeout(timeout):
+            return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Publish/subscribe between the views that change orders and the event streams of this process.
+
+    Each channel keeps its last `buffer_size` events, and the `max_channels` most recently used
+    channels keep theirs, so a client that reconnects with Last-Event-ID is sent what it missed. Event
+    ids start with a per-process epoch; when the missed events are gone (evicted, or published by an
+    earlier process) the client is sent a `reset` event instead and should reload its list. Streams
+    served by other processes don't see these events; deployments with several worker processes need
+    SQLiteBroker (which `serve` switches to when it forks workers) or another shared broker with the same
+    publish()/subscribe()/unsubscribe() methods.
+    """
+
+    def __init__(self, buffer_size=None, max_channels=None, queue_size=None):
+        self.buffer_size = buffer_size or getattr(settings, 'EVENTS_BUFFER_SIZE', 100)
+        self.max_channels = max_channels or getattr(settings, 'EVENTS_MAX_CHANNELS', 10000)
+        self.queue_size = queue_size or getattr(settings, 'EVENTS_QUEUE_SIZE', 100)
+        self.epoch = format(time.time_ns(), 'x')
+        self._seq = itertools.count(1)
+        self._last_seq = 0
+        self._lock = threading.Lock()
+        self._buffers = OrderedDict()
+        # Highest sequence number evicted from each channel's buffer, and from any dropped buffer.
+        self._evicted = {}
+        self._dropped = 0
+        self._subscribers = {}
+
+    def publish(self, channel, event_type, data):
+        """Send `data`, already encoded as JSON, to the channel's streams. Safe to call from any thread."""
+        with self._lock:
+            event, subscribers = self._record(channel, next(self._seq), event_type, data)
+        self._deliver(event, subscribers)
+        return event
+
+    def _record(self, channel, seq, event_type, data):
+        """Buffer a new event; returns it and the subscriptions to deliver it to. Call with the lock held."""
+        self._last_seq = seq
+        event = Event(f'{self.epoch}-{seq}', seq, event_type, data)
+        buffer = self._buffers.get(channel)
+        if buffer is None:
+            buffer = self._buffers[channel] = deque(maxlen=self.buffer_size)
+            if self._dropped:
+                # This channel's earlier events may have been in a dropped buffer.
+                self._evicted[channel] = self._dropped
+            if len(self._buffers) > self.max_channels:
+                dropped_channel, dropped = self._buffers.popitem(last=False)
+                self._evicted.pop(dropped_channel, None)
+                self._dropped = max(self._dropped, dropped[-1].seq)
+        else:
+            self._buffers.move_to_end(channel)
+            if len(buffer) == buffer.maxlen:
+                self._evicted[channel] = buffer[0].seq
+        buffer.append(event)
+        return event, list(self._subscribers.get(channel, ()))
+
+    def _deliver(self, event, subscribers):
+        for subscription in subscribers:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # The stream's event loop has closed; its subscription goes with the stream.
+                pass
+
+    def subscribe(self, channel, last_event_id=None):
+        """Start receiving the channel's events on the running event loop, after any missed since last_event_id."""
+        subscription = Subscription(self, channel, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if last_event_id:
+                subscription.backlog = self._missed(channel, last_event_id)
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def subscriber_count(self):
+        """Open subscriptions in this process, over all channels."""
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def _missed(self, channel, last_event_id):
+        epoch, _, seq = last_event_id.partition('-')
+        evicted = self._evicted.get(channel, 0) if channel in self._buffers else self._dropped
+        if epoch != self.epoch or not seq.isdigit() or int(seq) < evicted:
+            return [Event(f'{self.epoch}-{self._last_seq}', self._last_seq, 'reset', '{}')]
+        return [event for event in self._buffers.get(channel, ()) if event.seq > int(seq)]
+
+
+class SQLiteBroker(InProcessBroker):
+    """
+    InProcessBroker whose events pass through an SQLite file shared by every worker process, so a change
+    made in one process reaches the streams held by all of them.
+
+    publish() appends the event to the file. A process that serves streams reads the events it holds
+    on its first subscription, then polls for new ones every `poll_interval` seconds from a background
+    thread, and buffers and delivers them as InProcessBroker does. Event ids are the file's sequence
+    numbers, so a client can reconnect to any worker. The file keeps the last `retain` events; a poller
+    that falls further behind than that cuts its streams off, and they reconnect to a `reset` event.
+    """
+
+    def __init__(self, path=None, poll_interval=None, retain=None, **options):
+        super().__init__(**options)
+        self.path = path or getattr(settings, 'EVENTS_DB', None)
+        if not self.path:
+            raise ImproperlyConfigured('SQLiteBroker needs EVENTS_DB, the path of the file its processes share.')
+        self.poll_interval = poll_interval or getattr(settings, 'EVENTS_POLL_INTERVAL', 0.1)
+        self.retain = retain or getattr(settings, 'EVENTS_RETAIN', 10000)
+        self._local = threading.local()
+        self._position = 0
+        self._poller_pid = None
+        self._start_lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def _connection(self):
+        """This thread's connection to the file; connections are not carried over a fork."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'channel TEXT NOT NULL, type TEXT NOT NULL, data TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            # The epoch belongs to the file, so every process gives out the same ids.
+            connection.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', ?)", (format(time.time_ns(), 'x'),))
+            self.epoch = connection.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def publish(self, channel, event_type, data):
+        connection = self._connection()
+        seq = connection.execute('INSERT INTO events (channel, type, data) VALUES (?, ?, ?)',
+                                 (channel, event_type, data)).lastrowid
+        if seq % 1000 == 0:
+            connection.execute('DELETE FROM events WHERE seq <= ?', (seq - self.retain,))
+        return Event(f'{self.epoch}-{seq}', seq, event_type, data)
+
+    def subscribe(self, channel, last_event_id=None):
+        if self._poller_pid != os.getpid():
+            with self._start_lock:
+                if self._poller_pid != os.getpid():
+                    # Catch up before the first subscription looks for missed events.
+                    self._read_new()
+                    threading.Thread(target=self._poll, name='events-poller', daemon=True).start()
+                    self._poller_pid = os.getpid()
+        return super().subscribe(channel, last_event_id)
+
+    def close(self):
+        """Stop this process's poller."""
+        self._closed.set()
+
+    def _poll(self):
+        while not self._closed.wait(self.poll_interval):
+            try:
+                self._read_new()
+            except sqlite3.Error:
+                logger.exception('Reading events from %s failed', self.path)
+
+    def _read_new(self):
+        while True:
+            rows = self._connection().execute(
+                'SELECT seq, channel, type, data FROM events WHERE seq > ? ORDER BY seq LIMIT 1000',
+                (self._position,)).fetchall()
+            if not rows:
+                return
+            with self._lock:
+                delivered = []
+                if self._position and rows[0][0] > self._position + 1:
+                    # Events were pruned before this process read them: forget what it has and cut its
+                    # streams off, so their clients reconnect to a reset.
+                    self._buffers.clear()
+                    self._evicted.clear()
+                    self._dropped = rows[0][0] - 1
+                    delivered.append((None, [subscription for subscribers in self._subscribers.values()
+                                             for subscription in subscribers]))
+                for seq, channel, event_type, data in rows:
+                    delivered.append(self._record(channel, seq, event_type, data))
+                self._position = rows[-1][0]
+            for event, subscribers in delivered:
+                self._deliver(event, subscribers)
+            if len(rows) < 1000:
+                return
+
+
+broker = import_string(getattr(settings, 'EVENTS_BROKER', 'restaurantAPI.events.InProcessBroker'))()
+
+
+def publish_on_commit(channel, event_type, data):
+    """Publish `data` (rendered like the API's JSON) once the current transaction commits, or now outside one."""
+    payload = JSONRenderer().render(data).decode()
+    transaction.on_commit(lambda: broker.publish(channel, event_type, payload))
+
+
+async def stream(channel, last_event_id=None):
+    """
+    The text/event-stream body for one connection. Subscribes on the first iteration, so the
+    subscription is always closed with the stream; an idle stream sends a comment every
+    EVENTS_KEEPALIVE_SECONDS and does no other work. Ends when the client falls EVENTS_QUEUE_SIZE
+    events behind (see Subscription).
+    """
+    keepalive = getattr(settings, 'EVENTS_KEEPALIVE_SECONDS', 15)
+    subscription = broker.subscribe(channel, last_event_id)
+    try:
+        yield b': connected\n\n'
+        for event in subscription.backlog:
+            yield event.encode()
+        while True:
+            try:
+                event = await subscription.get(keepalive)
+            except TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            if event is None:
+                return
+            yield event.encode()
+    finally:
+        subscription.close()
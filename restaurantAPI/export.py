@@ -0,0 +1,91 @@
+import csv
+import itertools
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem
+
+ORDER_FIELDS = ('id', 'user_id', 'delivery_crew_id', 'status', 'total', 'customer_address', 'date',
+                'ordered_time', 'delivered_time')
+ITEM_FIELDS = ('id', 'menuitem_id', 'menuitem_title', 'quantity', 'price')
+CSV_HEADER = ['order_' + name if name == 'id' else name for name in ORDER_FIELDS] + \
+             ['item_' + name if name == 'id' else name for name in ITEM_FIELDS]
+# Leading characters that make spreadsheet applications read a cell as a formula.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Echo:
+    """File-like object whose write() hands the line back instead of buffering it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def export_queryset(start_date=None, end_date=None, status=None):
+    orders = Order.objects.only(*(name.removesuffix('_id') for name in ORDER_FIELDS)).order_by('date', 'id')
+    if start_date:
+        orders = orders.filter(date__gte=start_date)
+    if end_date:
+        orders = orders.filter(date__lte=end_date)
+    if status is not None:
+        orders = orders.filter(status=status)
+    items = OrderItem.objects.select_related('menuitem').only(
+        'id', 'order_id', 'quantity', 'price', 'menuitem__title').order_by('id')
+    return orders.prefetch_related(Prefetch('order', queryset=items))
+
+
+def _iterate(queryset):
+    """Orders with their items, one chunk of orders (and one prefetch query) at a time."""
+    return queryset.iterator(chunk_size=getattr(settings, 'ORDER_EXPORT_CHUNK_SIZE', 2000))
+
+
+def _order_values(order):
+    return [getattr(order, name) for name in ORDER_FIELDS]
+
+
+def _item_values(item):
+    return [item.id, item.menuitem_id, item.menuitem.title, item.quantity, item.price]
+
+
+def _csv_cell(value):
+    """Prefix text a spreadsheet would run as a formula, such as an address of '=HYPERLINK(...)', with '."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(queryset):
+    """One CSV row per order item, with the order columns repeated; orders without items get one row."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order in _iterate(queryset):
+        order_values = [_csv_cell(value) for value in _order_values(order)]
+        items = order.order.all()
+        if not items:
+            yield writer.writerow(order_values + [''] * len(ITEM_FIELDS))
+            continue
+        yield ''.join(writer.writerow(order_values + [_csv_cell(value) for value in _item_values(item)])
+                      for item in items)
+
+
+def iter_ndjson(queryset):
+    """One JSON object per line per order, with its items nested under `items`."""
+    for order in _iterate(queryset):
+        row = dict(zip(ORDER_FIELDS, _order_values(order)))
+        row['items'] = [dict(zip(ITEM_FIELDS, _item_values(item))) for item in order.order.all()]
+        yield json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+
+
+async def aiter_rows(rows, batch_size=100):
+    """
+    `rows` (iter_csv() or iter_ndjson()) for a response served under ASGI, where Django would otherwise
+    read a sync iterator to the end before sending anything. Each batch of rows is read in the request's
+    database thread; empty rows never occur, so an empty batch marks the end.
+    """
+    read_batch = sync_to_async(lambda: ''.join(itertools.islice(rows, batch_size)), thread_sensitive=True)
+    while batch := await read_batch():
+        yield batch
@@ -0,0 +1,165 @@
+from operator import attrgetter, itemgetter
+
+from django.conf import settings
+from django.db.models import QuerySet
+from rest_framework import serializers
+
+from .profiling import span
+from .serializers import MenuItemSerializer, CartSerializer, OrderSerializer, OrderItemSerializer
+
+# Field classes whose to_representation() hands a database value back unchanged (or an equal one).
+_PASSTHROUGH = {serializers.IntegerField, serializers.BooleanField, serializers.CharField,
+                serializers.PrimaryKeyRelatedField, serializers.ReadOnlyField}
+
+
+def _attribute_path(model, lookup):
+    """The attribute path on an instance for an ORM lookup: 'menuitem__category' -> 'menuitem.category_id'."""
+    parts = lookup.split('__')
+    path = []
+    for part in parts[:-1]:
+        path.append(part)
+        model = model._meta.get_field(part).related_model
+    path.append(model._meta.get_field(parts[-1]).attname)
+    return '.'.join(path)
+
+
+def _converting(read, convert):
+    if convert is None:
+        return read
+
+    def get(source):
+        value = read(source)
+        return None if value is None else convert(value)
+    return get
+
+
+def _combining(reads, function):
+    return lambda source: function(*[read(source) for read in reads])
+
+
+class ProjectionSerializer:
+    """
+    Read-only stand-in for `serializer_class(rows, many=True)` that builds the same `.data` without DRF's
+    per-row, per-field dispatch. A queryset is read with values_list(), so no model instances are made;
+    a list of instances (a pagination page) is read through attribute getters. Each field's lookup and
+    converter (the serializer field's own to_representation(), where it changes the value) is worked
+    out once per class.
+    """
+    serializer_class = None
+    # Output field -> ORM lookup, for fields whose source can't be projected as is.
+    lookups = {}
+    # Output field -> (ORM lookups, function of their values), for SerializerMethodFields.
+    computed = {}
+
+    def __init__(self, instance, many=True):
+        assert many, 'Projection serializers only serialize lists'
+        self.instance = instance
+
+    @property
+    def data(self):
+        if not hasattr(self, '_data'):
+            with span('serialize'):
+                if isinstance(self.instance, QuerySet):
+                    self._data = self.from_rows(self.project(self.instance))
+                else:
+                    self._data = self.from_instances(self.instance)
+        return self._data
+
+    @classmethod
+    def project(cls, queryset):
+        """The values_list() queryset from_rows() reads; evaluate it with iteration or `async for`."""
+        return queryset.values_list(*cls.compile()[0])
+
+    @classmethod
+    def from_rows(cls, rows):
+        getters = cls.compile()[1]
+        return [{name: get(row) for name, get in getters} for row in rows]
+
+    @classmethod
+    def from_instances(cls, instances):
+        getters = cls.compile()[2]
+        return [{name: get(instance) for name, get in getters} for instance in instances]
+
+    @classmethod
+    def compile(cls):
+        if '_compiled' not in cls.__dict__:
+            model = cls.serializer_class.Meta.model
+            fields = []
+            for name, field in cls.serializer_class().fields.items():
+                if name in cls.computed:
+                    lookups, function = cls.computed[name]
+                    fields.append((name, lookups, function, None))
+                else:
+                    lookup = cls.lookups.get(name, field.source.replace('.', '__'))
+                    convert = None if type(field) in _PASSTHROUGH else field.to_representation
+                    fields.append((name, (lookup,), None, convert))
+
+            columns = list(dict.fromkeys(lookup for _, lookups, _, _ in fields for lookup in lookups))
+            row_getters, instance_getters = [], []
+            for name, lookups, function, convert in fields:
+                for getters, read in ((row_getters, lambda lookup: itemgetter(columns.index(lookup))),
+                                      (instance_getters, lambda lookup: attrgetter(_attribute_path(model, lookup)))):
+                    if function is None:
+                        getters.append((name, _converting(read(lookups[0]), convert)))
+                    else:
+                        getters.append((name, _combining([read(lookup) for lookup in lookups], function)))
+            cls._compiled = (columns, row_getters, instance_getters)
+        return cls._compiled
+
+
+def _rate(rate_count, rate_sum, rate_histogram):
+    return {'rate_count': rate_count,
+            'rate_average': rate_sum / rate_count if rate_count else None,
+            'rate_histogram': rate_histogram}
+
+
+class MenuItemProjection(ProjectionSerializer):
+    serializer_class = MenuItemSerializer
+    computed = {'rate': (('rate_count', 'rate_sum', 'rate_histogram'), _rate)}
+
+
+class CartProjection(ProjectionSerializer):
+    serializer_class = CartSerializer
+    # The serializer renders the category with str(), which is its title.
+    lookups = {'_menuitem_category': 'menuitem__category__title'}
+
+
+class OrderProjection(ProjectionSerializer):
+    serializer_class = OrderSerializer
+
+
+class OrderItemProjection(ProjectionSerializer):
+    serializer_class = OrderItemSerializer
+    lookups = {'_menuitem_category': 'menuitem__category__title'}
+
+
+PROJECTIONS = {projection.serializer_class: projection
+               for projection in (MenuItemProjection, CartProjection, OrderProjection, OrderItemProjection)}
+
+
+def list_serializer(view, serializer_class):
+    """
+    What `view` lists serializer_class's rows with: LIST_SERIALIZERS[the view's list_serializer_key, or
+    its class name], or else LIST_SERIALIZER_DEFAULT. 'projection' picks the serializer's projection,
+    'model' the serializer. The async views use the key of the sync view they stand in for.
+    """
+    key = getattr(view, 'list_serializer_key', None) or type(view).__name__
+    mode = getattr(settings, 'LIST_SERIALIZERS', {}).get(
+        key, getattr(settings, 'LIST_SERIALIZER_DEFAULT', 'projection'))
+    if mode == 'projection':
+        return PROJECTIONS.get(serializer_class, serializer_class)
+    return serializer_class
+
+
+def serialize_list(view, serializer_class, rows):
+    """`.data` of a list of rows (a queryset or a page of instances), through list_serializer()."""
+    return list_serializer(view, serializer_class)(rows, many=True).data
+
+
+async def aserialize_list(view, serializer_class, queryset):
+    """serialize_list() of a queryset for async views."""
+    serializer = list_serializer(view, serializer_class)
+    if issubclass(serializer, ProjectionSerializer):
+        with span('serialize'):
+            return serializer.from_rows([row async for row in serializer.project(queryset)])
+    return serializer([row async for row in queryset], many=True).data
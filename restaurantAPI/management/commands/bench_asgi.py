@@ -0,0 +1,124 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from rest_framework.authtoken.models import Token
+
+from auths.users.models import User
+
+DEFAULT_PATHS = ('/api/menu-items', '/api/menu-items/1', '/api/category', '/api/cart/menu-items', '/api/orders')
+HOST = 'localhost'
+
+
+def _percentile(latencies, percent):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Compare requests/sec and p99 latency of the WSGI and ASGI handlers on the read endpoints, '
+            'calling both in-process with the same concurrency (no server or network in the loop)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username to authenticate as (by API token)')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help=f'Path to request, repeatable; defaults to {", ".join(DEFAULT_PATHS)}')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per path and handler')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist")
+        token = Token.objects.get_or_create(user=user)[0].key
+        wsgi, asgi = get_wsgi_application(), get_asgi_application()
+        requests, concurrency = options['requests'], options['concurrency']
+
+        self.stdout.write(f"{'path':<40} {'handler':<7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for path in options['paths'] or DEFAULT_PATHS:
+            for name, run in (('wsgi', self.run_wsgi), ('asgi', self.run_asgi)):
+                # One untimed request warms the caches the timed ones would otherwise pay for once.
+                run(asgi if name == 'asgi' else wsgi, path, token, 1, 1)
+                started = time.perf_counter()
+                results = run(asgi if name == 'asgi' else wsgi, path, token, requests, concurrency)
+                elapsed = time.perf_counter() - started
+
+                latencies = [latency for latency, _ in results]
+                errors = sum(1 for _, status_code in results if status_code >= 400)
+                self.stdout.write(
+                    f'{path:<40} {name:<7} {len(results) / elapsed:>9.1f} '
+                    f'{statistics.median(latencies) * 1000:>8.2f} {_percentile(latencies, 99) * 1000:>8.2f} '
+                    f'{errors:>7}'
+                )
+
+    def run_wsgi(self, application, path, token, requests, concurrency):
+        url = urlsplit(path)
+
+        def call(_):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': HOST,
+                'HTTP_ACCEPT': 'application/json', 'HTTP_AUTHORIZATION': f'Token {token}',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            status_line = []
+            started = time.perf_counter()
+            response = application(environ, lambda status, headers, exc_info=None: status_line.append(status))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            return time.perf_counter() - started, int(status_line[0].split()[0])
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(call, range(requests)))
+
+    def run_asgi(self, application, path, token, requests, concurrency):
+        url = urlsplit(path)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': url.path, 'raw_path': url.path.encode(), 'query_string': url.query.encode(), 'root_path': '',
+            'headers': [(b'host', HOST.encode()), (b'accept', b'application/json'),
+                        (b'authorization', f'Token {token}'.encode())],
+            'client': ('127.0.0.1', 50000), 'server': (HOST, 80),
+        }
+
+        async def call():
+            received = asyncio.Event()
+            status_code = []
+
+            async def receive():
+                if not received.is_set():
+                    received.set()
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client never disconnects; the handler cancels this wait once the response is sent.
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status_code.append(message['status'])
+
+            started = time.perf_counter()
+            await application(dict(scope), receive, send)
+            return time.perf_counter() - started, status_code[0]
+
+        async def worker(remaining, results):
+            while remaining:
+                remaining.pop()
+                results.append(await call())
+
+        async def main():
+            remaining, results = list(range(requests)), []
+            await asyncio.gather(*(worker(remaining, results) for _ in range(concurrency)))
+            return results
+
+        return asyncio.run(main())
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import resource
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from auths.users.models import User
+from restaurantAPI import events
+from restaurantAPI.async_views import AsyncOrderEvents
+from restaurantAPI.management.commands.bench_asgi import HOST, _percentile
+
+
+def _rss_mib():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return None
+
+
+def bench_channel(customer_id):
+    return f'bench-orders:{customer_id}'
+
+
+@contextmanager
+def bench_broker():
+    """
+    Route the order streams to channels of their own on a broker of their own, on a temp EVENTS_DB, so the
+    benchmark's events never reach real customers' streams in this or any other process.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        broker = events.SQLiteBroker(os.path.join(directory, 'events.sqlite3'))
+        previous_broker, previous_channel = events.broker, AsyncOrderEvents.channel
+        events.broker, AsyncOrderEvents.channel = broker, staticmethod(bench_channel)
+        try:
+            yield broker
+        finally:
+            events.broker, AsyncOrderEvents.channel = previous_broker, previous_channel
+            broker.close()
+
+
+class Command(BaseCommand):
+    help = ('Hold many idle /api/orders/events streams open on the ASGI application in this process, then '
+            'push one event to every stream through an SQLiteBroker on a temp file and report the memory and '
+            'threads the streams hold and how long the events take to reach them (no server or network in the '
+            'loop; no real customer is sent anything)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--customers', type=int, default=500,
+                            help='Customers to spread the connections over, by API token')
+        parser.add_argument('--idle', type=float, default=2, help='Seconds to hold the streams idle')
+
+    def handle(self, *args, **options):
+        customers = list(User.objects.filter(groups__name='customer', is_active=True)
+                         .order_by('id')[:options['customers']])
+        if not customers:
+            raise CommandError('No customers; create some first, e.g. with seed_restaurant')
+        tokens = [(customer.id, Token.objects.get_or_create(user=customer)[0].key) for customer in customers]
+        with bench_broker() as broker:
+            result = asyncio.run(self.run(get_asgi_application(), broker, tokens, options))
+
+        for name, value, unit in (
+            ('connections open', result['open'], ''),
+            ('seconds to open', result['open_seconds'], 's'),
+            ('threads per connection', result['threads'] / result['open'], ''),
+            ('RSS per connection', result['rss'] * 1024 / result['open'] if result['rss'] is not None else None, 'KiB'),
+            ('events delivered', result['delivered'], ''),
+            ('delivery p50', result['p50'] * 1000, 'ms'),
+            ('delivery p99', result['p99'] * 1000, 'ms'),
+            ('subscriptions left after disconnect', result['left'], ''),
+        ):
+            shown = 'n/a' if value is None else f'{value:.2f}' if isinstance(value, float) else value
+            self.stdout.write(f'{name:<38} {shown} {unit}'.rstrip())
+
+    async def run(self, application, broker, tokens, options):
+        count = options['connections']
+        loop = asyncio.get_running_loop()
+        disconnect = asyncio.Event()
+        connected, received = [], {}
+
+        async def connection(index, customer_id, token):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': '/api/orders/events', 'raw_path': b'/api/orders/events',
+                'query_string': b'', 'root_path': '', 'client': ('127.0.0.1', 50000), 'server': (HOST, 80),
+                'headers': [(b'host', HOST.encode()), (b'accept', b'text/event-stream'),
+                            (b'authorization', f'Token {token}'.encode())],
+            }
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                body = message.get('body', b'')
+                if body.startswith(b': connected'):
+                    connected.append(index)
+                elif body.startswith(b'id: '):
+                    received[index] = time.perf_counter()
+
+            await application(scope, receive, send)
+
+        threads, rss = threading.active_count(), _rss_mib()
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(connection(index, *tokens[index % len(tokens)])) for index in range(count)]
+        while len(connected) < count and not all(task.done() for task in tasks):
+            await asyncio.sleep(0.05)
+        open_seconds = time.perf_counter() - started
+        await asyncio.sleep(options['idle'])
+        result = {
+            'open': len(connected), 'open_seconds': open_seconds,
+            'threads': threading.active_count() - threads,
+            'rss': _rss_mib() - rss if rss is not None else None,
+        }
+        if not connected:
+            raise CommandError('No stream opened; are the customers in the "customer" group?')
+
+        # Publish from another thread, the way a view does after its transaction commits.
+        published = time.perf_counter()
+        await loop.run_in_executor(None, lambda: [
+            broker.publish(bench_channel(customer_id), 'delivered', '{}') for customer_id, _ in tokens
+        ])
+        deadline = time.monotonic() + 10
+        while len(received) < len(connected) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        latencies = [at - published for at in received.values()] or [0]
+
+        disconnect.set()
+        await asyncio.gather(*tasks)
+        result.update(delivered=len(received), p50=_percentile(latencies, 50), p99=_percentile(latencies, 99),
+                      left=broker.subscriber_count())
+        return result
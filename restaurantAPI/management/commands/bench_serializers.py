@@ -0,0 +1,82 @@
+import datetime
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from auths.users.models import User
+from restaurantAPI.fast_serializers import PROJECTIONS
+from restaurantAPI.models import Category, MenuItem, Cart, Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = ('Serialize --rows menu items, cart rows, orders and order items (created in a transaction that is '
+            'rolled back) with the ModelSerializers and with their projections, and report rows per second. '
+            'Both include fetching the rows; "page" is the projection of already fetched instances, as for '
+            'a paginated list')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per serializer; the fastest is reported')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        self.stdout.write(f"{'serializer':<20} {'model rows/s':>13} {'projection rows/s':>18} {'page rows/s':>12} "
+                          f"{'speedup':>8}")
+        with transaction.atomic():
+            querysets = self.create(rows)
+            for projection in PROJECTIONS.values():
+                serializer_class = projection.serializer_class
+                queryset = querysets[serializer_class.Meta.model]
+                if projection(queryset.all()).data != serializer_class(queryset.all(), many=True).data:
+                    raise CommandError(f'{projection.__name__} does not match {serializer_class.__name__}')
+
+                model = self.best(repeat, lambda: serializer_class(queryset.all(), many=True).data)
+                projected = self.best(repeat, lambda: projection(queryset.all()).data)
+                instances = list(queryset)
+                page = self.best(repeat, lambda: projection(instances).data)
+                self.stdout.write(f'{serializer_class.__name__:<20} {rows / model:>13.0f} {rows / projected:>18.0f} '
+                                  f'{rows / page:>12.0f} {model / projected:>7.1f}x')
+            transaction.set_rollback(True)
+
+    def best(self, repeat, function):
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - started)
+        return min(times)
+
+    def create(self, rows):
+        users = User.objects.bulk_create([User(username=f'bench-serializers-{i}') for i in range(100)])
+        categories = Category.objects.bulk_create([
+            Category(slug=f'bench-{i}', title=f'Bench {i}') for i in range(10)
+        ])
+        items = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Bench item {i}', price=Decimal(i % 500) + Decimal('0.99'), featured=i % 7 == 0,
+                     category=categories[i % 10], rate_count=i % 5, rate_sum=i % 5 * 4)
+            for i in range(rows)
+        ])
+        Cart.objects.bulk_create([
+            Cart(user=users[i % 100], menuitem=item, quantity=2, unit_price=item.price, price=2 * item.price)
+            for i, item in enumerate(items)
+        ])
+        delivered = timezone.now()
+        orders = Order.objects.bulk_create([
+            Order(user=users[i % 100], delivery_crew=users[0] if i % 2 else None, status=i % 2 == 1,
+                  total=items[i].price, date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365),
+                  delivered_time=delivered if i % 2 else None)
+            for i in range(rows)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=item, quantity=1, price=item.price) for order, item in zip(orders, items)
+        ])
+        # The querysets the list views serialize.
+        return {
+            MenuItem: MenuItem.objects.filter(category__in=categories).select_related('category').order_by('id'),
+            Cart: Cart.objects.filter(user__in=users).select_related('menuitem__category').order_by('id'),
+            Order: Order.objects.filter(user__in=users).order_by('id'),
+            OrderItem: OrderItem.objects.filter(order__in=orders).select_related('menuitem__category').order_by('id'),
+        }
@@ -0,0 +1,126 @@
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from copy import deepcopy
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError
+from rest_framework.test import APIClient
+
+from auths.users.models import User, Address
+from restaurantAPI.cache import menu_cache
+from restaurantAPI.dispatch import dispatcher
+from restaurantAPI.models import Category, MenuItem, Cart
+from restaurantAPI.roles import invalidate_groups, invalidate_roles
+
+STOCK = {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {}}
+
+
+class Command(BaseCommand):
+    help = ('Run concurrent checkouts and menu reads against a scratch SQLite database and report throughput '
+            'and "database is locked" errors, with the stock backend and with the tuned DATABASES settings')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('both', 'stock', 'tuned'), default='both')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--write-ratio', type=float, default=0.3,
+                            help='Share of iterations that fill a cart and check out; the rest read the menu')
+        parser.add_argument('--menu-items', type=int, default=200)
+
+    def handle(self, *args, **options):
+        database = connections.settings['default']
+        if 'sqlite3' not in database['ENGINE']:
+            raise CommandError('bench_sqlite compares SQLite backends; the default database is not SQLite')
+        original = deepcopy(database)
+        modes = ('stock', 'tuned') if options['mode'] == 'both' else (options['mode'],)
+        # Views raise straight into the client; don't log every lock error as a server error as well.
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        self.stdout.write(f"{'mode':<6} {'checkouts/s':>12} {'reads/s':>9} {'lock errors':>12} {'other errors':>13}")
+        try:
+            for mode in modes:
+                with tempfile.TemporaryDirectory() as directory:
+                    database_settings = deepcopy(original)
+                    if mode == 'stock':
+                        database_settings.update(deepcopy(STOCK))
+                    database_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+                    self.use_database(database_settings)
+                    if mode == 'stock':
+                        # journal_mode is stored in the file; make sure the stock run isn't in WAL.
+                        connections['default'].cursor().execute('PRAGMA journal_mode = DELETE')
+                    call_command('migrate', verbosity=0, interactive=False)
+                    result = self.run(options)
+                    self.stdout.write(
+                        f"{mode:<6} {result['checkouts'] / options['seconds']:>12.1f} "
+                        f"{result['reads'] / options['seconds']:>9.1f} {result['locked']:>12} {result['errors']:>13}"
+                    )
+                    connections.close_all()
+        finally:
+            self.use_database(original)
+
+    def use_database(self, settings_dict):
+        connections.close_all()
+        database = connections.settings['default']
+        database.clear()
+        database.update(settings_dict)
+        # Wrappers are per thread and keep their backend class; drop this thread's so the next query reconnects.
+        del connections['default']
+        # Forget everything cached from the previous database.
+        dispatcher.reset()
+        invalidate_groups()
+        invalidate_roles()
+        menu_cache.bump()
+
+    def run(self, options):
+        category = Category.objects.create(slug='bench', title='Bench')
+        menu_items = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Bench item {i}', price=1 + i % 20, featured=True, category=category)
+            for i in range(options['menu_items'])
+        ])
+        customers = [User.objects.create_user(username=f'bench-{i}', password=None)
+                     for i in range(options['threads'])]
+        Address.objects.bulk_create([
+            Address(profile=customer.profile, city='Tehran', country='Iran', details='Bench street')
+            for customer in customers
+        ])
+        connections.close_all()
+
+        totals = {'checkouts': 0, 'reads': 0, 'locked': 0, 'errors': 0}
+        lock = threading.Lock()
+        stop_at = time.monotonic() + options['seconds']
+
+        def worker(customer):
+            counts = dict.fromkeys(totals, 0)
+            client = APIClient(HTTP_HOST='localhost')
+            client.force_authenticate(customer)
+            rng = random.Random(customer.pk)
+            while time.monotonic() < stop_at:
+                try:
+                    if rng.random() < options['write_ratio']:
+                        Cart.objects.add_items(customer, [(item, 1) for item in rng.sample(menu_items, 3)])
+                        response = client.post('/api/orders')
+                        kind = 'checkouts'
+                    else:
+                        # A new price bound each time, so the menu cache can't answer it.
+                        response = client.get('/api/menu-items', {'from_price': round(rng.uniform(0, 20), 3)},
+                                              HTTP_ACCEPT='application/json')
+                        kind = 'reads'
+                    counts[kind if response.status_code < 400 else 'errors'] += 1
+                except OperationalError as exc:
+                    counts['locked' if 'locked' in str(exc) else 'errors'] += 1
+            connections.close_all()
+            with lock:
+                for name, count in counts.items():
+                    totals[name] += count
+
+        threads = [threading.Thread(target=worker, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return totals
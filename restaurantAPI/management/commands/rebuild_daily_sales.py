@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from restaurantAPI.models import DailySales, Order
+
+
+class Command(BaseCommand):
+    help = 'Backfill or repair the daily_sales rollup from the orders table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='First day to rebuild (YYYY-MM-DD); defaults to the first order')
+        parser.add_argument('--end-date', help='Last day to rebuild (YYYY-MM-DD); defaults to the last order')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        rollup = DailySales.objects.all()
+        if options['start_date']:
+            orders = orders.filter(date__gte=options['start_date'])
+            rollup = rollup.filter(date__gte=options['start_date'])
+        if options['end_date']:
+            orders = orders.filter(date__lte=options['end_date'])
+            rollup = rollup.filter(date__lte=options['end_date'])
+
+        days = (orders.values('date')
+                .annotate(order_count=Count('id'), revenue=Sum('total'))
+                .order_by('date'))
+
+        with transaction.atomic():
+            rollup.delete()
+            created = DailySales.objects.bulk_create(
+                (DailySales(date=day['date'], order_count=day['order_count'], revenue=day['revenue'])
+                 for day in days.iterator()),
+                batch_size=options['batch_size'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'daily_sales rebuilt for {len(created)} days'))
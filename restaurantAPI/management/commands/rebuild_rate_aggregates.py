@@ -0,0 +1,43 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from ratings.models import Rate
+from restaurantAPI.cache import menu_cache
+from restaurantAPI.models import MenuItem, empty_rate_histogram
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the rating count, sum and histogram stored on every menu item from the rates table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        content_type = ContentType.objects.get_for_model(MenuItem)
+        rows = (Rate.objects.filter(content_type=content_type)
+                .values('object_id', 'rate')
+                .annotate(count=Count('id'))
+                .order_by())
+
+        histograms = defaultdict(empty_rate_histogram)
+        for row in rows:
+            if 1 <= row['rate'] <= 10:
+                histograms[row['object_id']][row['rate'] - 1] += row['count']
+
+        updated = []
+        with transaction.atomic():
+            for item in MenuItem.objects.select_for_update().only('id').order_by('id').iterator():
+                histogram = histograms.get(item.id, empty_rate_histogram())
+                item.rate_histogram = histogram
+                item.rate_count = sum(histogram)
+                item.rate_sum = sum(rate * count for rate, count in enumerate(histogram, start=1))
+                updated.append(item)
+            MenuItem.objects.bulk_update(updated, ['rate_count', 'rate_sum', 'rate_histogram'],
+                                         batch_size=options['batch_size'])
+            transaction.on_commit(menu_cache.bump)
+
+        self.stdout.write(self.style.SUCCESS(f'Rating aggregates rebuilt for {len(updated)} menu items'))
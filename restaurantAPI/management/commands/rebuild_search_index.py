@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurantAPI.search import menu_search
+
+
+class Command(BaseCommand):
+    help = 'Create the FTS5 menu search index if needed and refill it from the menu items'
+
+    def handle(self, *args, **options):
+        if not menu_search.supported():
+            raise CommandError('The database does not support SQLite FTS5; menu search uses icontains instead.')
+        menu_search.create()
+        count = menu_search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Menu search index rebuilt with {count} menu items'))
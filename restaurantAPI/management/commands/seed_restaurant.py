@@ -0,0 +1,245 @@
+import datetime
+import itertools
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from auths.users.models import User, Profile, Address
+from ratings.models import Rate
+from restaurantAPI.models import Category, MenuItem, Cart, Order, OrderItem
+from restaurantAPI.search import menu_search
+
+CATEGORIES = ('Starters', 'Salads', 'Soups', 'Burgers', 'Pizzas', 'Pasta', 'Kebabs', 'Stews', 'Rice dishes',
+              'Sandwiches', 'Seafood', 'Vegetarian', 'Desserts', 'Ice creams', 'Hot drinks', 'Cold drinks')
+ADJECTIVES = ('Classic', 'Spicy', 'Smoked', 'Grilled', 'Crispy', 'Creamy', 'Garden', 'Homemade', 'Saffron',
+              'Royal', 'Lemon', 'Herbed', 'Double', 'Mini', 'Family', 'Chef\'s')
+FIRST_NAMES = ('Ali', 'Sara', 'Reza', 'Maryam', 'Omid', 'Neda', 'Amir', 'Leila', 'Hamid', 'Parisa', 'Kaveh',
+               'Shirin', 'Babak', 'Mina', 'Dariush', 'Roya')
+LAST_NAMES = ('Ahmadi', 'Hosseini', 'Karimi', 'Rahimi', 'Moradi', 'Jafari', 'Rezaei', 'Ghasemi', 'Sadeghi',
+              'Mohammadi', 'Kazemi', 'Nazari')
+CITIES = ('Tehran', 'Shiraz', 'Isfahan', 'Tabriz', 'Mashhad', 'Rasht', 'Yazd', 'Kerman')
+STREETS = ('Azadi', 'Enghelab', 'Valiasr', 'Ferdowsi', 'Hafez', 'Saadi', 'Jomhouri', 'Keshavarz')
+# Orders per hour of the day: a lunch and a dinner peak.
+HOUR_WEIGHTS = (1, 0, 0, 0, 0, 0, 1, 2, 3, 3, 4, 8, 14, 12, 6, 4, 4, 6, 10, 14, 12, 8, 4, 2)
+# Ratings lean positive, as they do on real menus.
+RATE_WEIGHTS = (2, 1, 1, 2, 3, 5, 8, 12, 10, 8)
+ORDER_COLUMNS = ('id', 'user', 'delivery_crew', 'status', 'total', 'customer_address', 'date', 'ordered_time',
+                 'delivered_time')
+ORDER_ITEM_COLUMNS = ('id', 'order', 'menuitem', 'quantity', 'price')
+
+
+def _insert_sql(model, field_names):
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in field_names)
+    return (f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+            f'VALUES ({", ".join(["%s"] * len(field_names))})')
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with synthetic users (customers, delivery crew, managers) with profiles and '
+            'addresses, categories, menu items, carts, orders with their items and ratings. The same --seed '
+            'and --end-date produce the same rows. Rows are written in batches (bulk_create, and executemany for '
+            'orders and their items), so no per-row signals run; the profiles and group memberships those '
+            'signals would add are written directly, and the rollups, the rating aggregates and the search '
+            'index are rebuilt at the end')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--crew', type=int, default=50)
+        parser.add_argument('--managers', type=int, default=5)
+        parser.add_argument('--categories', type=int, default=len(CATEGORIES))
+        parser.add_argument('--menu-items', type=int, default=300)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--max-items-per-order', type=int, default=5)
+        parser.add_argument('--ratings', type=int, default=20000,
+                            help='Upper bound; every rating is from a customer who ordered the item')
+        parser.add_argument('--cart-fraction', type=float, default=0.2,
+                            help='Share of customers left with items in their cart')
+        parser.add_argument('--days', type=int, default=365, help='Orders are spread over this many days')
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat,
+                            help='Day of the newest orders (YYYY-MM-DD); defaults to today')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the generated usernames')
+        parser.add_argument('--password', default='seed-pass', help='Password of every generated user')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['customers'] < 1 or options['menu_items'] < 1 or options['categories'] < 1:
+            raise CommandError('--customers, --menu-items and --categories must be at least 1')
+        if options['days'] < 1 or options['max_items_per_order'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days, --max-items-per-order and --batch-size must be at least 1')
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users named '{options['prefix']}-...' exist already; pass another --prefix")
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.end_date = options['end_date'] or timezone.now().date()
+        self.started = time.monotonic()
+
+        customers, crew = self.create_users()
+        menu = self.create_menu()
+        self.create_carts(customers, menu)
+        rated = self.create_orders(customers, crew, menu)
+        self.create_ratings(rated)
+
+        call_command('rebuild_daily_sales', stdout=self.stdout)
+        call_command('rebuild_rate_aggregates', stdout=self.stdout)
+        if menu_search.supported():
+            call_command('rebuild_search_index', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {time.monotonic() - self.started:.1f}s'))
+
+    def log(self, message):
+        self.stdout.write(f'[{time.monotonic() - self.started:7.1f}s] {message}')
+
+    def create_users(self):
+        """Customers (with one or two addresses each), delivery crew and managers, all sharing one password hash."""
+        rng, options, prefix = self.rng, self.options, self.options['prefix']
+        password = make_password(options['password'])
+        groups = {name: Group.objects.get_or_create(name=name)[0] for name in ('customer', 'delivery', 'manager')}
+        earliest = self.end_date - datetime.timedelta(days=options['days'])
+
+        def user(role, i, **fields):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            joined = datetime.datetime.combine(earliest - datetime.timedelta(days=rng.randrange(365)),
+                                               datetime.time(rng.randrange(24)), tzinfo=datetime.timezone.utc)
+            return User(username=f'{prefix}-{role}-{i}', password=password, first_name=first_name,
+                        last_name=last_name, email=f'{prefix}.{role}.{i}@example.com', date_joined=joined, **fields)
+
+        users = {
+            'customer': [user('customer', i) for i in range(options['customers'])],
+            'delivery': [user('crew', i, ready_to_work=rng.random() < 0.8) for i in range(options['crew'])],
+            'manager': [user('manager', i, is_staff=True, is_superuser=True) for i in range(options['managers'])],
+        }
+        memberships = []
+        with transaction.atomic():
+            for role, role_users in users.items():
+                User.objects.bulk_create(role_users, batch_size=self.batch_size)
+                memberships += [User.groups.through(user_id=u.pk, group_id=groups[role].pk) for u in role_users]
+            User.groups.through.objects.bulk_create(memberships, batch_size=self.batch_size)
+
+            profiles = Profile.objects.bulk_create(
+                [Profile(user=u, phone_number=f'09{rng.randrange(10 ** 9):09d}')
+                 for role_users in users.values() for u in role_users],
+                batch_size=self.batch_size)
+            addresses = {}
+            for profile in profiles[:options['customers']]:
+                addresses[profile.user_id] = [
+                    Address(profile=profile, city=rng.choice(CITIES), country='Iran',
+                            details=f'{rng.choice(STREETS)} St, No. {rng.randint(1, 300)}')
+                    for _ in range(rng.choice((1, 1, 1, 2)))
+                ]
+            Address.objects.bulk_create([a for user_addresses in addresses.values() for a in user_addresses],
+                                        batch_size=self.batch_size)
+
+        customers = [(u.pk, [f'{a.details}, {a.city}, {a.country}' for a in addresses[u.pk]])
+                     for u in users['customer']]
+        self.log(f"{len(profiles)} users ({options['customers']} customers, {options['crew']} crew, "
+                 f"{options['managers']} managers), {len(memberships)} group memberships")
+        return customers, [u.pk for u in users['delivery']]
+
+    def create_menu(self):
+        rng, options = self.rng, self.options
+        names = [CATEGORIES[i % len(CATEGORIES)] + (f' {i // len(CATEGORIES) + 1}' if i >= len(CATEGORIES) else '')
+                 for i in range(options['categories'])]
+        with transaction.atomic():
+            categories = Category.objects.bulk_create(
+                [Category(slug=name.lower().replace(' ', '-'), title=name) for name in names])
+            items = MenuItem.objects.bulk_create([
+                MenuItem(title=f'{rng.choice(ADJECTIVES)} {category.title.lower()} {i + 1}',
+                         price=Decimal(rng.randrange(300, 4000, 25)) / 100, featured=rng.random() < 0.9,
+                         category=category)
+                for i, category in ((i, rng.choice(categories)) for i in range(options['menu_items']))
+            ], batch_size=self.batch_size)
+        self.log(f'{len(categories)} categories, {len(items)} menu items')
+        return [(item.pk, item.price) for item in items if item.featured]
+
+    def create_carts(self, customers, menu):
+        rng = self.rng
+        carts = []
+        for customer_id, _ in customers:
+            if rng.random() >= self.options['cart_fraction']:
+                continue
+            for menuitem_id, unit_price in rng.sample(menu, min(len(menu), rng.randint(1, 4))):
+                quantity = rng.randint(1, 3)
+                carts.append(Cart(user_id=customer_id, menuitem_id=menuitem_id, quantity=quantity,
+                                  unit_price=unit_price, price=unit_price * quantity))
+        Cart.objects.bulk_create(carts, batch_size=self.batch_size)
+        self.log(f'{len(carts)} cart lines')
+
+    def create_orders(self, customers, crew, menu):
+        """
+        Orders in date order (ids grow with time, as they do in production), each with 1 to
+        --max-items-per-order distinct items. Orders from before the end date are delivered; the
+        end date's are mostly still open. Returns (customer, menu item) pairs to rate.
+
+        These are the millions of rows, and bulk_create spends far more time compiling each value than
+        the database spends storing it, so they go through executemany() with ids handed out here.
+        """
+        rng, options = self.rng, self.options
+        count, days = options['orders'], options['days']
+        max_items = min(options['max_items_per_order'], len(menu))
+        first_day = self.end_date - datetime.timedelta(days=days - 1)
+        hours, hour_weights = range(24), list(itertools.accumulate(HOUR_WEIGHTS))
+        ops = connection.ops
+        # Sample rating candidates from the purchases, at a rate that fills --ratings on average.
+        rate_probability = min(1.0, 1.5 * options['ratings'] / max(1, count * (max_items + 1) / 2))
+        rated, item_count = {}, 0
+
+        order_insert = _insert_sql(Order, ORDER_COLUMNS)
+        item_insert = _insert_sql(OrderItem, ORDER_ITEM_COLUMNS)
+        for start in range(0, count, self.batch_size):
+            orders, items = [], []
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Inside the (IMMEDIATE) transaction nobody else can insert, so max(id) + 1 onwards is ours.
+                order_id = (Order.objects.aggregate(last=Max('id'))['last'] or 0)
+                item_id = (OrderItem.objects.aggregate(last=Max('id'))['last'] or 0)
+                for i in range(start, min(start + self.batch_size, count)):
+                    order_id += 1
+                    day = first_day + datetime.timedelta(days=i * days // count)
+                    ordered_time = datetime.datetime.combine(
+                        day, datetime.time(rng.choices(hours, cum_weights=hour_weights)[0], rng.randrange(60),
+                                           rng.randrange(60)),
+                        tzinfo=datetime.timezone.utc)
+                    customer_id, addresses = rng.choice(customers)
+                    delivered = day < self.end_date or rng.random() < 0.3
+                    total = 0
+                    for menuitem_id, unit_price in rng.sample(menu, rng.randint(1, max_items)):
+                        item_id += 1
+                        quantity = rng.choice((1, 1, 1, 2, 2, 3))
+                        total += unit_price * quantity
+                        items.append((item_id, order_id, menuitem_id, quantity,
+                                      ops.adapt_decimalfield_value(unit_price * quantity, 6, 2)))
+                        if len(rated) < options['ratings'] and rng.random() < rate_probability:
+                            rated[customer_id, menuitem_id] = None
+                    delivered_time = ordered_time + datetime.timedelta(minutes=rng.randint(15, 75)) if delivered else None
+                    orders.append((
+                        order_id, customer_id, rng.choice(crew) if crew else None, delivered,
+                        ops.adapt_decimalfield_value(total, 6, 2), rng.choice(addresses),
+                        ops.adapt_datefield_value(day), ops.adapt_datetimefield_value(ordered_time),
+                        ops.adapt_datetimefield_value(delivered_time),
+                    ))
+                cursor.executemany(order_insert, orders)
+                cursor.executemany(item_insert, items)
+            item_count += len(items)
+            self.log(f'{start + len(orders)}/{count} orders, {item_count} order items')
+        return list(rated)[:options['ratings']]
+
+    def create_ratings(self, rated):
+        rng = self.rng
+        content_type = ContentType.objects.get_for_model(MenuItem)
+        Rate.objects.bulk_create([
+            Rate(user_id=user_id, rate=rng.choices(range(1, 11), RATE_WEIGHTS)[0], content_type=content_type,
+                 object_id=menuitem_id)
+            for user_id, menuitem_id in rated
+        ], batch_size=self.batch_size)
+        self.log(f'{len(rated)} ratings')
@@ -0,0 +1,244 @@
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import WSGIServer, WSGIRequestHandler
+from django.db import connections
+from django.http import Http404
+from django.urls import get_resolver, Resolver404
+
+from restaurantAPI import events, metrics
+from restaurantAPI.cache import menu_cache
+from restaurantAPI.dispatch import dispatcher
+from restaurantAPI.roles import get_group
+from restaurantAPI.search import menu_search
+
+logger = logging.getLogger('django.server')
+
+
+def warm_up():
+    """Pay the first-request costs once, in the parent, so every forked worker starts with them done."""
+    for urlconf in filter(None, (settings.ROOT_URLCONF, getattr(settings, 'ASYNC_READ_URLCONF', None))):
+        resolver = get_resolver(urlconf)
+        resolver.reverse_dict
+        try:
+            # A path that matches nothing compiles every pattern on the way.
+            resolver.resolve('/__warm-up__/')
+        except Resolver404:
+            pass
+
+    ContentType.objects.get_for_models(*apps.get_models())
+    for name in ('manager', 'delivery', 'customer'):
+        try:
+            get_group(name)
+        except Http404:
+            pass
+    dispatcher.rebuild()
+    menu_search.available()
+
+
+class PreforkRequestHandler(WSGIRequestHandler):
+    """
+    Django's HTTP/1.1 request handler (access log on the 'django.server' logger) with a socket timeout, so
+    a client that sends nothing, or too slowly, can't hold the worker for longer than `request_timeout`.
+    The server is single-threaded, so every response closes its connection, as gunicorn's sync workers do.
+    """
+
+    def setup(self):
+        self.timeout = self.server.request_timeout
+        super().setup()
+
+    def handle(self):
+        try:
+            super().handle()
+        except TimeoutError:
+            logger.info('- Timed out waiting for %s after %s s', self.client_address[0], self.timeout)
+
+
+class PreforkWSGIServer(WSGIServer):
+    """A WSGI server on a socket that the parent bound and shares with the other workers."""
+    served = 0
+
+    def __init__(self, sock, request_timeout=None):
+        super().__init__(sock.getsockname()[:2], PreforkRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.request_timeout = request_timeout
+        host, self.server_port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.setup_environ()
+
+    def finish_request(self, request, client_address):
+        super().finish_request(request, client_address)
+        self.served += 1
+
+
+class Command(BaseCommand):
+    help = ('Serve the project with a pool of prefork workers: the app is loaded and warmed up once, then '
+            'forked; each worker is replaced after --max-requests requests')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default=getattr(settings, 'SERVE_BIND', '127.0.0.1:8000'),
+                            help='host:port to listen on')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'SERVE_WORKERS', 4))
+        parser.add_argument('--max-requests', type=int, default=getattr(settings, 'SERVE_MAX_REQUESTS', 1000),
+                            help='Requests a worker serves before it is replaced; 0 disables recycling')
+        parser.add_argument('--max-requests-jitter', type=int,
+                            default=getattr(settings, 'SERVE_MAX_REQUESTS_JITTER', 50),
+                            help='Random extra requests per worker, so the workers are not all replaced at once')
+        parser.add_argument('--timeout', type=float, default=getattr(settings, 'SERVE_TIMEOUT', 10),
+                            help='Seconds a WSGI worker waits on a silent client before dropping the connection')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Serve core.asgi with uvicorn in each worker instead (needs uvicorn installed)')
+
+    def handle(self, *args, **options):
+        host, _, port = options['bind'].rpartition(':')
+        if not host or not port.isdigit():
+            raise CommandError(f"--bind must look like host:port, not '{options['bind']}'")
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['workers'] > 1:
+            self.share_events()
+            self.check_shared_state()
+
+        if options['asgi']:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError('--asgi needs uvicorn; install it or serve core.wsgi without --asgi')
+            from core.asgi import application
+            interface, run_worker = 'core.asgi', self.run_asgi_worker
+        else:
+            from core.wsgi import application
+            interface, run_worker = 'core.wsgi', self.run_worker
+        warm_up()
+        # A fresh pool starts its request counters from zero.
+        metrics.clear()
+        # Forked workers must not share the parent's database connections; each opens its own.
+        connections.close_all()
+
+        sock = socket.create_server((host, int(port)), backlog=2048)
+        # Idle workers all wake up for a new connection; the ones that lose the accept() race return to select().
+        sock.setblocking(False)
+        self.stdout.write(f"Serving {interface} on http://{host}:{port} with {options['workers']} workers "
+                          f"(pid {os.getpid()})")
+        self.stdout.flush()
+        self.run_master(sock, application, run_worker, options)
+
+    def share_events(self):
+        """Pass events between the workers through EVENTS_DB, unless EVENTS_BROKER already shares them."""
+        if type(events.broker) is events.InProcessBroker:
+            try:
+                events.broker = events.SQLiteBroker()
+            except ImproperlyConfigured as e:
+                raise CommandError(f'{e} Set it, or serve with --workers 1.')
+
+    def check_shared_state(self):
+        """Refuse per-process state that several workers would get wrong, and warn about what goes stale."""
+        if menu_cache.process_local:
+            if menu_cache.timeout is None:
+                raise CommandError('The menu cache (MENU_CACHE_ALIAS) is per process and MENU_CACHE_TIMEOUT is None, '
+                                   'so a menu change would never reach the other workers; use a shared cache backend, '
+                                   'a timeout, or --workers 1')
+            self.stderr.write(self.style.WARNING(
+                f'The menu cache (MENU_CACHE_ALIAS) is per process: other workers serve menu changes up to '
+                f'{menu_cache.timeout} s late. Use a shared cache backend to invalidate them at once.'))
+
+    def run_master(self, sock, application, run_worker, options):
+        workers = {}
+        stopping = False
+
+        def spawn():
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                try:
+                    run_worker(sock, application, options)
+                    os._exit(0)
+                except BaseException:
+                    traceback.print_exc()
+                    os._exit(1)
+            workers[pid] = time.monotonic()
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for pid in list(workers):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for _ in range(options['workers']):
+            spawn()
+
+        while workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = workers.pop(pid, None)
+            if stopping or started is None:
+                continue
+            if os.waitstatus_to_exitcode(status) != 0 and time.monotonic() - started < 1:
+                # Crashing right after the fork: don't spin, leave the pool one worker short.
+                self.stderr.write(f'Worker {pid} exited with status {status} right after starting')
+                continue
+            spawn()
+        sock.close()
+
+    def max_requests(self, options):
+        max_requests = options['max_requests']
+        if max_requests:
+            max_requests += random.randint(0, max(options['max_requests_jitter'], 0))
+        return max_requests
+
+    def run_worker(self, sock, application, options):
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        max_requests = self.max_requests(options)
+
+        server = PreforkWSGIServer(sock, request_timeout=options['timeout'] or None)
+        server.set_app(application)
+        server.timeout = 1
+        # A request in progress always finishes; SIGTERM and the request limit are only checked between requests.
+        while not stopping and (not max_requests or server.served < max_requests):
+            server.handle_request()
+            # Also runs when handle_request() times out, so an idle worker's last requests still get written.
+            metrics.flush_pending()
+        metrics.flush()
+        connections.close_all()
+        sys.stdout.flush()
+
+    def run_asgi_worker(self, sock, application, options):
+        """
+        uvicorn on the shared socket, with the application the parent imported and warmed up. uvicorn
+        finishes in-flight requests on SIGTERM and returns after its request limit, as run_worker() does.
+        """
+        import uvicorn
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # log_config=None leaves the access log to the project's LOGGING ('uvicorn.access').
+        config = uvicorn.Config(application, lifespan='off', log_config=None,
+                                limit_max_requests=self.max_requests(options) or None)
+        uvicorn.Server(config).run(sockets=[sock])
+        metrics.flush()
+        connections.close_all()
+        sys.stdout.flush()
@@ -0,0 +1,298 @@
+import contextvars
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .cache import cache_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# What the processes that have exited had counted, folded into one file by collect().
+TOTALS_FILE = 'totals.json'
+PROCESS_FILE = re.compile(r'(\d+)-\d+\.json')
+
+_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def metrics_dir():
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        raise ImproperlyConfigured('METRICS_DIR must name a directory for the per-process metrics files.')
+    return directory
+
+
+def count_query(execute, sql, params, many, context):
+    """Execute wrapper, installed on every connection, counting the queries of the request being measured."""
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class ProcessMetrics:
+    """
+    This process's request counters and histograms. Each process writes them to its own file in
+    METRICS_DIR; the metrics endpoint adds all the files up, so prefork workers (and the workers they
+    replaced) are all counted without the processes sharing any memory or touching the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.queries = {}
+        self.written = 0.0
+        self.pending = False
+        # Unique per process even when a pid is reused; a forked worker starts over with a new file.
+        self.filename = f'{os.getpid()}-{time.time_ns()}.json'
+        # Cache counters are process-wide and a forked worker inherits its parent's; report the difference.
+        self.cache_baseline = cache_stats()
+
+    def observe(self, view, method, status, seconds, queries):
+        with self.lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(view, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries.setdefault(view, Histogram(QUERY_BUCKETS)).observe(queries)
+            self.pending = True
+        self.flush_pending()
+
+    def flush_pending(self):
+        """Flush if there is anything new and the last flush is METRICS_FLUSH_INTERVAL seconds old."""
+        if self.pending and time.monotonic() - self.written >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 1):
+            self.flush()
+
+    def snapshot(self):
+        caches = {}
+        for name, stats in cache_stats().items():
+            baseline = self.cache_baseline.get(name, {})
+            caches[name] = {'hits': stats['hits'] - baseline.get('hits', 0),
+                            'misses': stats['misses'] - baseline.get('misses', 0)}
+        with self.lock:
+            return {
+                'requests': [[*key, count] for key, count in self.requests.items()],
+                'latency': {view: [h.counts, h.sum] for view, h in self.latency.items()},
+                'queries': {view: [h.counts, h.sum] for view, h in self.queries.items()},
+                'caches': caches,
+            }
+
+    def flush(self):
+        """Replace this process's file; readers see the old or the new snapshot, never half of one."""
+        self.written = time.monotonic()
+        directory = metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        self.pending = False
+        with self.flush_lock:
+            _write(path, self.snapshot())
+
+
+process_metrics = ProcessMetrics()
+
+
+def reset():
+    """Start this process's metrics over, under a new file."""
+    global process_metrics
+    process_metrics = ProcessMetrics()
+
+
+os.register_at_fork(after_in_child=reset)
+
+
+def observe(view, method, status, seconds, queries):
+    process_metrics.observe(view, method, status, seconds, queries)
+
+
+def flush():
+    process_metrics.flush()
+
+
+def flush_pending():
+    process_metrics.flush_pending()
+
+
+def clear():
+    """Remove every process's file and the totals, e.g. when a server starts a fresh set of workers."""
+    directory = metrics_dir()
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(directory, name))
+
+
+def start_request():
+    return _queries.set([0])
+
+
+def end_request(token):
+    queries = _queries.get()[0]
+    _queries.reset(token)
+    return queries
+
+
+@contextmanager
+def _locked(directory):
+    """Serialises collect() across processes; the writers replace their own files and need no lock."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _exited(pid, name):
+    if pid == os.getpid():
+        # An earlier file of this process (before reset()) or of a process that had the same pid.
+        return name != process_metrics.filename
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        # Removed by clear() since listdir().
+        return None
+
+
+def _write(path, snapshot):
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(snapshot, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def collect():
+    """
+    The snapshots of every process that has written one, this process's brought up to date first. The files
+    of processes that have exited are added to the totals file and removed, so the directory holds one file
+    per live process plus the totals, however many workers have been recycled.
+    """
+    flush()
+    directory = metrics_dir()
+    with _locked(directory):
+        snapshots, exited = [], []
+        for name in sorted(os.listdir(directory)):
+            match = PROCESS_FILE.fullmatch(name)
+            if match is None:
+                continue
+            snapshot = _read(os.path.join(directory, name))
+            if snapshot is None:
+                continue
+            if _exited(int(match.group(1)), name):
+                exited.append((name, snapshot))
+            else:
+                snapshots.append(snapshot)
+
+        totals_path = os.path.join(directory, TOTALS_FILE)
+        totals = _read(totals_path)
+        if exited:
+            totals = _merge(([totals] if totals else []) + [snapshot for _, snapshot in exited])
+            _write(totals_path, totals)
+            for name, _ in exited:
+                os.remove(os.path.join(directory, name))
+    return [totals, *snapshots] if totals else snapshots
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _histogram_lines(name, buckets, per_view):
+    lines = []
+    for view in sorted(per_view):
+        counts, total = per_view[view]
+        cumulative = 0
+        for bound, count in zip((*buckets, '+Inf'), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(view=view, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(view=view)} {total}')
+        lines.append(f'{name}_count{_labels(view=view)} {cumulative}')
+    return lines
+
+
+def _add_histograms(into, histograms):
+    for view, (counts, total) in histograms.items():
+        current = into.setdefault(view, [[0] * len(counts), 0])
+        current[0] = [a + b for a, b in zip(current[0], counts)]
+        current[1] += total
+
+
+def _merge(snapshots):
+    """Several snapshots added up into one, in the same format."""
+    requests, latency, queries, caches = {}, {}, {}, {}
+    for snapshot in snapshots:
+        for view, method, status, count in snapshot['requests']:
+            requests[view, method, status] = requests.get((view, method, status), 0) + count
+        _add_histograms(latency, snapshot['latency'])
+        _add_histograms(queries, snapshot['queries'])
+        for name, stats in snapshot['caches'].items():
+            total = caches.setdefault(name, {'hits': 0, 'misses': 0})
+            total['hits'] += stats['hits']
+            total['misses'] += stats['misses']
+    return {
+        'requests': [[*key, count] for key, count in requests.items()],
+        'latency': latency,
+        'queries': queries,
+        'caches': caches,
+    }
+
+
+def exposition():
+    """All processes' metrics added up, in the Prometheus text exposition format."""
+    merged = _merge(collect())
+    requests = {tuple(key): count for *key, count in merged['requests']}
+    latency, queries, caches = merged['latency'], merged['queries'], merged['caches']
+
+    lines = ['# HELP restaurant_http_requests_total Requests by view class, method and status code.',
+             '# TYPE restaurant_http_requests_total counter']
+    lines += [f'restaurant_http_requests_total{_labels(view=view, method=method, status=status)} {count}'
+              for (view, method, status), count in sorted(requests.items())]
+    lines += ['# HELP restaurant_http_request_duration_seconds Time to a response, by view class.',
+              '# TYPE restaurant_http_request_duration_seconds histogram']
+    lines += _histogram_lines('restaurant_http_request_duration_seconds', LATENCY_BUCKETS, latency)
+    lines += ['# HELP restaurant_db_queries_per_request Database queries run by one request, by view class.',
+              '# TYPE restaurant_db_queries_per_request histogram']
+    lines += _histogram_lines('restaurant_db_queries_per_request', QUERY_BUCKETS, queries)
+    for kind in ('hits', 'misses'):
+        lines += [f'# HELP restaurant_cache_{kind}_total Cache {kind}, by cache.',
+                  f'# TYPE restaurant_cache_{kind}_total counter']
+        lines += [f'restaurant_cache_{kind}_total{_labels(cache=name)} {stats[kind]}'
+                  for name, stats in sorted(caches.items())]
+    lines += ['# HELP restaurant_cache_hit_ratio Hits over lookups since the workers started, by cache.',
+              '# TYPE restaurant_cache_hit_ratio gauge']
+    lines += [f'restaurant_cache_hit_ratio{_labels(cache=name)} '
+              f'{stats["hits"] / (stats["hits"] + stats["misses"]) if stats["hits"] + stats["misses"] else 0}'
+              for name, stats in sorted(caches.items())]
+    return '\n'.join(lines) + '\n'
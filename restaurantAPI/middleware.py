@@ -0,0 +1,128 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+from . import metrics, profiling
+
+
+class HybridMiddleware:
+    """
+    Base for middleware whose hooks never block: under ASGI the hooks run on the event loop, where
+    MiddlewareMixin would hand each of them to the sync thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.process_request(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        return self.process_response(request, await self.get_response(request))
+
+    def process_request(self, request):
+        pass
+
+    def process_response(self, request, response):
+        return response
+
+
+class AsyncReadRoutingMiddleware(HybridMiddleware):
+    """
+    Under ASGI, routes GET/HEAD requests through ASYNC_READ_URLCONF so the hot read endpoints run as
+    native async views. Writes, WSGI requests and browsers asking for HTML keep ROOT_URLCONF.
+    """
+
+    def process_request(self, request):
+        urlconf = getattr(settings, 'ASYNC_READ_URLCONF', None)
+        if (urlconf and isinstance(request, ASGIRequest) and request.method in ('GET', 'HEAD')
+                and 'text/html' not in request.headers.get('Accept', '')):
+            request.urlconf = urlconf
+
+
+class IssuedTokenMiddleware(HybridMiddleware):
+    """Adds the API token picked by CachedBasicAuthentication to the response as X-Auth-Token."""
+
+    def process_response(self, request, response):
+        token_key = getattr(request, 'issued_auth_token', None)
+        if token_key:
+            response['X-Auth-Token'] = token_key
+        return response
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Profiles a PROFILING_SAMPLE_RATE share of requests: query count and time, plus auth, view, serializer
+    and render time, sent back as a Server-Timing header; requests slower than PROFILING_SLOW_REQUEST_MS
+    are logged with their slowest queries. Goes first in MIDDLEWARE so the total covers the others.
+    A streaming response's queries run after it returns and aren't counted.
+    """
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = profiling.start()
+        if profile is None:
+            return self.get_response(request)
+        profiling.attach(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiling.detach(profile)
+            profiling.stop(profile)
+        return profiling.finish(profile, request, response)
+
+    async def __acall__(self, request):
+        profile = profiling.start()
+        if profile is None:
+            return await self.get_response(request)
+        # Sync views and database calls run in the request's thread-sensitive executor; attach there.
+        await sync_to_async(profiling.attach)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(profiling.detach)(profile)
+            profiling.stop(profile)
+        return profiling.finish(profile, request, response)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Records every request's view class, status, latency and query count in restaurantAPI.metrics."""
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token, started = metrics.start_request(), time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            queries = metrics.end_request(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        token, started = metrics.start_request(), time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            queries = metrics.end_request(token)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def record(self, request, response, seconds, queries):
+        match = request.resolver_match
+        if match is None:
+            view = 'unmatched'
+        else:
+            view = getattr(match.func, 'view_class', match.func).__name__
+        metrics.observe(view, request.method, response.status_code, seconds, queries)
@@ -1,6 +1,7 @@
 # from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericRelation
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import F
 from auths.users.models import User
 from ratings.models import Rate
 
@@ -18,6 +19,10 @@ class Category(models.Model):
         return self.title
 
 
+def empty_rate_histogram():
+    return [0] * 10
+
+
 class MenuItem(models.Model):
     title = models.CharField(max_length=255, db_index=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
@@ -25,6 +30,11 @@ class MenuItem(models.Model):
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
     rate = GenericRelation(Rate)
 
+    # Denormalized from `rates`, kept in step by add_rate() and the rebuild_rate_aggregates command.
+    rate_count = models.PositiveIntegerField(default=0, editable=False)
+    rate_sum = models.PositiveIntegerField(default=0, editable=False)
+    rate_histogram = models.JSONField(default=empty_rate_histogram, editable=False)
+
     class Meta:
         db_table = 'menu_items'
         verbose_name = 'menu_item'
@@ -33,6 +43,65 @@ class MenuItem(models.Model):
     def __str__(self):
         return self.title
 
+    @property
+    def rate_average(self):
+        if self.rate_count:
+            return self.rate_sum / self.rate_count
+        return None
+
+    def add_rate(self, rate):
+        """
+        Fold a new rating into the stored aggregates. Call it on a row locked with
+        select_for_update() inside the transaction that saves the Rate.
+        """
+        histogram = list(self.rate_histogram or empty_rate_histogram())
+        histogram[rate - 1] += 1
+        self.rate_histogram = histogram
+        self.rate_count += 1
+        self.rate_sum += rate
+        self.save(update_fields=['rate_count', 'rate_sum', 'rate_histogram'])
+
+
+class CartManager(models.Manager):
+    def add_items(self, user, lines):
+        """
+        Add (menu_item, quantity) lines to the user's cart in one INSERT ... ON CONFLICT DO UPDATE, which
+        increments quantity and price of the lines already in the cart, so concurrent adds of the same item
+        can't lose an update or create a second row. Menu items must be distinct.
+
+        Returns {menuitem_id: Cart} with the resulting rows; a line is new when its quantity is the one added.
+        """
+        if not lines:
+            return {}
+        opts = self.model._meta
+        table = opts.db_table
+        values, params = [], []
+        for menu_item, quantity in lines:
+            values.append('(%s, %s, %s, %s, %s)')
+            params += [user.pk, menu_item.pk, quantity, menu_item.price, quantity * menu_item.price]
+
+        # Django's bulk_create(update_conflicts=True) can only overwrite with the inserted values, not add to them.
+        sql = (
+            f"INSERT INTO {table} (user_id, menuitem_id, quantity, unit_price, price) VALUES {', '.join(values)} "
+            f"ON CONFLICT (user_id, menuitem_id) DO UPDATE SET "
+            f"quantity = {table}.quantity + excluded.quantity, price = {table}.price + excluded.price "
+            f"RETURNING id, menuitem_id, quantity, unit_price, price"
+        )
+        with connections[router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        menu_items = {menu_item.pk: menu_item for menu_item, _ in lines}
+        unit_price, price = opts.get_field('unit_price'), opts.get_field('price')
+        return {
+            menuitem_id: self.model(id=pk, user=user, menuitem=menu_items[menuitem_id], quantity=quantity,
+                                    unit_price=unit_price.to_python(row_unit_price), price=price.to_python(row_price))
+            for pk, menuitem_id, quantity, row_unit_price, row_price in rows
+        }
+
+    def add_item(self, user, menu_item, quantity):
+        return self.add_items(user, [(menu_item, quantity)])[menu_item.pk]
+
 
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -41,8 +110,10 @@ class Cart(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
 
+    objects = CartManager()
+
     class Meta:
-        # unique_together = ('menuitem', 'user')
+        unique_together = ('user', 'menuitem')
         db_table = 'carts'
         verbose_name = 'cart'
         verbose_name_plural = 'carts'
@@ -52,13 +123,25 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     delivery_crew = models.ForeignKey(
         User, on_delete=models.SET_NULL, related_name="delivery_crew", null=True)
-    status = models.BooleanField(default=0, db_index=True)
+    status = models.BooleanField(default=0)
     total = models.DecimalField(max_digits=6, decimal_places=2, default=0)
     customer_address = models.TextField(blank=False, null=False, default='in restaurant')
     date = models.DateField(db_index=True)
+    ordered_time = models.DateTimeField(null=True, blank=True, default=None)
     delivered_time = models.DateTimeField(null=True, blank=True, default=None)
 
     class Meta:
+        indexes = [
+            # A customer's orders by date (order list, order history).
+            models.Index(fields=['user', 'date'], name='orders_user_date_idx'),
+            # A crew member's open orders (dispatcher load counts, delivery list).
+            models.Index(fields=['delivery_crew', 'status'], name='orders_crew_status_idx'),
+            # The undelivered queue and the delivered history, each by date. Partial rather than
+            # (status, date) because the ORM filters booleans as `WHERE status` / `WHERE NOT status`,
+            # which SQLite can't turn into an equality lookup on a status column.
+            models.Index(fields=['date', 'id'], condition=models.Q(status=False), name='orders_open_date_idx'),
+            models.Index(fields=['date', 'id'], condition=models.Q(status=True), name='orders_done_date_idx'),
+        ]
         db_table = 'orders'
         verbose_name = 'order'
         verbose_name_plural = 'orders'
@@ -76,3 +159,26 @@ class OrderItem(models.Model):
         db_table = 'order_items'
         verbose_name = 'order_item'
         verbose_name_plural = 'order_items'
+
+
+class DailySales(models.Model):
+    date = models.DateField(unique=True)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'daily_sales'
+        verbose_name = 'daily_sales'
+        verbose_name_plural = 'daily_sales'
+
+    def __str__(self):
+        return f'{self.date}: {self.order_count} orders, {self.revenue}'
+
+    @classmethod
+    def record_order(cls, date, total):
+        """
+        Add one order to its day. Two statements whatever the state of the table (insert-or-ignore,
+        then increment), so it is safe under concurrent checkouts; run it inside the checkout transaction.
+        """
+        cls.objects.bulk_create([cls(date=date)], ignore_conflicts=True)
+        cls.objects.filter(date=date).update(order_count=F('order_count') + 1, revenue=F('revenue') + total)
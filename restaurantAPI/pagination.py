@@ -0,0 +1,113 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in cursor pagination over a unique ordering such as ('date', 'id').
+
+    The cursor carries the ordering values of the last row sent, so every page is one range
+    query for page_size + 1 rows, with no COUNT(*) and no OFFSET. Requests without a `cursor`
+    or `page_size` parameter keep the unpaginated response.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering):
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip('-') for field in self.ordering)
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.take_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.take_page([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset[:self.page_size + 1]
+
+    def take_page(self, rows):
+        page = rows[:self.page_size]
+        self.next_position = self.position_of(page[-1]) if len(rows) > self.page_size else None
+        return page
+
+    def after(self, position):
+        """Rows strictly after `position` in the ordering, led by a range on the first field so it can use an index."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{self.fields[i]}__{lookup}': position[i]})
+            for name, value in zip(self.fields[:i], position[:i]):
+                clause &= Q(**{name: value})
+            condition |= clause
+
+        first_lookup = 'lte' if self.ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{self.fields[0]}__{first_lookup}': position[0]}) & condition
+
+    def position_of(self, instance):
+        return [getattr(instance, instance._meta.get_field(name).attname) for name in self.fields]
+
+    def encode_cursor(self, position):
+        payload = json.dumps(position, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        """The position in `request`'s cursor, each value converted by its model field; NotFound if it isn't one."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [model._meta.get_field(name).to_python(value) for name, value in zip(self.fields, position)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
@@ -1,6 +1,7 @@
 from rest_framework.permissions import BasePermission, IsAuthenticated
 
 from restaurantAPI.models import OrderItem
+from restaurantAPI.roles import has_role
 
 MANAGER_METHODS = ('POST', 'PUT', 'DELETE')
 SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
@@ -15,12 +16,12 @@ class IsManager(BasePermission):
 class IsDeliveryCrew(BasePermission):
 
     def has_permission(self, request, view):
-        return bool(request.user and request.user.groups.filter(name='delivery'))
+        return bool(request.user and has_role(request.user, 'delivery'))
 
 
 class IsCustomer(BasePermission):
     def has_permission(self, request, view):
-        return bool(request.user and request.user.groups.filter(name='customer'))
+        return bool(request.user and has_role(request.user, 'customer'))
 
 
 class IsCustomerAndHasBoughtItem(BasePermission):
@@ -57,7 +58,7 @@ class IsManagerOrCustomerReadOnly(BasePermission):
             if bool(request.user and
                     request.user.is_staff and
                     request.user.is_superuser and
-                    request.user.groups.filter(name='manager').exists()):
+                    has_role(request.user, 'manager')):
                 return True
             return False
         elif request.method in SAFE_METHODS:
@@ -71,7 +72,7 @@ class IsCustomerOrManagerReadOnly(BasePermission):
     def has_permission(self, request, view):
         if request.method == 'POST':
             if bool(request.user and
-                    request.user.groups.filter(name='customer').exists()):
+                    has_role(request.user, 'customer')):
                 return True
             return False
         elif request.method == 'GET':
@@ -0,0 +1,143 @@
+import contextvars
+import heapq
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('restaurantAPI.profiling')
+
+_current = contextvars.ContextVar('request_profile', default=None)
+_instrumented = False
+
+
+class RequestProfile:
+    """Timings of one sampled request: spans by name, and every query with its duration."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.open_spans = set()
+        self.queries = []
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name):
+    """Add the time spent in the block to `name` on the current request's profile, if it is being profiled."""
+    profile = _current.get()
+    # Nested entries of the same span (a serializer inside a serializer) are counted once.
+    if profile is None or name in profile.open_spans:
+        yield
+        return
+    profile.open_spans.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+        profile.open_spans.discard(name)
+
+
+def _timed(function, name):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return function(*args, **kwargs)
+        with span(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def instrument():
+    """
+    Time DRF's authentication, views, serializers and rendering on profiled requests. Installed once,
+    from AppConfig.ready() when PROFILING_SAMPLE_RATE is set; requests that aren't sampled only pay a
+    ContextVar lookup per wrapped call.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    from rest_framework.response import Response
+    from rest_framework.serializers import BaseSerializer
+    from rest_framework.views import APIView
+
+    APIView.dispatch = _timed(APIView.dispatch, 'view')
+    APIView.perform_authentication = _timed(APIView.perform_authentication, 'auth')
+    BaseSerializer.data = property(_timed(BaseSerializer.data.fget, 'serialize'))
+    Response.rendered_content = property(_timed(Response.rendered_content.fget, 'render'))
+    _instrumented = True
+
+
+def start():
+    """A RequestProfile for this request if it is sampled (PROFILING_SAMPLE_RATE), else None."""
+    rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+    if rate <= 0 or random.random() >= rate:
+        return None
+    profile = RequestProfile()
+    profile.token = _current.set(profile)
+    return profile
+
+
+def attach(profile):
+    """
+    Record the queries of this thread's connections. Connections are per thread, so under ASGI this has
+    to run in the thread the request's sync code (and database access) runs in.
+    """
+    for connection in connections.all():
+        connection.execute_wrappers.append(profile.record_query)
+
+
+def detach(profile):
+    for connection in connections.all():
+        if profile.record_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(profile.record_query)
+
+
+def stop(profile):
+    profile.elapsed = time.perf_counter() - profile.started
+    _current.reset(profile.token)
+
+
+def finish(profile, request, response):
+    """Add the Server-Timing header and log the request if it was slower than PROFILING_SLOW_REQUEST_MS."""
+    db_time = sum(seconds for seconds, _ in profile.queries)
+    timings = [f'total;dur={profile.elapsed * 1000:.2f}',
+               f'db;dur={db_time * 1000:.2f};desc="{len(profile.queries)} queries"']
+    timings += [f'{name};dur={seconds * 1000:.2f}' for name, seconds in profile.spans.items()]
+    response['Server-Timing'] = ', '.join(timings)
+
+    if profile.elapsed * 1000 >= getattr(settings, 'PROFILING_SLOW_REQUEST_MS', 500):
+        match = request.resolver_match
+        view = getattr(match.func, 'view_class', match.func) if match else None
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(view, '__qualname__', None),
+            'status': response.status_code,
+            'total_ms': round(profile.elapsed * 1000, 2),
+            'db_ms': round(db_time * 1000, 2),
+            'queries': len(profile.queries),
+            'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in profile.spans.items()},
+            'slowest_sql': [
+                {'ms': round(seconds * 1000, 2), 'sql': sql}
+                for seconds, sql in heapq.nlargest(getattr(settings, 'PROFILING_SLOWEST_QUERIES', 5),
+                                                   profile.queries, key=lambda query: query[0])
+            ],
+        }
+        logger.warning(json.dumps(record), extra={'profile': record})
+    return response
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.shortcuts import get_object_or_404
+
+from .cache import LRUCache
+
+_role_cache = LRUCache('roles',
+                       maxsize=getattr(settings, 'ROLE_CACHE_MAX_ENTRIES', 10000),
+                       ttl=getattr(settings, 'ROLE_CACHE_TTL', 300))
+
+_group_cache = LRUCache('groups', maxsize=64, ttl=getattr(settings, 'ROLE_CACHE_TTL', 300))
+
+
+def get_roles(user):
+    """
+    Names of the groups ('manager', 'delivery', 'customer') the user belongs to.
+
+    Resolved at most once per request (memoized on the user object DRF attaches to the request)
+    and cached across requests for ROLE_CACHE_TTL seconds, so a warm request runs no group query.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        roles = _role_cache.get(user.pk)
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            _role_cache.set(user.pk, roles)
+        user._roles = roles
+    return roles
+
+
+async def aget_roles(user):
+    """get_roles() for async views."""
+    if not user or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        roles = _role_cache.get(user.pk)
+        if roles is None:
+            roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+            _role_cache.set(user.pk, roles)
+        user._roles = roles
+    return roles
+
+
+def has_role(user, role):
+    return role in get_roles(user)
+
+
+async def ahas_role(user, role):
+    return role in await aget_roles(user)
+
+
+def get_group(name):
+    """The Group called `name` (404 when it is missing), fetched at most once per ROLE_CACHE_TTL."""
+    group = _group_cache.get(name)
+    if group is None:
+        group = get_object_or_404(Group, name=name)
+        _group_cache.set(name, group)
+    return group
+
+
+def invalidate_groups():
+    _group_cache.clear()
+
+
+def invalidate_roles(user_id=None):
+    """Forget the cached roles of one user, or of everyone when user_id is None."""
+    if user_id is None:
+        _role_cache.clear()
+    else:
+        _role_cache.pop(user_id)
@@ -0,0 +1,139 @@
+import re
+
+from django.db import connection, DatabaseError
+from django.db.models.expressions import RawSQL
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def _prefix_query(text):
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    return '(' + ' AND '.join(f'"{token}"*' for token in tokens) + ')'
+
+
+class MenuSearchIndex:
+    """
+    SQLite FTS5 index over menu item titles and their category titles (rowid = menu item id).
+
+    The table is created and filled by the post_migrate receiver, kept in step by the MenuItem and
+    Category signals and can be rebuilt with the rebuild_search_index command. filter() returns
+    None whenever the index can't answer (other database, SQLite built without FTS5, a search term
+    with no word characters), and ListMenuItems falls back to icontains.
+    """
+    table = 'menu_item_search'
+
+    def __init__(self):
+        self._available = None
+
+    def supported(self):
+        if connection.vendor != 'sqlite':
+            return False
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("CREATE VIRTUAL TABLE temp.menu_item_search_probe USING fts5(probe)")
+                cursor.execute("DROP TABLE temp.menu_item_search_probe")
+            except DatabaseError:
+                return False
+        return True
+
+    def available(self):
+        if self._available is None:
+            if not self.supported():
+                self._available = False
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+                    self._available = cursor.fetchone() is not None
+        return self._available
+
+    def create(self):
+        """Create the index if it is missing; returns True when it had to be created."""
+        if not self.supported():
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+            if cursor.fetchone() is not None:
+                return False
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {self.table} USING fts5("
+                f"title, category, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+        self._available = True
+        return True
+
+    def rebuild(self):
+        if not self.available():
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, title, category) "
+                f"SELECT menu_items.id, menu_items.title, categories.title "
+                f"FROM menu_items INNER JOIN categories ON categories.id = menu_items.category_id"
+            )
+            return cursor.rowcount
+
+    def index_item(self, item):
+        if not self.available():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [item.pk])
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, title, category) "
+                f"SELECT %s, %s, title FROM categories WHERE id = %s",
+                [item.pk, item.title, item.category_id]
+            )
+
+    def remove_item(self, item_id):
+        if not self.available():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [item_id])
+
+    def rename_category(self, category):
+        if not self.available():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {self.table} SET category = %s "
+                f"WHERE rowid IN (SELECT id FROM menu_items WHERE category_id = %s)",
+                [category.title, category.pk]
+            )
+
+    def match_expression(self, search, categories):
+        clauses = []
+        if search:
+            title_query = _prefix_query(search)
+            if title_query is None:
+                return None
+            clauses.append(f'(title : {title_query})')
+        if categories:
+            category_queries = [_prefix_query(category) for category in categories]
+            if None in category_queries:
+                return None
+            clauses.append('(category : (' + ' OR '.join(category_queries) + '))')
+        return ' AND '.join(clauses)
+
+    def filter(self, queryset, search, categories):
+        """
+        Restrict `queryset` to the matching menu items with one indexed subquery. When there is a
+        title search the rows are annotated with `search_rank` (bm25, lower is better).
+        """
+        if not self.available():
+            return None
+        expression = self.match_expression(search, categories)
+        if expression is None:
+            return None
+
+        queryset = queryset.filter(pk__in=RawSQL(
+            f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [expression]))
+        if search:
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f"SELECT rank FROM {self.table} WHERE {self.table} MATCH %s AND rowid = menu_items.id",
+                [expression]))
+        return queryset
+
+
+menu_search = MenuSearchIndex()
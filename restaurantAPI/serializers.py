@@ -1,4 +1,3 @@
-from django.db.models import Avg, Count
 from rest_framework import serializers
 
 from auths.users.models import User
@@ -27,11 +26,9 @@ class MenuItemSerializer(serializers.ModelSerializer):
                   ]
 
     def get_rate(self, obj):
-        rate = obj.rate.aggregate(rate_count=Count('rate'), rate_average=Avg('rate'))
-        if rate:
-            return rate
-        else:
-            return 0
+        return {'rate_count': obj.rate_count,
+                'rate_average': obj.rate_average,
+                'rate_histogram': obj.rate_histogram}
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -1,12 +1,104 @@
-from django.db.models.signals import post_save
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, m2m_changed, post_migrate
 from django.dispatch import receiver
+from django.http import Http404
 from django.contrib.auth.models import Group
+from rest_framework.authtoken.models import Token
 from auths.users.models import User
+from ratings.models import Rate
+from .authentication import invalidate_token, invalidate_user_tokens, invalidate_user_credentials
+from .cache import menu_cache
+from .metrics import count_query
+from .models import MenuItem, Category
+from .roles import invalidate_roles, invalidate_groups, get_group
+from .search import menu_search
 
 
 @receiver(post_save, sender=User)
 def assign_to_customer_group(sender, instance, created, **kwargs):
     if created:
         if not instance.groups.exists():
-            customer_group, _ = Group.objects.get_or_create(name='customer')
+            try:
+                customer_group = get_group('customer')
+            except Http404:
+                customer_group, _ = Group.objects.get_or_create(name='customer')
             instance.groups.add(customer_group)
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+def invalidate_menu_cache(sender, **kwargs):
+    # Bump after commit so a concurrent reader can't cache pre-commit rows under the new version.
+    transaction.on_commit(menu_cache.bump)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_cached_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.__dict__.pop('_roles', None)
+        user_ids = [instance.pk]
+    elif pk_set is None:
+        # group.user_set.clear(): the former members are no longer known, forget everyone.
+        invalidate_roles()
+        invalidate_user_tokens()
+        return
+    else:
+        user_ids = pk_set
+    for user_id in user_ids:
+        invalidate_roles(user_id)
+        invalidate_user_tokens(user_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_cached_groups(sender, **kwargs):
+    invalidate_groups()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_tokens(sender, instance, created, **kwargs):
+    # Covers deactivation and any other change to the fields the cached user carries (is_staff, ...).
+    if not created:
+        invalidate_user_tokens(instance.pk)
+        invalidate_user_credentials(instance.pk)
+
+
+@receiver(post_migrate)
+def create_menu_search_index(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name == 'restaurantAPI' and using == DEFAULT_DB_ALIAS and menu_search.create():
+        menu_search.rebuild()
+
+
+@receiver(post_save, sender=MenuItem)
+def index_menu_item(sender, instance, **kwargs):
+    menu_search.index_item(instance)
+
+
+@receiver(post_delete, sender=MenuItem)
+def unindex_menu_item(sender, instance, **kwargs):
+    menu_search.remove_item(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    if not created:
+        menu_search.rename_category(instance)
+
+
+@receiver(connection_created)
+def count_request_queries(sender, connection, **kwargs):
+    # The wrapper object survives reconnects (CONN_MAX_AGE), so only add it once.
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
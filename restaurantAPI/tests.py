@@ -1,3 +1,1565 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime
+import inspect
+import io
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from urllib.parse import urlsplit
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import OuterRef, QuerySet, Sum
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from auths.users.models import User, Address
+from ratings.models import Rate
+from . import analytics, async_views, events, export, fast_serializers, metrics, profiling, urls, views
+from .authentication import CachedTokenAuthentication, invalidate_user_tokens, invalidate_user_credentials, \
+    token_cache_stats
+from .cache import VersionedResponseCache, menu_cache
+from .management.commands.serve import Command as ServeCommand, PreforkWSGIServer
+from .dispatch import dispatcher
+from .models import Category, MenuItem, Cart, Order, OrderItem, DailySales
+from .roles import get_roles, get_group, invalidate_roles, invalidate_groups
+from .search import menu_search
+from .serializers import MenuItemSerializer, CartSerializer, OrderSerializer
+
+
+def setUpModule():
+    # Every request the tests make flushes metrics; keep those files out of the project's METRICS_DIR.
+    directory = tempfile.TemporaryDirectory()
+    settings_override = override_settings(METRICS_DIR=directory.name)
+    settings_override.enable()
+    unittest.addModuleCleanup(directory.cleanup)
+    unittest.addModuleCleanup(settings_override.disable)
+
+
+class RestaurantTestCase(TestCase):
+    def setUp(self):
+        self.reset_caches()
+        for group_name in ('delivery', 'manager', 'customer'):
+            Group.objects.get_or_create(name=group_name)
+
+        self.customer = User.objects.create_user(username='customer', password='customer-pass')
+        Address.objects.create(profile=self.customer.profile, city='Tehran', country='Iran', details='Street 1')
+
+        self.crew = User.objects.create_user(username='crew', password='crew-pass', ready_to_work=True)
+        self.crew.groups.set([Group.objects.get(name='delivery')])
+
+        self.category = Category.objects.create(slug='ice-creams', title='Ice creams')
+        self.menu_items = [
+            MenuItem.objects.create(title=f'Flavour {i}', price=i + 1, featured=True, category=self.category)
+            for i in range(30)
+        ]
+
+        dispatcher.rebuild()
+        self.client = APIClient()
+
+    def reset_caches(self):
+        cache.clear()
+        caches['analytics'].clear()
+        invalidate_roles()
+        invalidate_groups()
+        invalidate_user_tokens()
+        invalidate_user_credentials()
+
+    def fill_cart(self, user, size):
+        Cart.objects.bulk_create([
+            Cart(user=user, menuitem=item, quantity=2, unit_price=item.price, price=2 * item.price)
+            for item in self.menu_items[:size]
+        ])
+
+
+class CheckoutTests(RestaurantTestCase):
+    def test_checkout_moves_cart_into_order(self):
+        self.fill_cart(self.customer, 3)
+        self.client.force_authenticate(self.customer)
+
+        response = self.client.post('/api/orders')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        order = Order.objects.get(user=self.customer)
+        self.assertEqual(order.total, 2 * (1 + 2 + 3))
+        self.assertEqual(order.delivery_crew, self.crew)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+
+    def test_checkout_query_count_does_not_depend_on_cart_size(self):
+        self.client.force_authenticate(self.customer)
+        get_roles(self.customer)
+        for size in (1, 30):
+            with self.subTest(cart_size=size):
+                self.fill_cart(self.customer, size)
+                with self.assertNumQueries(12), self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post('/api/orders')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(OrderItem.objects.filter(order_id=response.data['id']).count(), size)
+
+    def test_checkout_updates_daily_sales(self):
+        self.client.force_authenticate(self.customer)
+        for size in (1, 2):
+            self.fill_cart(self.customer, size)
+            self.client.post('/api/orders')
+
+        day = DailySales.objects.get()
+        self.assertEqual((day.order_count, day.revenue), (2, 2 + (2 + 4)))
+
+        DailySales.objects.all().delete()
+        call_command('rebuild_daily_sales', stdout=mock.Mock())
+        self.assertEqual(DailySales.objects.get().order_count, 2)
+
+    def test_failed_checkout_leaves_cart_untouched(self):
+        self.fill_cart(self.customer, 3)
+        self.client.force_authenticate(self.customer)
+
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/api/orders')
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 3)
+
+
+class CartTests(RestaurantTestCase):
+    def add(self, menu_item, quantity):
+        return self.client.post('/api/cart/menu-items', {'menuitem': menu_item.id, 'quantity': quantity}, format='json')
+
+    def test_repeated_add_increments_one_line(self):
+        self.client.force_authenticate(self.customer)
+        get_roles(self.customer)
+        menu_item = self.menu_items[2]
+
+        with self.assertNumQueries(2):
+            first = self.add(menu_item, 2)
+        second = self.add(menu_item, 3)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual((second.data['item']['quantity'], second.data['item']['price']), (5, '15.00'))
+        line = Cart.objects.get(user=self.customer)
+        self.assertEqual((line.quantity, line.price), (5, 15))
+
+    def test_rejects_non_positive_quantity(self):
+        self.client.force_authenticate(self.customer)
+
+        self.assertEqual(self.add(self.menu_items[0], 0).status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_batch_add(self):
+        self.client.force_authenticate(self.customer)
+        get_roles(self.customer)
+        self.add(self.menu_items[0], 1)
+        self.menu_items[1].featured = False
+        self.menu_items[1].save()
+        lines = [{'menuitem': item.id, 'quantity': 1} for item in self.menu_items] + [
+            {'menuitem': self.menu_items[2].id, 'quantity': 2}, {'menuitem': 0, 'quantity': 1}, {'quantity': 1}]
+
+        with self.assertNumQueries(4):
+            response = self.client.post('/api/cart/menu-items/batch', lines, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        statuses = [result['status'] for result in response.data]
+        self.assertEqual(statuses[:3], ['updated', 'error', 'created'])
+        self.assertEqual(statuses[-2:], ['error', 'error'])
+        self.assertEqual(response.data[2]['item']['quantity'], 3)
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 29)
+
+
+class RatingTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other', password='customer-pass')
+        for user in (self.customer, self.other):
+            order = Order.objects.create(user=user, date='2024-05-01')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menuitem=item, quantity=1, price=item.price) for item in self.menu_items[:2]
+            ])
+
+    def rate(self, user, item, rate):
+        self.client.force_authenticate(user)
+        return self.client.post(f'/api/rate/{item.id}', {'rate': rate}, format='json')
+
+    def aggregates(self, item):
+        item.refresh_from_db()
+        return item.rate_count, item.rate_sum, item.rate_histogram
+
+    def test_rating_updates_aggregates(self):
+        item = self.menu_items[0]
+        self.assertEqual(self.rate(self.customer, item, 9).status_code, 201)
+        self.assertEqual(self.rate(self.other, item, 4).status_code, 201)
+
+        self.assertEqual(self.aggregates(item), (2, 13, [0, 0, 0, 1, 0, 0, 0, 0, 1, 0]))
+        self.assertEqual(self.client.get(f'/api/rate/{item.id}').data['rate']['rate_average'], 6.5)
+
+    def test_rating_again_is_refused_and_not_counted(self):
+        item = self.menu_items[0]
+        self.assertEqual(self.rate(self.customer, item, 9).status_code, 201)
+        response = self.rate(self.customer, item, 3)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(list(Rate.objects.values_list('user', 'rate')), [(self.customer.id, 9)])
+        self.assertEqual(self.aggregates(item), (1, 9, [0, 0, 0, 0, 0, 0, 0, 0, 1, 0]))
+
+    def test_invalid_rating_changes_nothing(self):
+        item = self.menu_items[0]
+        self.rate(self.customer, item, 9)
+        self.assertEqual(self.rate(self.customer, item, 11).status_code, 400)
+        self.assertEqual(self.aggregates(item), (1, 9, [0, 0, 0, 0, 0, 0, 0, 0, 1, 0]))
+
+    def test_from_rate_filters_on_stored_aggregates(self):
+        first, second = self.menu_items[:2]
+        self.rate(self.customer, first, 9)
+        self.rate(self.other, first, 4)
+        self.rate(self.customer, second, 8)
+
+        self.client.force_authenticate(self.customer)
+        for from_rate, expected in (('7', [second.id]), ('6.5', [first.id, second.id]), ('9', [])):
+            with self.subTest(from_rate=from_rate), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/api/menu-items?from_rate={from_rate}')
+                self.assertEqual(sorted(item['id'] for item in response.data), expected)
+                self.assertFalse([query['sql'] for query in queries if '"rates"' in query['sql']])
+
+    def test_rebuild_rate_aggregates_reproduces_them(self):
+        first, second = self.menu_items[:2]
+        self.rate(self.customer, first, 9)
+        self.rate(self.other, first, 4)
+        self.rate(self.customer, first, 2)
+        self.rate(self.customer, second, 8)
+        expected = {item.id: self.aggregates(item) for item in self.menu_items}
+
+        MenuItem.objects.update(rate_count=0, rate_sum=0, rate_histogram=[0] * 10)
+        call_command('rebuild_rate_aggregates', stdout=io.StringIO())
+
+        self.assertEqual({item.id: self.aggregates(item) for item in self.menu_items}, expected)
+        self.assertEqual(expected[first.id], (2, 13, [0, 0, 0, 1, 0, 0, 0, 0, 1, 0]))
+
+
+class MenuCacheTests(RestaurantTestCase):
+    def test_entry_built_before_a_write_is_not_served_after_it(self):
+        key = menu_cache.key('menu-items', None, ())
+        stale = [{'title': 'old'}]
+        # A write commits (and bumps the version) while the reader is still building its response.
+        menu_cache.bump()
+        menu_cache.set(key, stale)
+
+        self.assertIsNone(menu_cache.get(menu_cache.key('menu-items', None, ())))
+
+    async def test_async_api_goes_through_a_shared_backend(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+                **settings.CACHES, 'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                             'LOCATION': directory}}):
+            shared = VersionedResponseCache('shared-menu', alias='shared')
+            self.assertFalse(shared.process_local)
+            key = await shared.akey('menu-items', None, ())
+            self.assertIsNone(await shared.aget(key))
+            await shared.aset(key, [{'title': 'Vanilla'}])
+
+            self.assertEqual(await shared.aget(await shared.akey('menu-items', None, ())), [{'title': 'Vanilla'}])
+            await sync_to_async(shared.bump)()
+            self.assertIsNone(await shared.aget(await shared.akey('menu-items', None, ())))
+
+    def assertCache(self, path, expected):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], expected, path)
+        return response
+
+    def test_reads_hit_until_a_menu_write_commits(self):
+        self.client.force_authenticate(self.customer)
+        item = self.menu_items[0]
+        writes = (
+            lambda: MenuItem.objects.filter(pk=item.pk).get().save(),
+            lambda: Category.objects.create(slug='cakes', title='Cakes'),
+            lambda: Category.objects.get(slug='cakes').delete(),
+            lambda: item.delete(),
+        )
+        for write in writes:
+            for path in ('/api/menu-items', '/api/menu-items?featured=1', '/api/category'):
+                self.assertCache(path, 'MISS')
+                self.assertCache(path, 'HIT')
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+
+        self.assertNotIn(item.pk, [row['id'] for row in self.assertCache('/api/menu-items', 'MISS').data])
+        self.assertEqual([row['slug'] for row in self.assertCache('/api/category', 'MISS').data], ['ice-creams'])
+
+    def test_equivalent_queries_share_an_entry(self):
+        self.client.force_authenticate(self.customer)
+        self.assertCache('/api/menu-items?category=a&category=b&from_price=1', 'MISS')
+        self.assertCache('/api/menu-items?category=b&category=a&category=a&from_price=1.0', 'HIT')
+
+
+class MenuSearchTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cakes = Category.objects.create(slug='cakes', title='Cakes')
+        bars = Category.objects.create(slug='bars', title='Bars')
+        cookies = Category.objects.create(slug='cookies', title='Cookies')
+        for title, category in (('Chocolate layer cake with sea salt', self.cakes), ('Vanilla cake', self.cakes),
+                                ('Dark chocolate', bars), ('Crème brûlée', self.cakes), ('Oatmeal cookie', cookies)):
+            MenuItem.objects.create(title=title, price=5, featured=False, category=category)
+
+    def titles(self, query):
+        queryset = views.filter_menu_items(MenuItem.objects.all(), QueryDict(query))
+        return list(views.order_menu_items(queryset).values_list('title', flat=True))
+
+    def test_index_matches_word_prefixes(self):
+        self.assertTrue(menu_search.available())
+        self.assertEqual(set(self.titles('search=choc')), {'Chocolate layer cake with sea salt', 'Dark chocolate'})
+        self.assertEqual(self.titles('search=cake+choc'), ['Chocolate layer cake with sea salt'])
+        self.assertEqual(self.titles('search=creme'), ['Crème brûlée'])
+        self.assertEqual(set(self.titles('category=bar&category=cook')), {'Dark chocolate', 'Oatmeal cookie'})
+        self.assertEqual(self.titles('search=choc&category=cake'), ['Chocolate layer cake with sea salt'])
+        # Prefixes only: a word is not matched from its middle.
+        self.assertEqual(self.titles('search=late'), [])
+
+    def test_title_matches_are_ordered_by_relevance(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.get('/api/menu-items?search=chocolate')
+
+        # bm25 ranks the shorter title first, although its category and id would put it last.
+        self.assertEqual([item['title'] for item in response.data],
+                         ['Dark chocolate', 'Chocolate layer cake with sea salt'])
+
+    def test_icontains_fallback_without_fts5(self):
+        with mock.patch.object(menu_search, '_available', False):
+            self.assertEqual(set(self.titles('search=late')),
+                             {'Chocolate layer cake with sea salt', 'Dark chocolate'})
+            self.assertEqual(self.titles('search=vanilla&category=akes'), ['Vanilla cake'])
+
+    def test_index_follows_menu_changes(self):
+        item = MenuItem.objects.get(title='Vanilla cake')
+        item.title = 'Strawberry cake'
+        item.save()
+        MenuItem.objects.get(title='Dark chocolate').delete()
+        self.cakes.title = 'Tarts'
+        self.cakes.save()
+
+        self.assertEqual(self.titles('search=vanilla'), [])
+        self.assertEqual(self.titles('search=straw'), ['Strawberry cake'])
+        self.assertEqual(self.titles('search=dark'), [])
+        self.assertEqual(set(self.titles('category=tart')),
+                         {'Strawberry cake', 'Chocolate layer cake with sea salt', 'Crème brûlée'})
+
+    def test_rebuild_command_refills_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {menu_search.table}')
+        self.assertEqual(self.titles('search=vanilla'), [])
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+
+        self.assertIn(f'{MenuItem.objects.count()} menu items', out.getvalue())
+        self.assertEqual(self.titles('search=vanilla'), ['Vanilla cake'])
+
+
+class SalesAnalyticsTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_superuser(username='manager', password='manager-pass')
+        for day in ('2024-05-01', '2024-05-02'):
+            order = Order.objects.create(user=self.customer, date=day, ordered_time=f'{day}T12:30:00Z')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menuitem=item, quantity=2, price=2 * item.price)
+                for item in self.menu_items[:3]
+            ])
+        self.client.force_authenticate(self.manager)
+
+    def test_breakdown_by_item_category_and_hour(self):
+        response = self.client.get('/api/sale/analytics?start_date=2024-05-01&end_date=2024-05-02&top=2')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([(row['id'], row['quantity'], row['revenue']) for row in response.data['menu_items']],
+                         [(self.menu_items[2].id, 4, '12.00'), (self.menu_items[1].id, 4, '8.00')])
+        self.assertEqual(response.data['categories'][0]['revenue'], '24.00')
+        self.assertEqual(sum(row['quantity'] for row in response.data['hours']), 12)
+
+    def test_closed_days_are_served_from_cache(self):
+        path = '/api/sale/analytics?start_date=2024-05-01&end_date=2024-05-02'
+        first = self.client.get(path)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(path)
+
+        self.assertEqual(first.data, second.data)
+        self.assertFalse([query for query in queries if 'order_items' in query['sql']])
+
+    def test_only_uncached_days_are_queried(self):
+        self.client.get('/api/sale/analytics?start_date=2024-05-02&end_date=2024-05-02')
+        with mock.patch.object(analytics, '_query_days', wraps=analytics._query_days) as query_days:
+            response = self.client.get('/api/sale/analytics?start_date=2024-05-01&end_date=2024-05-03')
+
+        self.assertEqual(response.data['categories'][0]['revenue'], '24.00')
+        query_days.assert_called_once_with([datetime.date(2024, 5, 1), datetime.date(2024, 5, 3)])
+
+    def test_cached_days_do_not_share_the_menu_cache(self):
+        path = '/api/sale/analytics?start_date=2024-05-01&end_date=2024-05-02'
+        self.client.get(path)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(path)
+
+        self.assertFalse([query for query in queries if 'order_items' in query['sql']])
+
+    @override_settings(ANALYTICS_CACHE_TIMEOUT=60)
+    def test_cached_days_expire(self):
+        path = '/api/sale/analytics?start_date=2024-05-01&end_date=2024-05-02'
+        self.client.get(path)
+        with mock.patch('time.time', return_value=time.time() + 61), \
+                CaptureQueriesContext(connection) as queries:
+            self.client.get(path)
+
+        self.assertTrue([query for query in queries if 'order_items' in query['sql']])
+
+    def test_rejects_reversed_range(self):
+        response = self.client.get('/api/sale/analytics?start_date=2024-05-02&end_date=2024-05-01')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderExportTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(User.objects.create_superuser(username='manager', password='manager-pass'))
+        for day, delivered in (('2024-05-01', True), ('2024-05-02', False), ('2024-05-03', False)):
+            order = Order.objects.create(user=self.customer, date=day, status=delivered)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menuitem=item, quantity=1, price=item.price) for item in self.menu_items[:2]
+            ])
+
+    def test_csv_has_one_row_per_order_item(self):
+        response = self.client.get('/api/orders/export?start_date=2024-05-02&status=false')
+
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['order_id', 'user_id'])
+        self.assertEqual(len(lines), 1 + 2 * 2)
+
+    def test_csv_cells_are_not_read_as_formulas(self):
+        Order.objects.filter(date='2024-05-01').update(customer_address='=HYPERLINK("http://example.com")')
+        response = self.client.get('/api/orders/export?status=true')
+
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual({row['customer_address'] for row in rows}, {'\'=HYPERLINK("http://example.com")'})
+
+    @override_settings(ORDER_EXPORT_CHUNK_SIZE=1)
+    async def test_asgi_export_streams_in_batches(self):
+        manager = await User.objects.aget(username='manager')
+        token, _ = await Token.objects.aget_or_create(user=manager)
+        with mock.patch.object(views, 'aiter_rows', wraps=export.aiter_rows) as aiter_rows:
+            response = await self.async_client.get('/api/orders/export?output=ndjson',
+                                                   headers={'Authorization': f'Token {token.key}'})
+            lines = ''.join([chunk.decode() async for chunk in response.streaming_content]).splitlines()
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(aiter_rows.call_count, 1)
+        self.assertEqual([len(json.loads(line)['items']) for line in lines], [2, 2, 2])
+
+    @override_settings(ORDER_EXPORT_CHUNK_SIZE=2)
+    def test_ndjson_queries_per_chunk(self):
+        response = self.client.get('/api/orders/export?output=ndjson')
+        with CaptureQueriesContext(connection) as queries:
+            lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual([len(json.loads(line)['items']) for line in lines], [2, 2, 2])
+        # One orders query, then one item prefetch per chunk of two orders.
+        self.assertEqual(len(queries), 1 + 2)
+
+
+class KeysetPaginationTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_superuser(username='manager', password='manager-pass')
+        self.manager.groups.add(Group.objects.get(name='manager'))
+        other = User.objects.create_user(username='other', password='customer-pass')
+        # Several orders per day and per customer, so every ordering field has ties.
+        for i in range(11):
+            Order.objects.create(user=(self.customer, other)[i % 2], date=f'2024-05-0{1 + i % 3}')
+
+    def walk(self, path, page_size):
+        ids, url = [], f'{path}?page_size={page_size}'
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(response.data['results']), page_size)
+                ids += [order['id'] for order in response.data['results']]
+                url = response.data['next']
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()])
+        return ids
+
+    def test_pages_cover_every_row_once_in_order(self):
+        for user, path, orders in ((self.customer, '/api/orderhistory', self.customer.order_set.order_by('date', 'id')),
+                                   (self.manager, '/api/orders', Order.objects.order_by('-date', 'user', 'id')),
+                                   (self.manager, '/api/undelivered', Order.objects.order_by('date', 'id'))):
+            self.client.force_authenticate(user)
+            expected = list(orders.values_list('id', flat=True))
+            for page_size in (1, 3, len(expected)):
+                with self.subTest(path=path, page_size=page_size):
+                    self.assertEqual(self.walk(path, page_size), expected)
+
+    def test_bad_cursors_are_rejected(self):
+        self.client.force_authenticate(self.manager)
+        for position in ('["abc", 1, 1]', '["2024-05-01", "x", 1]', '["2024-05-01", 1]', '[null, 1, 1]',
+                         '["2024-05-01", [1], 1]', '{"date": "2024-05-01"}'):
+            cursor = base64.urlsafe_b64encode(position.encode()).decode()
+            with self.subTest(position=position):
+                self.assertEqual(self.client.get(f'/api/orders?cursor={cursor}').status_code, 404)
+        self.assertEqual(self.client.get('/api/orders?cursor=not-base64!').status_code, 404)
+
+
+class DispatcherTests(RestaurantTestCase):
+    def test_checkout_goes_to_least_loaded_crew(self):
+        busy_crew = self.crew
+        idle_crew = User.objects.create_user(username='idle-crew', password='crew-pass', ready_to_work=True)
+        idle_crew.groups.set([Group.objects.get(name='delivery')])
+        Order.objects.create(user=self.customer, delivery_crew=busy_crew, date='2024-05-01')
+        dispatcher.rebuild()
+
+        self.fill_cart(self.customer, 1)
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/orders')
+
+        self.assertEqual(response.data['delivery_crew'], idle_crew.id)
+
+    def test_order_is_queued_until_crew_is_ready(self):
+        self.crew.ready_to_work = False
+        self.crew.save()
+        dispatcher.rebuild()
+
+        self.fill_cart(self.customer, 1)
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['delivery_crew'])
+
+        self.client.force_authenticate(self.crew)
+        self.client.post('/api/deliverystatus')
+
+        self.assertEqual(Order.objects.get(pk=response.data['id']).delivery_crew, self.crew)
+
+    def checkout(self):
+        self.fill_cart(self.customer, 1)
+        self.client.force_authenticate(self.customer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 200)
+        return response.data['delivery_crew']
+
+    def test_checkout_skips_crew_changed_by_another_process(self):
+        # Changes made without this process's dispatcher hearing about them.
+        off_duty = User.objects.create_user(username='off-duty', password='crew-pass', ready_to_work=True)
+        removed = User.objects.create_user(username='removed', password='crew-pass', ready_to_work=True)
+        for user in (off_duty, removed):
+            user.groups.set([Group.objects.get(name='delivery')])
+        Order.objects.create(user=self.customer, delivery_crew=self.crew, date='2024-05-01')
+        dispatcher.rebuild()
+        User.objects.filter(pk=off_duty.pk).update(ready_to_work=False)
+        User.groups.through.objects.filter(user=removed).delete()
+
+        self.assertEqual(self.checkout(), self.crew.id)
+        self.assertNotIn(off_duty.id, dispatcher._load)
+        self.assertNotIn(removed.id, dispatcher._load)
+
+    def test_checkout_sees_load_added_by_another_process(self):
+        idle_crew = User.objects.create_user(username='idle-crew', password='crew-pass', ready_to_work=True)
+        idle_crew.groups.set([Group.objects.get(name='delivery')])
+        dispatcher.rebuild()
+        busy_crew = min((self.crew, idle_crew), key=lambda crew: (dispatcher._load[crew.id], crew.id))
+        Order.objects.bulk_create([Order(user=self.customer, delivery_crew=busy_crew, date='2024-05-01')] * 2)
+
+        self.assertNotEqual(self.checkout(), busy_crew.id)
+        self.assertEqual(dispatcher._load[busy_crew.id], 2)
+
+    def test_rolled_back_checkout_adds_no_load(self):
+        dispatcher.rebuild()
+        self.fill_cart(self.customer, 1)
+        self.client.force_authenticate(self.customer)
+
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError), self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/orders')
+
+        self.assertEqual(dispatcher._load[self.crew.id], 0)
+        Cart.objects.filter(user=self.customer).delete()
+        self.assertEqual(self.checkout(), self.crew.id)
+        self.assertEqual(dispatcher._load[self.crew.id], 1)
+
+    def test_drain_counts_only_orders_it_assigned(self):
+        other_crew = User.objects.create_user(username='other-crew', password='crew-pass')
+        queued = [Order.objects.create(user=self.customer, date=f'2024-05-0{day}') for day in (1, 2, 3)]
+        update = QuerySet.update
+
+        def taken_by_another_process(queryset, **kwargs):
+            update(Order.objects.filter(pk=queued[0].pk), delivery_crew_id=other_crew.id)
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=taken_by_another_process), \
+                self.captureOnCommitCallbacks(execute=True):
+            assignments = dispatcher.drain_queue()
+
+        self.assertEqual(assignments, {self.crew.id: [queued[1].pk, queued[2].pk]})
+        self.assertEqual(dispatcher._load[self.crew.id], 2)
+
+
+    def test_drain_fills_nobody_past_the_limit(self):
+        queued = [Order.objects.create(user=self.customer, date='2024-05-01') for _ in range(5)]
+        Order.objects.create(user=self.customer, delivery_crew=self.crew, date='2024-04-30')
+
+        with mock.patch.object(dispatcher, 'drain_max_open_orders', 3):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(dispatcher.drain_queue(), {self.crew.id: [queued[0].pk, queued[1].pk]})
+            # Delivering an order makes room for the next queued one.
+            self.client.force_authenticate(self.crew)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/delivery/{queued[0].pk}')
+
+        self.assertEqual(Order.objects.get(pk=queued[2].pk).delivery_crew, self.crew)
+        self.assertEqual(Order.objects.filter(delivery_crew__isnull=True).count(), 2)
+        self.assertEqual(dispatcher._load[self.crew.id], 3)
+
+    def test_crew_added_to_the_group_is_told_about_queued_orders(self):
+        new_crew = User.objects.create_user(username='new-crew', password='crew-pass', ready_to_work=True)
+        queued = Order.objects.create(user=self.customer, date='2024-05-01')
+        self.crew.ready_to_work = False
+        self.crew.save()
+        dispatcher.rebuild()
+
+        manager = User.objects.create_superuser(username='manager', password='manager-pass')
+        manager.groups.add(Group.objects.get(name='manager'))
+        self.client.force_authenticate(manager)
+        with mock.patch.object(events, 'publish_on_commit') as publish:
+            self.client.post('/api/groups/delivery-crew/users', {'username': 'new-crew'})
+
+        self.assertEqual(Order.objects.get(pk=queued.pk).delivery_crew, new_crew)
+        self.assertEqual({(args[0], args[1], args[2]['id']) for args, _ in publish.call_args_list},
+                         {(events.delivery_channel(new_crew.id), 'assigned', queued.pk),
+                          (events.orders_channel(self.customer.id), 'assigned', queued.pk)})
+
+
+class RoleCacheTests(RestaurantTestCase):
+    def get_as(self, user_id, path):
+        # A fresh user instance per request, as the authentication classes produce.
+        self.client.force_authenticate(User.objects.get(pk=user_id))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response, [query['sql'] for query in queries if 'auth_group' in query['sql']]
+
+    def test_warm_request_runs_no_group_query(self):
+        _, cold_queries = self.get_as(self.customer.id, '/api/orders')
+        _, warm_queries = self.get_as(self.customer.id, '/api/orders')
+
+        self.assertTrue(cold_queries)
+        self.assertEqual(warm_queries, [])
+
+    def test_group_lookup_is_cached_until_groups_change(self):
+        manager = get_group('manager')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_group('manager'), manager)
+
+        Group.objects.filter(pk=manager.pk).delete()
+        Group.objects.create(name='manager')
+        self.assertNotEqual(get_group('manager'), manager)
+
+    def test_group_change_invalidates_roles(self):
+        response, _ = self.get_as(self.crew.id, '/api/delivery')
+        self.assertEqual(response.status_code, 200)
+
+        self.crew.groups.clear()
+        response, _ = self.get_as(self.crew.id, '/api/delivery')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class TokenAuthenticationTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.customer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_repeated_requests_skip_the_token_query(self):
+        self.client.get('/api/orders')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/orders')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'authtoken_token' in query['sql']])
+        self.assertGreaterEqual(token_cache_stats()['hits'], 1)
+
+    def test_cached_user_shares_no_related_objects_between_requests(self):
+        authentication = CachedTokenAuthentication()
+        first, _ = authentication.authenticate_credentials(self.token.key)
+        first.profile.city = 'changed in one request'
+        second, _ = authentication.authenticate_credentials(self.token.key)
+
+        self.assertIsNot(second, first)
+        self.assertFalse(second._state.fields_cache)
+        self.assertNotEqual(getattr(second.profile, 'city', None), 'changed in one request')
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get('/api/orders')
+        self.token.delete()
+
+        self.assertEqual(self.client.get('/api/orders').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/orders')
+        self.customer.is_active = False
+        self.customer.save()
+
+        self.assertEqual(self.client.get('/api/orders').status_code, 401)
+
+
+class AsyncReadViewTests(RestaurantTestCase):
+    paths = ('/api/menu-items', '/api/menu-items?search=flav&to_price=5', '/api/menu-items/999', '/api/category',
+             '/api/cart/menu-items', '/api/orders', '/api/orders?page_size=1')
+
+    def setUp(self):
+        super().setUp()
+        self.fill_cart(self.customer, 3)
+        for day in ('2024-05-01', '2024-05-02'):
+            Order.objects.create(user=self.customer, date=day)
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.customer).key}'}
+        self.crew_headers = {'Authorization': f'Token {Token.objects.create(user=self.crew).key}'}
+
+    async def test_async_views_match_sync_views(self):
+        for headers in (self.headers, self.crew_headers):
+            for path in self.paths:
+                with self.subTest(path=path, headers=headers):
+                    async_response = await self.async_client.get(path, headers=headers)
+                    sync_response = await sync_to_async(self.client.get)(path, headers=headers)
+
+                    self.assertEqual(async_response.resolver_match.func.view_class.__module__,
+                                     async_views.__name__)
+                    self.assertEqual(async_response.status_code, sync_response.status_code)
+                    self.assertEqual(json.loads(async_response.content), json.loads(sync_response.content))
+
+    async def test_async_views_require_authentication(self):
+        response = await self.async_client.get('/api/orders')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+
+class QueryPlanTests(RestaurantTestCase):
+    """
+    Every SELECT an endpoint runs must reach its table through an index. Scanning a partial index is
+    allowed (it only holds the rows asked for); endpoints that list a whole table on purpose (menu,
+    categories, all orders unpaginated) are left out.
+    """
+    scan_re = re.compile(r'SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?$')
+
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_superuser(username='manager', password='manager-pass')
+        for i, day in enumerate(('2024-05-01', '2024-05-02', '2024-05-03')):
+            order = Order.objects.create(user=self.customer, delivery_crew=self.crew, date=day, status=bool(i % 2),
+                                         ordered_time=f'{day}T10:00:00Z')
+            OrderItem.objects.create(order=order, menuitem=self.menu_items[i], quantity=1, price=1)
+        self.order = order
+        self.tables = set(connection.introspection.table_names())
+        self.partial_indexes = {index.name for model in apps.get_models() for index in model._meta.indexes
+                                if index.condition is not None}
+
+    def requests(self):
+        customer, crew, manager = self.customer, self.crew, self.manager
+        first_item = self.menu_items[0].id
+        return [
+            (customer, 'get', '/api/orders'),
+            (customer, 'get', f'/api/orders/{self.order.id}'),
+            (customer, 'get', '/api/cart/menu-items'),
+            (customer, 'get', '/api/orderhistory'),
+            (customer, 'get', f'/api/orderhistory/{self.order.id}'),
+            (customer, 'get', '/api/address'),
+            (customer, 'post', f'/api/rate/{first_item}', {'rate': 5}),
+            (customer, 'post', '/api/cart/menu-items', {'menuitem': first_item, 'quantity': 1}),
+            (customer, 'post', '/api/orders'),
+            (crew, 'get', '/api/delivery?page_size=1'),
+            (crew, 'post', '/api/deliverystatus'),
+            (manager, 'get', '/api/undelivered?page_size=1'),
+            (manager, 'get', '/api/delivered?page_size=1'),
+            (manager, 'get', '/api/orders?page_size=1'),
+            (manager, 'get', f'/api/cart/menu-items/{customer.id}'),
+            (manager, 'get', '/api/sale'),
+            (manager, 'get', '/api/sale/analytics?start_date=2024-05-01&end_date=2024-05-03'),
+            (manager, 'get', '/api/orders/export?start_date=2024-05-02'),
+            (manager, 'get', '/api/menu-items?search=flav'),
+        ]
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[3] for row in cursor.fetchall()]
+        scans = [self.scan_re.match(line) for line in plan]
+        return [match.group(0) for match in scans
+                if match and match.group(1) in self.tables and match.group(2) not in self.partial_indexes]
+
+    def test_endpoints_do_not_scan_tables(self):
+        for user, method, path, *data in self.requests():
+            with self.subTest(method=method, path=path):
+                self.client.force_authenticate(user)
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(self.client, method)(path, *data, format='json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    next_page = not response.streaming and isinstance(response.data, dict) and response.data.get('next')
+                    if next_page:
+                        self.client.get(next_page)
+                self.assertLess(response.status_code, 400, path)
+
+                selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+                self.assertTrue(selects)
+                for sql in selects:
+                    self.assertEqual(self.full_scans(sql), [], sql)
+
+
+class RouteBenchmarkTests(RestaurantTestCase):
+    """
+    Requests every route in restaurantAPI/urls.py with each of its methods as each role, at every dataset size
+    in ROUTE_BENCH_SIZES (rows of menu items, orders, order items and cart lines; e.g. 100,10000,1000000), and
+    fails when a request's query count changes with the size or a request errors. When ROUTE_BENCH_RESULTS names
+    a file, query counts, wall time and response bytes are written to it so runs can be compared.
+    """
+    sizes = [int(size) for size in os.environ.get('ROUTE_BENCH_SIZES', '20,200').split(',')]
+    results_path = os.environ.get('ROUTE_BENCH_RESULTS')
+    customers = 5
+    # Streams in chunks of ORDER_EXPORT_CHUNK_SIZE orders, with one query per chunk for them and one for their items.
+    chunked = {'/api/orders/export'}
+    # Event streams are served under ASGI only; the test client goes through WSGI.
+    asgi_only = {'/api/orders/events', '/api/delivery/events'}
+
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_superuser(username='manager', password='manager-pass')
+        self.manager.groups.add(Group.objects.get(name='manager'))
+        self.spare_category = Category.objects.create(slug='spare', title='Spare')
+        self.address = self.customer.profile.addresses.get()
+        self.others = [User.objects.create_user(username=f'customer-{i}', password=None)
+                       for i in range(1, self.customers)]
+        self.client.raise_request_exception = False
+        # The seeded crew member's open orders grow with the size; keep them under the drain limit at every size,
+        # so the same drain is measured each time.
+        patcher = mock.patch.object(dispatcher, 'drain_max_open_orders', 10 * max(self.sizes))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Warm in any long-running process; a cold one would show up as an extra query on the first request.
+        ContentType.objects.get_for_models(*apps.get_models())
+
+    def seed(self, size):
+        customers = [self.customer] + self.others
+        items = self.menu_items + MenuItem.objects.bulk_create([
+            MenuItem(title=f'Bench item {i}', price=1 + i % 20, featured=True, category=self.category)
+            for i in range(size)
+        ])
+        days = [datetime.date(2024, 5, 1) + datetime.timedelta(days=i % 30) for i in range(size)]
+        orders = Order.objects.bulk_create([
+            Order(user=customers[i % len(customers)], delivery_crew=self.crew, status=bool(i % 2), total=2,
+                  customer_address='Street 1, Tehran, Iran', date=days[i], ordered_time=f'{days[i]}T10:00:00Z')
+            for i in range(size)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=items[i % len(items)], quantity=1, price=2)
+            for i, order in enumerate(orders)
+        ])
+        # The customer who checks out keeps a cart of a realistic size; the other carts grow with the data.
+        Cart.objects.bulk_create([
+            Cart(user=self.customer if i < 10 else self.others[i % len(self.others)], menuitem=items[i], quantity=1,
+                 unit_price=items[i].price, price=items[i].price)
+            for i in range(size)
+        ])
+        self.open_order = Order.objects.filter(user=self.customer, status=False).earliest('id')
+        self.delivered_order = Order.objects.filter(status=True).earliest('id')
+
+    def routes(self):
+        item, category, spare = self.menu_items[0].id, self.category.id, self.spare_category.id
+        order, delivered = self.open_order.id, self.delivered_order.id
+        menu_item = {'title': 'Bench special', 'price': '5.00', 'featured': True, 'category': category}
+        return [
+            ('get', '/api/menu-items'),
+            ('get', f'/api/menu-items/{item}'),
+            ('post', '/api/menu-items', menu_item),
+            ('post', f'/api/menu-items/{item}', menu_item),
+            ('put', f'/api/menu-items/{item}', menu_item),
+            ('delete', f'/api/menu-items/{self.menu_items[1].id}'),
+            ('get', '/api/category'),
+            ('get', f'/api/category/{category}'),
+            ('post', '/api/category', {'slug': 'bench', 'title': 'Bench'}),
+            ('post', f'/api/category/{category}', {'slug': 'bench', 'title': 'Bench'}),
+            ('put', f'/api/category/{spare}', {'slug': 'spare', 'title': 'Spare parts'}),
+            ('delete', f'/api/category/{spare}'),
+            ('get', '/api/groups/manager/users'),
+            ('get', f'/api/groups/manager/users/{self.manager.id}'),
+            ('post', '/api/groups/manager/users', {'username': 'customer-1'}),
+            ('delete', f'/api/groups/manager/users/{self.manager.id}'),
+            ('get', '/api/groups/delivery-crew/users'),
+            ('get', f'/api/groups/delivery-crew/users/{self.crew.id}'),
+            ('post', '/api/groups/delivery-crew/users', {'username': 'customer-1'}),
+            ('delete', f'/api/groups/delivery-crew/users/{self.crew.id}'),
+            ('get', '/api/cart/menu-items'),
+            ('get', f'/api/cart/menu-items/{self.customer.id}'),
+            ('post', '/api/cart/menu-items', {'menuitem': item, 'quantity': 1}),
+            ('delete', '/api/cart/menu-items'),
+            ('post', '/api/cart/menu-items/batch', {'items': [{'menuitem': item, 'quantity': 1},
+                                                               {'menuitem': self.menu_items[2].id, 'quantity': 2}]}),
+            ('get', '/api/orders'),
+            ('get', f'/api/orders/{order}'),
+            ('post', '/api/orders'),
+            ('get', '/api/orders/export'),
+            ('get', '/api/orders/events'),
+            ('get', '/api/delivery'),
+            ('get', f'/api/delivery/{order}'),
+            ('get', '/api/delivery/events'),
+            ('post', f'/api/delivery/{order}'),
+            ('post', '/api/deliverystatus'),
+            ('get', '/api/undelivered'),
+            ('get', f'/api/undelivered/{order}'),
+            ('post', f'/api/undelivered/{order}', {'delivery_crew': self.crew.id}),
+            ('get', '/api/delivered'),
+            ('get', f'/api/delivered/{delivered}'),
+            ('get', '/api/menuitemstatus?featured=true'),
+            ('get', f'/api/menuitemstatus/{item}'),
+            ('post', '/api/menuitemstatus', {'menuitem': 'Flavour 29'}),
+            ('post', f'/api/menuitemstatus/{item}'),
+            ('get', '/api/orderhistory'),
+            ('get', f'/api/orderhistory/{order}'),
+            ('get', '/api/price-change'),
+            ('get', f'/api/price-change/{item}'),
+            ('post', '/api/price-change', {'menuitem': 'Flavour 29', 'price': '3.00'}),
+            ('post', f'/api/price-change/{item}', {'price': '3.00'}),
+            ('get', '/api/sale'),
+            ('post', '/api/sale', {'start_date': '2024-05-01', 'end_date': '2024-05-30'}),
+            ('get', '/api/sale/analytics?start_date=2024-05-01&end_date=2024-05-30'),
+            ('get', '/api/rate'),
+            ('get', f'/api/rate/{item}'),
+            ('post', f'/api/rate/{item}', {'rate': 5}),
+            ('get', '/api/address'),
+            ('get', f'/api/address/{self.address.id}'),
+            ('post', '/api/address', {'city': 'Shiraz', 'country': 'Iran', 'details': 'Street 2'}),
+            ('delete', f'/api/address/{self.address.id}'),
+        ]
+
+    def measure(self, user, method, path, data):
+        """One request on cold caches, rolled back afterwards so every request sees the same data."""
+        self.reset_caches()
+        dispatcher.rebuild()
+        # A fresh instance, so roles memoized on the user by an earlier request don't carry over.
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, data, format='json')
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return {'status': response.status_code, 'queries': len(queries), 'ms': round(elapsed * 1000, 3),
+                'bytes': len(body)}
+
+    def test_every_route_and_method_is_benchmarked(self):
+        self.seed(2)
+        covered = {(method, resolve(urlsplit(path).path).route) for method, path, *_ in self.routes()}
+        for pattern in urls.urlpatterns:
+            view, route = pattern.callback.view_class, 'api/' + str(pattern.pattern)
+            for method in view.http_method_names:
+                handler = getattr(view, method, None)
+                if handler is None or method in ('options', 'head'):
+                    continue
+                pk = inspect.signature(handler).parameters.get('pk')
+                if pk is None and '<int:pk>' in route or pk and pk.default is not None and '<int:pk>' not in route:
+                    continue
+                with self.subTest(method=method, route=route):
+                    self.assertIn((method, route), covered)
+
+    def test_query_counts_do_not_grow_with_data(self):
+        roles = {'customer': self.customer, 'crew': self.crew, 'manager': self.manager}
+        results = []
+        for size in self.sizes:
+            with transaction.atomic():
+                self.seed(size)
+                for method, path, *data in self.routes():
+                    for role, user in roles.items():
+                        result = self.measure(user, method, path, data[0] if data else None)
+                        results.append({'size': size, 'role': role, 'method': method.upper(), 'path': path, **result})
+                transaction.set_rollback(True)
+
+        if self.results_path:
+            with open(self.results_path, 'w') as file:
+                json.dump({'sizes': self.sizes, 'results': results}, file, indent=1)
+
+        by_request = {}
+        for result in results:
+            with self.subTest(role=result['role'], method=result['method'], path=result['path'], size=result['size']):
+                if result['path'] in self.asgi_only:
+                    self.assertEqual(result['status'], 501)
+                else:
+                    self.assertLess(result['status'], 500)
+            by_request.setdefault((result['role'], result['method'], result['path']), {})[result['size']] = result
+        for (role, method, path), per_size in by_request.items():
+            if path in self.chunked:
+                continue
+            with self.subTest(role=role, method=method, path=path):
+                self.assertEqual(len({result['queries'] for result in per_size.values()}), 1,
+                                 {size: result['queries'] for size, result in per_size.items()})
+
+
+class SeedRestaurantTests(TestCase):
+    def seed(self, prefix):
+        call_command('seed_restaurant', seed=7, prefix=prefix, customers=20, crew=3, managers=1, categories=3,
+                     menu_items=15, orders=120, days=10, ratings=30, end_date=datetime.date(2024, 5, 10),
+                     batch_size=50, stdout=io.StringIO())
+        return list(Order.objects.filter(user__username__startswith=f'{prefix}-').order_by('id').values_list(
+            'total', 'status', 'date', 'ordered_time', 'customer_address'))
+
+    def test_same_seed_same_data(self):
+        self.assertEqual(self.seed('first'), self.seed('second'))
+
+    def test_rows_are_consistent(self):
+        orders = self.seed('seed')
+
+        self.assertEqual(len(orders), 120)
+        self.assertEqual(User.objects.filter(profile__isnull=True).count(), 0)
+        self.assertEqual(User.objects.filter(groups__name='customer').count(), 20)
+        self.assertEqual(User.objects.filter(groups__name='delivery').count(), 3)
+        for order in Order.objects.annotate(items_total=Sum('order__price')):
+            self.assertEqual(order.total, order.items_total)
+        daily = DailySales.objects.aggregate(orders=Sum('order_count'), revenue=Sum('revenue'))
+        self.assertEqual((daily['orders'], daily['revenue']), (120, sum(total for total, *_ in orders)))
+        self.assertEqual(MenuItem.objects.aggregate(rates=Sum('rate_count'))['rates'], Rate.objects.count())
+        self.assertFalse(Rate.objects.exclude(
+            object_id__in=OrderItem.objects.filter(order__user=OuterRef('user')).values('menuitem')).exists())
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_SLOW_REQUEST_MS=0)
+class ProfilingTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        profiling.instrument()
+        self.fill_cart(self.customer, 3)
+        self.client.force_authenticate(self.customer)
+
+    def timings(self, response):
+        return {name: dict(part.split('=', 1) for part in params.split(';') if '=' in part)
+                for name, _, params in (metric.strip().partition(';')
+                                        for metric in response['Server-Timing'].split(','))}
+
+    def test_server_timing_header(self):
+        with self.assertLogs('restaurantAPI.profiling', 'WARNING') as logs, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/cart/menu-items')
+
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'total', 'db', 'auth', 'view', 'serialize', 'render'})
+        self.assertEqual(timings['db']['desc'], f'"{len(queries)} queries"')
+        self.assertGreaterEqual(float(timings['total']['dur']), float(timings['view']['dur']))
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['view'], record['status'], record['queries']), ('UserCartManager', 200, len(queries)))
+        self.assertLessEqual(len(record['slowest_sql']), 5)
+        self.assertEqual(record['slowest_sql'], sorted(record['slowest_sql'], key=lambda query: -query['ms']))
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_left_alone(self):
+        with self.assertNoLogs('restaurantAPI.profiling'):
+            response = self.client.get('/api/cart/menu-items')
+        self.assertNotIn('Server-Timing', response)
+        # Only the metrics query counter, which every connection has.
+        self.assertEqual(connection.execute_wrappers, [metrics.count_query])
+
+    async def test_async_views(self):
+        token = await sync_to_async(Token.objects.create)(user=self.customer)
+        with self.assertLogs('restaurantAPI.profiling', 'WARNING') as logs:
+            response = await self.async_client.get('/api/orders', headers={'Authorization': f'Token {token.key}',
+                                                                            'Accept': 'application/json'})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'AsyncOrderManagement')
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(self.timings(response)['db']['desc'], f'"{record["queries"]} queries"')
+
+
+class MetricsTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.reset()
+        self.client.force_authenticate(self.customer)
+
+    def scrape(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/metrics')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                    if not line.startswith('#'))
+
+    def test_requests_by_view(self):
+        self.client.get('/api/menu-items')
+        self.client.get('/api/menu-items')
+        self.client.get('/api/nowhere')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/cart/menu-items')
+
+        samples = self.scrape()
+        self.assertEqual(samples['restaurant_http_requests_total{view="ListMenuItems",method="GET",status="200"}'], '2')
+        self.assertEqual(samples['restaurant_http_requests_total{view="unmatched",method="GET",status="404"}'], '1')
+        self.assertEqual(samples['restaurant_http_request_duration_seconds_count{view="ListMenuItems"}'], '2')
+        self.assertEqual(samples['restaurant_db_queries_per_request_sum{view="UserCartManager"}'], str(len(queries)))
+        self.assertEqual(samples['restaurant_cache_hits_total{cache="menu"}'], '1')
+        self.assertEqual(samples['restaurant_cache_hit_ratio{cache="menu"}'], '0.5')
+
+    def test_adds_up_every_process(self):
+        other_process = {
+            'requests': [['ListMenuItems', 'GET', '200', 5]],
+            'latency': {'ListMenuItems': [[5] + [0] * len(metrics.LATENCY_BUCKETS), 0.01]},
+            'queries': {'ListMenuItems': [[0, 5] + [0] * (len(metrics.QUERY_BUCKETS) - 1), 5]},
+            'caches': {'menu': {'hits': 3, 'misses': 1}},
+        }
+        with open(os.path.join(self.directory, '1-1.json'), 'w') as file:
+            json.dump(other_process, file)
+        self.client.get('/api/menu-items')
+
+        samples = self.scrape()
+        self.assertEqual(samples['restaurant_http_requests_total{view="ListMenuItems",method="GET",status="200"}'], '6')
+        self.assertEqual(samples['restaurant_http_request_duration_seconds_bucket{view="ListMenuItems",le="+Inf"}'], '6')
+        self.assertEqual(samples['restaurant_cache_misses_total{cache="menu"}'], '2')
+
+    def test_other_addresses_are_refused(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_exited_processes_are_folded_into_the_totals(self):
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        snapshot = {
+            'requests': [['ListMenuItems', 'GET', '200', 2]],
+            'latency': {'ListMenuItems': [[2] + [0] * len(metrics.LATENCY_BUCKETS), 0.01]},
+            'queries': {'ListMenuItems': [[0, 2] + [0] * (len(metrics.QUERY_BUCKETS) - 1), 2]},
+            'caches': {},
+        }
+        for name in (f'{exited.pid}-1.json', f'{exited.pid}-2.json', f'{os.getpid()}-1.json'):
+            with open(os.path.join(self.directory, name), 'w') as file:
+                json.dump(snapshot, file)
+        self.client.get('/api/menu-items')
+
+        for _ in range(2):
+            samples = self.scrape()
+            self.assertEqual(
+                samples['restaurant_http_requests_total{view="ListMenuItems",method="GET",status="200"}'], '7')
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.endswith('.json')),
+                         sorted([metrics.TOTALS_FILE, metrics.process_metrics.filename]))
+
+    def test_a_metrics_dir_is_required(self):
+        with override_settings(METRICS_DIR=None), self.assertRaises(ImproperlyConfigured):
+            metrics.flush()
+
+
+class EventStreamTestCase(RestaurantTestCase):
+    path = None
+    broker_options = {}
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(events, 'broker', events.InProcessBroker(**self.broker_options))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def open_stream(self, user, **headers):
+        token = await sync_to_async(Token.objects.get_or_create)(user=user)
+        response = await self.async_client.get(self.path, headers={'Authorization': f'Token {token[0].key}', **headers})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b': connected\n\n')
+        return stream
+
+    async def read_event(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), 5)
+        fields = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n'))
+        return fields['event'], json.loads(fields['data'])
+
+
+class DeliveryEventTests(EventStreamTestCase):
+    path = '/api/delivery/events'
+    broker_options = {'buffer_size': 2}
+
+    def setUp(self):
+        super().setUp()
+        self.channel = events.delivery_channel(self.crew.id)
+
+    def checkout(self):
+        self.fill_cart(self.customer, 2)
+        self.client.force_authenticate(self.customer)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/orders').data
+
+    async def test_checkout_assignment_is_pushed(self):
+        stream = await self.open_stream(self.crew)
+        try:
+            order = await sync_to_async(self.checkout)()
+            self.assertEqual(await self.read_event(stream), ('assigned', order))
+        finally:
+            await stream.aclose()
+
+    async def test_reassignment_and_queued_orders_are_pushed(self):
+        def change_orders():
+            other_crew = User.objects.create_user(username='other-crew', password='crew-pass', ready_to_work=True)
+            other_crew.groups.set([Group.objects.get(name='delivery')])
+            order = Order.objects.create(user=self.customer, delivery_crew=self.crew, date='2024-05-01')
+            queued = Order.objects.create(user=self.customer, date='2024-05-02')
+            self.crew.ready_to_work = False
+            self.crew.save()
+            dispatcher.rebuild()
+
+            self.client.force_authenticate(User.objects.create_superuser(username='manager', password='manager-pass'))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/undelivered/{order.id}', {'delivery_crew': other_crew.id})
+            self.client.force_authenticate(self.crew)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/deliverystatus')
+            return order.id, queued.id
+
+        stream = await self.open_stream(self.crew)
+        try:
+            order_id, queued_id = await sync_to_async(change_orders)()
+            kind, data = await self.read_event(stream)
+            self.assertEqual((kind, data['id']), ('unassigned', order_id))
+            self.assertNotEqual(data['delivery_crew'], self.crew.id)
+            kind, data = await self.read_event(stream)
+            self.assertEqual((kind, data['id'], data['delivery_crew']), ('assigned', queued_id, self.crew.id))
+        finally:
+            await stream.aclose()
+
+    async def test_reconnecting_client_gets_missed_events(self):
+        broker = events.broker
+        first = broker.publish(self.channel, 'assigned', '{"id": 1}')
+        broker.publish(events.delivery_channel(self.crew.id + 1), 'assigned', '{"id": 2}')
+        broker.publish(self.channel, 'assigned', '{"id": 3}')
+        broker.publish(self.channel, 'assigned', '{"id": 4}')
+
+        stream = await self.open_stream(self.crew, **{'Last-Event-ID': first.id})
+        self.assertEqual(await self.read_event(stream), ('assigned', {'id': 3}))
+        self.assertEqual(await self.read_event(stream), ('assigned', {'id': 4}))
+        await stream.aclose()
+
+        # Missed events that were evicted, or ids from another process, can't be replayed.
+        for last_event_id in (f'{broker.epoch}-0', 'ffff-1'):
+            stream = await self.open_stream(self.crew, **{'Last-Event-ID': last_event_id})
+            self.assertEqual(await self.read_event(stream), ('reset', {}))
+            await stream.aclose()
+
+    @override_settings(EVENTS_KEEPALIVE_SECONDS=0.01)
+    async def test_idle_stream_sends_keepalives_until_the_client_disconnects(self):
+        stream = await self.open_stream(self.crew)
+        self.assertEqual(await anext(stream), b': keepalive\n\n')
+
+        # The ASGI handler cancels the response when the client disconnects.
+        reading = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        reading.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reading
+        self.assertEqual(events.broker.subscriber_count(), 0)
+
+    async def test_only_delivery_crew_can_subscribe(self):
+        token = await sync_to_async(Token.objects.create)(user=self.customer)
+        response = await self.async_client.get('/api/delivery/events', headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 403)
+
+
+class OrderEventTests(EventStreamTestCase):
+    path = '/api/orders/events'
+    broker_options = {'queue_size': 2}
+
+    async def test_customer_is_told_about_their_own_orders(self):
+        def change_order():
+            order = Order.objects.create(user=self.customer, delivery_crew=self.crew, date='2024-05-01')
+            other_crew = User.objects.create_user(username='other-crew', password='crew-pass', ready_to_work=True)
+            other_crew.groups.set([Group.objects.get(name='delivery')])
+
+            self.client.force_authenticate(User.objects.create_superuser(username='manager', password='manager-pass'))
+            with self.captureOnCommitCallbacks(execute=True):
+                reassigned = self.client.post(f'/api/undelivered/{order.id}', {'delivery_crew': other_crew.id})
+            self.client.force_authenticate(other_crew)
+            with self.captureOnCommitCallbacks(execute=True):
+                delivered = self.client.post(f'/api/delivery/{order.id}')
+            return reassigned.data[1]['order'], delivered.data['order']
+
+        other_customer = await sync_to_async(User.objects.create_user)(username='other', password='customer-pass')
+        stream = await self.open_stream(self.customer)
+        other_stream = await self.open_stream(other_customer)
+        try:
+            reassigned, delivered = await sync_to_async(change_order)()
+            self.assertEqual(await self.read_event(stream), ('assigned', reassigned))
+            self.assertEqual(await self.read_event(stream), ('delivered', delivered))
+
+            events.broker.publish(events.orders_channel(other_customer.id), 'marker', '{}')
+            self.assertEqual(await self.read_event(other_stream), ('marker', {}))
+        finally:
+            await stream.aclose()
+            await other_stream.aclose()
+
+        response = await self.async_client.get(self.path, headers={
+            'Authorization': f'Token {(await sync_to_async(Token.objects.create)(user=self.crew)).key}'})
+        self.assertEqual(response.status_code, 403)
+
+    async def test_delivery_in_another_worker_process_is_pushed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'events.sqlite3')
+        worker = events.SQLiteBroker(path, poll_interval=0.01)
+        self.addCleanup(worker.close)
+        order = await sync_to_async(Order.objects.create)(user=self.customer, delivery_crew=self.crew,
+                                                           date='2024-05-01')
+
+        def deliver_elsewhere():
+            self.client.force_authenticate(self.crew)
+            with mock.patch.object(events, 'broker', events.SQLiteBroker(path)), \
+                    self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(f'/api/delivery/{order.id}').data['order']
+
+        with mock.patch.object(events, 'broker', worker):
+            stream = await self.open_stream(self.customer)
+        try:
+            delivered = await sync_to_async(deliver_elsewhere)()
+            self.assertEqual(await self.read_event(stream), ('delivered', delivered))
+        finally:
+            await stream.aclose()
+
+    async def test_client_that_falls_behind_is_cut_off_and_resumes(self):
+        channel = events.orders_channel(self.customer.id)
+        stream = await self.open_stream(self.customer)
+        first = events.broker.publish(channel, 'delivered', '{"id": 1}')
+        self.assertEqual(await self.read_event(stream), ('delivered', {'id': 1}))
+
+        # Three more events while the client reads nothing overflow its two-event queue.
+        for order_id in (2, 3, 4):
+            events.broker.publish(channel, 'delivered', f'{{"id": {order_id}}}')
+        with self.assertRaises(StopAsyncIteration):
+            await asyncio.wait_for(anext(stream), 5)
+        self.assertEqual(events.broker.subscriber_count(), 0)
+
+        stream = await self.open_stream(self.customer, **{'Last-Event-ID': first.id})
+        self.assertEqual([await self.read_event(stream) for _ in range(3)],
+                         [('delivered', {'id': order_id}) for order_id in (2, 3, 4)])
+        await stream.aclose()
+
+    async def test_least_recently_used_channels_lose_their_buffer(self):
+        broker = events.InProcessBroker(max_channels=1)
+        first = broker.publish('orders:1', 'delivered', '{}')
+        broker.publish('orders:2', 'delivered', '{}')
+        latest = broker.publish('orders:1', 'delivered', '{}')
+
+        self.assertEqual([event.id for event in broker.subscribe('orders:1', first.id).backlog], [latest.id])
+        self.assertEqual([event.type for event in broker.subscribe('orders:1', f'{broker.epoch}-0').backlog],
+                         ['reset'])
+        self.assertEqual([event.type for event in broker.subscribe('orders:2', f'{broker.epoch}-0').backlog],
+                         ['reset'])
+
+
+class SQLiteBrokerTests(TestCase):
+    """Two brokers on one file stand in for two worker processes."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'events.sqlite3')
+        self.publisher, self.worker = (events.SQLiteBroker(path, poll_interval=0.01) for _ in range(2))
+        self.addCleanup(self.worker.close)
+
+    async def test_events_reach_streams_of_other_processes(self):
+        subscription = self.worker.subscribe('orders:1')
+        try:
+            published = self.publisher.publish('orders:1', 'delivered', '{"id": 1}')
+            event = await subscription.get(5)
+        finally:
+            subscription.close()
+
+        self.assertEqual((event.id, event.type, event.data), (published.id, 'delivered', '{"id": 1}'))
+
+    async def test_client_can_reconnect_to_another_process(self):
+        first = self.publisher.publish('orders:1', 'assigned', '{"id": 1}')
+        self.publisher.publish('orders:2', 'assigned', '{"id": 2}')
+        missed = self.publisher.publish('orders:1', 'delivered', '{"id": 1}')
+
+        subscription = self.worker.subscribe('orders:1', first.id)
+        subscription.close()
+
+        self.assertEqual([event.id for event in subscription.backlog], [missed.id])
+
+    def test_streams_are_not_served_under_wsgi(self):
+        for path in ('/api/delivery/events', '/api/orders/events'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 501)
+
+
+class ServeTests(TestCase):
+    def serve(self, workers=2, **options):
+        call_command('serve', workers=workers, stdout=io.StringIO(), stderr=io.StringIO(), **options)
+
+    def test_several_workers_pass_events_through_the_events_db(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'events.sqlite3')
+        with mock.patch.object(events, 'broker', events.InProcessBroker()), \
+                mock.patch.object(ServeCommand, 'run_master') as run_master, override_settings(EVENTS_DB=path):
+            self.serve(bind='127.0.0.1:0')
+            self.assertIsInstance(events.broker, events.SQLiteBroker)
+            self.assertEqual(events.broker.path, path)
+        run_master.assert_called_once()
+        run_master.call_args.args[0].close()
+
+    def test_several_workers_need_an_events_db(self):
+        with mock.patch.object(events, 'broker', events.InProcessBroker()), override_settings(EVENTS_DB=None):
+            with self.assertRaisesMessage(CommandError, 'EVENTS_DB'):
+                self.serve()
+
+    def test_refuses_process_local_menu_cache_without_expiry(self):
+        with mock.patch.object(menu_cache, 'timeout', None):
+            with self.assertRaisesMessage(CommandError, 'MENU_CACHE_TIMEOUT'):
+                self.serve()
+
+    def test_asgi_needs_uvicorn(self):
+        with mock.patch.dict(sys.modules, {'uvicorn': None}):
+            with self.assertRaisesMessage(CommandError, '--asgi needs uvicorn'):
+                self.serve(asgi=True, workers=1)
+
+    def test_silent_client_is_dropped_after_the_timeout(self):
+        sock = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(sock.close)
+        server = PreforkWSGIServer(sock, request_timeout=0.2)
+        server.set_app(lambda environ, start_response: self.fail('no request was sent'))
+        client = socket.create_connection(sock.getsockname())
+        self.addCleanup(client.close)
+
+        started = time.monotonic()
+        with self.assertLogs('django.server', 'INFO') as logs:
+            server.handle_request()
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIn('Timed out', logs.output[0])
+        self.assertEqual(client.recv(1), b'')
+
+
+class DatabaseBackendTests(TestCase):
+    def test_connection_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            busy_timeout = cursor.fetchone()[0]
+            cursor.execute('PRAGMA synchronous')
+            synchronous = cursor.fetchone()[0]
+
+        self.assertEqual(busy_timeout, 5000)
+        self.assertEqual(synchronous, 1)  # NORMAL
+
+
+class BasicAuthenticationTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=self.basic('customer', 'customer-pass'))
+
+    def basic(self, username, password):
+        return 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+
+    def test_password_is_hashed_once(self):
+        with mock.patch.object(User, 'check_password', autospec=True,
+                               side_effect=User.check_password) as check_password:
+            for _ in range(3):
+                self.assertEqual(self.client.get('/api/orders').status_code, 200)
+
+        self.assertEqual(check_password.call_count, 1)
+
+    def test_password_change_rejects_cached_credentials(self):
+        self.client.get('/api/orders')
+        self.customer.set_password('new-pass')
+        self.customer.save()
+
+        self.assertEqual(self.client.get('/api/orders').status_code, 401)
+
+    @override_settings(BASIC_AUTH_ISSUE_TOKEN=True)
+    def test_basic_auth_clients_receive_a_token(self):
+        response = self.client.get('/api/orders')
+
+        self.assertEqual(response['X-Auth-Token'], Token.objects.get(user=self.customer).key)
+
+
+class ProjectionSerializerTests(RestaurantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_user(username='manager', password='manager-pass', is_staff=True,
+                                                is_superuser=True)
+        self.manager.groups.set([Group.objects.get(name='manager')])
+        MenuItem.objects.filter(pk=self.menu_items[0].pk).update(
+            rate_count=2, rate_sum=13, rate_histogram=[0, 0, 0, 0, 0, 1, 0, 1, 0, 0])
+        self.fill_cart(self.customer, 3)
+        self.order = Order.objects.create(user=self.customer, delivery_crew=self.crew, total='12.50',
+                                          date='2024-05-01', delivered_time=timezone.now(), status=True)
+        Order.objects.create(user=self.customer, date='2024-05-02')
+        OrderItem.objects.bulk_create([OrderItem(order=self.order, menuitem=item, quantity=1, price=item.price)
+                                       for item in self.menu_items[:3]])
+
+    def test_projections_match_model_serializers(self):
+        for projection in fast_serializers.PROJECTIONS.values():
+            with self.subTest(serializer=projection.serializer_class.__name__):
+                queryset = projection.serializer_class.Meta.model.objects.order_by('id')
+                expected = projection.serializer_class(queryset, many=True).data
+
+                self.assertTrue(expected)
+                self.assertEqual(projection(queryset).data, expected)
+                self.assertEqual(projection(list(queryset)).data, expected)
+
+    def test_list_endpoints_match_model_serializers(self):
+        paths = {self.customer: ('/api/menu-items', '/api/menu-items?search=flav', '/api/cart/menu-items',
+                                 '/api/orders', '/api/orderhistory', f'/api/orderhistory/{self.order.pk}'),
+                 self.manager: ('/api/cart/menu-items', '/api/cart/menu-items?page_size=2', '/api/orders',
+                                '/api/orders?page_size=1', '/api/delivered', '/api/undelivered?page_size=1'),
+                 self.crew: ('/api/delivery',)}
+        for user, user_paths in paths.items():
+            self.client.force_authenticate(user)
+            for path in user_paths:
+                with self.subTest(path=path):
+                    responses = []
+                    for default in ('model', 'projection'):
+                        cache.clear()
+                        with self.settings(LIST_SERIALIZER_DEFAULT=default):
+                            responses.append(self.client.get(path))
+                    self.assertEqual(responses[0].status_code, 200)
+                    self.assertEqual(responses[0].json(), responses[1].json())
+
+    def test_serializer_is_chosen_per_view(self):
+        with self.settings(LIST_SERIALIZERS={'ListMenuItems': 'model'}):
+            self.assertIs(fast_serializers.list_serializer(views.ListMenuItems(), MenuItemSerializer),
+                          MenuItemSerializer)
+            self.assertIs(fast_serializers.list_serializer(views.UserCartManager(), CartSerializer),
+                          fast_serializers.CartProjection)
+
+    def test_async_views_follow_the_sync_view_they_replace(self):
+        with self.settings(LIST_SERIALIZERS={'ListMenuItems': 'model', 'UserCartManager': 'model',
+                                             'OrderManagement': 'model'}):
+            for view, serializer_class in ((async_views.AsyncListMenuItems(), MenuItemSerializer),
+                                           (async_views.AsyncUserCart(), CartSerializer),
+                                           (async_views.AsyncOrderManagement(), OrderSerializer)):
+                with self.subTest(view=type(view).__name__):
+                    self.assertIs(fast_serializers.list_serializer(view, serializer_class), serializer_class)
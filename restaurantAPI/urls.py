@@ -3,7 +3,7 @@ from django.urls import path
 from .views import ListMenuItems, ManagerGroupManagement, DeliveryGroupManagement, UserCartManager, OrderManagement, \
     OrderDeliveryStatusManagement, ListCategory, DeliveryCrewReadyToWorkStatusManagement, OrderDeliveryCrewChanger, \
     DeliveredOrders, MenuItemAvailability, UserOrdersHistory, MenuItemPriceAdjustment, SaleReport, MenuItemRatings, \
-    CustomerAddressManagement
+    CustomerAddressManagement, SalesAnalytics, OrderExport, UserCartBatchManager, EventStreamUnavailable
 
 urlpatterns = [
     path('menu-items', ListMenuItems.as_view()),
@@ -22,13 +22,17 @@ urlpatterns = [
 
     path('cart/menu-items', UserCartManager.as_view()),
     path('cart/menu-items/<int:pk>', UserCartManager.as_view()),
+    path('cart/menu-items/batch', UserCartBatchManager.as_view()),
 
 
     path('orders', OrderManagement.as_view()),
     path('orders/<int:pk>', OrderManagement.as_view()),
+    path('orders/export', OrderExport.as_view()),
+    path('orders/events', EventStreamUnavailable.as_view()),  # served under ASGI only
 
     path('delivery', OrderDeliveryStatusManagement.as_view()),
     path('delivery/<int:pk>', OrderDeliveryStatusManagement.as_view()),
+    path('delivery/events', EventStreamUnavailable.as_view()),  # served under ASGI only
 
 
     path('deliverystatus', DeliveryCrewReadyToWorkStatusManagement.as_view()),
@@ -54,6 +58,7 @@ urlpatterns = [
 
 
     path('sale', SaleReport.as_view()),
+    path('sale/analytics', SalesAnalytics.as_view()),
 
 
     path('rate', MenuItemRatings.as_view()),
@@ -1,42 +1,111 @@
 import datetime
-import random
-from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
-from django.db import IntegrityError
-from django.db.models import Sum, Count, Q, Avg
+from django.db import IntegrityError, transaction
+from django.db.models import Sum, Count, Q, F
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.utils import timezone
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework import status
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 
 from auths.users.models import User, Address
 from auths.users.serializers import AddressSerializer
 from ratings.models import Rate
 from ratings.serializers import RateCreateSerializer
-from .models import MenuItem, Cart, OrderItem, Order, Category
+from . import events, metrics
+from .analytics import sales_breakdown
+from .authentication import CachedTokenAuthentication, CachedBasicAuthentication
+from .cache import menu_cache, normalize_menu_params
+from .dispatch import dispatcher
+from .export import aiter_rows, export_queryset, iter_csv, iter_ndjson
+from .fast_serializers import list_serializer, serialize_list
+from .models import MenuItem, Cart, OrderItem, Order, Category, DailySales
+from .pagination import KeysetPagination
+from .roles import has_role, get_group
+from .search import menu_search
 from .serializers import MenuItemSerializer, UserSerializer, CartSerializer, OrderSerializer, CategorySerializer, \
     OrderItemSerializer, MenuItemAvailabilitySerializer
 from .permissions import IsManager, IsDeliveryCrew, IsCustomer, IsCustomerAndHasBoughtItem, IsManagerOrCustomerReadOnly, \
     IsCustomerOrManagerReadOnly
 
 
+def filter_menu_items(queryset, query_params):
+    """Apply the menu list filters (search, category, price range, featured, from_rate) to `queryset`."""
+    search = query_params.get('search', None)
+    categories = query_params.getlist('category', [])
+    to_price = query_params.get('to_price', None)
+    from_price = query_params.get('from_price', None)
+    featured_items = query_params.get('featured', None)
+    from_rate = query_params.get('from_rate', None)
+
+    searched = menu_search.filter(queryset, search, categories) if search or categories else None
+    if searched is not None:
+        queryset = searched
+    else:
+        if search:
+            queryset = queryset.filter(title__icontains=search)
+
+        if categories:
+            category_query = Q()
+            for category in categories:
+                category_query = category_query | Q(category__title__icontains=category)
+            queryset = queryset.filter(category_query)
+
+    if to_price:
+        queryset = queryset.filter(price__lte=float(to_price))
+
+    if from_price:
+        queryset = queryset.filter(price__gte=float(from_price))
+
+    if featured_items:
+        queryset = queryset.filter(featured=True)
+
+    if from_rate:
+        queryset = queryset.filter(rate_count__gt=0, rate_sum__gte=F('rate_count') * float(from_rate))
+
+    return queryset
+
+
+def order_menu_items(queryset):
+    ranking = ('search_rank',) if 'search_rank' in queryset.query.annotations else ()
+    return queryset.order_by(*ranking, 'category', '-featured')
+
+
+def publish_assignments(assignments):
+    """Tell crew and customers, once the transaction commits, about the orders drain_queue() handed out."""
+    order_ids = [order_id for order_ids in assignments.values() for order_id in order_ids]
+    if order_ids:
+        for order in Order.objects.filter(pk__in=order_ids).order_by('date', 'id'):
+            data = OrderSerializer(order).data
+            events.publish_on_commit(events.delivery_channel(order.delivery_crew_id), 'assigned', data)
+            events.publish_on_commit(events.orders_channel(order.user_id), 'assigned', data)
+
+
 class ListCategory(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManagerOrCustomerReadOnly]
 
     def get(self, request: Request, pk=None):
+        cache_key = menu_cache.key('category', pk)
+        cached = menu_cache.get(cache_key)
+        if cached is not None:
+            return Response(cached, status=status.HTTP_200_OK, headers={'X-Cache': 'HIT'})
+
         if pk:
             queryset = get_object_or_404(Category, pk=pk)
             ser = CategorySerializer(queryset)
-            return Response(ser.data, status=status.HTTP_200_OK)
         elif not pk:
             queryset = Category.objects.all()
             ser = CategorySerializer(queryset, many=True)
-            return Response(ser.data, status=status.HTTP_200_OK)
+        menu_cache.set(cache_key, ser.data)
+        return Response(ser.data, status=status.HTTP_200_OK, headers={'X-Cache': 'MISS'})
 
     def post(self, request: Request, pk=None):
         if pk:
@@ -71,55 +140,29 @@ class ListCategory(APIView):
 
 
 class ListMenuItems(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManagerOrCustomerReadOnly]
 
     def get_queryset(self, pk=None):
         if pk:
-            queryset = get_object_or_404(MenuItem, pk=pk)
-        else:
-            queryset = MenuItem.objects.all().select_related('category')
-
-        search = self.request.query_params.get('search', None)
-        categories = self.request.query_params.getlist('category', [])
-        to_price = self.request.query_params.get('to_price', None)
-        from_price = self.request.query_params.get('from_price', None)
-        featured_items = self.request.query_params.get('featured', None)
-        from_rate = self.request.query_params.get('from_rate', None)
-
-        if search:
-            queryset = queryset.filter(title__icontains=search)
-
-        if categories:
-            category_query = Q()
-            for category in categories:
-                category_query = category_query | Q(category__title__icontains=category)
-            queryset = queryset.filter(category_query)
-
-        if to_price:
-            queryset = queryset.filter(price__lte=float(to_price))
-
-        if from_price:
-            queryset = queryset.filter(price__gte=float(from_price))
-
-        if featured_items:
-            queryset = queryset.filter(featured=True)
-
-        if from_rate:
-            queryset = queryset.annotate(avg_rate=Avg('rate__rate'))
-            queryset = queryset.filter(avg_rate__gte=float(from_rate))
-
-        return queryset
+            return get_object_or_404(MenuItem.objects.select_related('category'), pk=pk)
+        return filter_menu_items(MenuItem.objects.all().select_related('category'), self.request.query_params)
 
     def get(self, request: Request, pk=None):
+        params = normalize_menu_params(request.query_params)
+        cache_key = menu_cache.key('menu-items', pk, params)
+        cached = menu_cache.get(cache_key)
+        if cached is not None:
+            return Response(cached, status=status.HTTP_200_OK, headers={'X-Cache': 'HIT'})
+
         if pk:
             queryset = self.get_queryset(pk=pk)
             ser = MenuItemSerializer(queryset)
-            return Response(ser.data, status=status.HTTP_200_OK)
         else:
-            queryset = self.get_queryset().order_by('category', '-featured')
-            ser = MenuItemSerializer(queryset, many=True)
-            return Response(ser.data, status=status.HTTP_200_OK)
+            queryset = order_menu_items(self.get_queryset())
+            ser = list_serializer(self, MenuItemSerializer)(queryset, many=True)
+        menu_cache.set(cache_key, ser.data)
+        return Response(ser.data, status=status.HTTP_200_OK, headers={'X-Cache': 'MISS'})
 
     def post(self, request: Request, pk=None):
         if pk:
@@ -154,7 +197,7 @@ class ListMenuItems(APIView):
 
 
 class ManagerGroupManagement(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManager]
 
     def get(self, request: Request, pk=None):
@@ -172,7 +215,7 @@ class ManagerGroupManagement(APIView):
 
     def post(self, request: Request):
         user = get_object_or_404(User, username=request.data.get('username'))
-        managers = get_object_or_404(Group, name='manager')
+        managers = get_group('manager')
 
         user.groups.add(managers)
 
@@ -183,7 +226,7 @@ class ManagerGroupManagement(APIView):
 
     def delete(self, request: Request, pk):
         user = get_object_or_404(User, pk=pk)
-        managers = get_object_or_404(Group, name='manager')
+        managers = get_group('manager')
 
         user.groups.remove(managers)
 
@@ -194,7 +237,7 @@ class ManagerGroupManagement(APIView):
 
 
 class DeliveryGroupManagement(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManager]
 
     def get(self, request: Request, pk=None):
@@ -212,43 +255,55 @@ class DeliveryGroupManagement(APIView):
 
     def post(self, request: Request):
         user = get_object_or_404(User, username=request.data.get('username'))
-        delivery_crews = get_object_or_404(Group, name='delivery')
+        delivery_crews = get_group('delivery')
 
         user.groups.add(delivery_crews)
+        if user.is_active and user.ready_to_work:
+            dispatcher.crew_ready(user.id, Order.objects.filter(delivery_crew=user, status=False).count())
+            publish_assignments(dispatcher.drain_queue())
         return Response({"message": f"'{user}' added to the delivery group"}, status=status.HTTP_201_CREATED)
 
     def delete(self, request: Request, pk):
         user = get_object_or_404(User, pk=pk)
-        managers = get_object_or_404(Group, name='delivery')
+        managers = get_group('delivery')
 
         user.groups.remove(managers)
+        dispatcher.crew_unavailable(user.id)
         return Response({"message": f"'{user}' deleted from the delivery group"}, status=status.HTTP_204_NO_CONTENT)
 
 
 class UserCartManager(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request: Request, pk=None):
-        if request.user.groups.filter(name='manager').exists():
+        cart = Cart.objects.select_related('menuitem__category')
+        if has_role(request.user, 'manager'):
             if pk:
-                queryset = Cart.objects.filter(user__id=pk)
+                queryset = cart.filter(user__id=pk)
                 user_total_cart_info = queryset.aggregate(
                     total_price=Sum("price"),
                     number_of_items=Count("id"),
                     total_quantity=Sum("quantity")
                 )
-                ser = CartSerializer(queryset, many=True)
+                ser = list_serializer(self, CartSerializer)(queryset, many=True)
                 return Response([ser.data, user_total_cart_info], status=status.HTTP_200_OK)
             elif not pk:
-                queryset = Cart.objects.order_by('user').all()
+                queryset = cart.order_by('user')
+                paginator = KeysetPagination(('user', 'id'))
+                if paginator.is_requested(request):
+                    page = paginator.paginate_queryset(queryset, request)
+                    each_user_cart = Cart.objects.filter(user__in={item.user_id for item in page}) \
+                        .values('user').annotate(total_price=Sum('price')).order_by('user')
+                    ser = list_serializer(self, CartSerializer)(page, many=True)
+                    return paginator.get_paginated_response([ser.data, each_user_cart])
                 each_user_cart = queryset.values('user').annotate(total_price=Sum('price'))
-                ser = CartSerializer(queryset, many=True)
+                ser = list_serializer(self, CartSerializer)(queryset, many=True)
                 return Response([ser.data, each_user_cart], status=status.HTTP_200_OK)
 
-        elif request.user.groups.filter(name='customer').exists():
-            queryset = Cart.objects.filter(user=request.user)
-            ser = CartSerializer(queryset, many=True)
+        elif has_role(request.user, 'customer'):
+            queryset = cart.filter(user=request.user)
+            ser = list_serializer(self, CartSerializer)(queryset, many=True)
 
             total_items = queryset.aggregate(
                 total_price=Sum("price"),
@@ -258,61 +313,43 @@ class UserCartManager(APIView):
 
             return Response([{"items in your cart": ser.data}, {"total order": total_items}],
                             status=status.HTTP_200_OK)
+        else:
+            return Response({'error': 'User is not in the "manager" or "customer" group.'},
+                            status=status.HTTP_403_FORBIDDEN)
 
     def post(self, request: Request):
-        if request.user.groups.filter(name='customer').exists():
+        if has_role(request.user, 'customer'):
             try:
                 menuitem_id = request.data['menuitem']
-                quantity = request.data['quantity']
-            except KeyError:
+                quantity = int(request.data['quantity'])
+                if quantity < 1:
+                    raise ValueError
+            except (KeyError, TypeError, ValueError):
                 return Response(
                     [{"message": "please send valid data"}, {"menuitem": "menuitem id", "quantity": "int: how many?"}],
                     status=status.HTTP_400_BAD_REQUEST)
             try:
-                menu_item = get_object_or_404(MenuItem, pk=menuitem_id)
+                menu_item = get_object_or_404(MenuItem.objects.select_related('category'), pk=menuitem_id)
             except (MenuItem.DoesNotExist, ValueError):
                 return Response({'error': 'Menu item not found.'}, status=status.HTTP_404_NOT_FOUND)
             if menu_item.featured:
-
-                user_cart = Cart.objects.filter(user=request.user)
-                if user_cart.filter(menuitem=menuitem_id).count() != 0:
-                    get_menu_item_in_current_cart = get_object_or_404(Cart, user=request.user, menuitem=menuitem_id)
-                    get_menu_item_in_current_cart.quantity += quantity
-                    new_quantity_price = quantity * menu_item.price
-                    get_menu_item_in_current_cart.price += new_quantity_price
-                    get_menu_item_in_current_cart.save()
-
-                    ser = CartSerializer(get_menu_item_in_current_cart)
-                    return Response({"message": "ok", "item": ser.data}, status=status.HTTP_200_OK)
-
-                elif user_cart.filter(menuitem=menuitem_id).count() == 0:
-                    unit_price = menu_item.price
-                    price = quantity * unit_price
-
-                    cart_data = {
-                        "user": request.user.id,
-                        "menuitem": menu_item.id,
-                        "quantity": quantity,
-                        "unit_price": unit_price,
-                        "price": price
-                    }
-
-                    ser = CartSerializer(data=cart_data)
-                    if ser.is_valid():
-                        ser.save()
-                        return Response(ser.data, status=status.HTTP_201_CREATED)
-                    else:
-                        return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+                cart_line = Cart.objects.add_item(request.user, menu_item, quantity)
+                ser = CartSerializer(cart_line)
+                if cart_line.quantity == quantity:
+                    return Response(ser.data, status=status.HTTP_201_CREATED)
+                return Response({"message": "ok", "item": ser.data}, status=status.HTTP_200_OK)
             elif not menu_item.featured:
                 return Response({"error": "Sorry, this menu item is no longer available."}, status=status.HTTP_200_OK)
         else:
             return Response({'error': 'User is not in the "customer" group.'}, status=status.HTTP_403_FORBIDDEN)
 
     def delete(self, request: Request):  # TODO: Add pk parameter
-        if request.user.groups.filter(name="customer"):
+        if has_role(request.user, 'customer'):
             queryset = Cart.objects.filter(user=request.user)
             queryset.delete()
             return Response({"messages": "Cart cleared"}, status=status.HTTP_204_NO_CONTENT)
+        else:
+            return Response({'error': 'User is not in the "customer" group.'}, status=status.HTTP_403_FORBIDDEN)
 
     # def get_total_price(self, items):
     #     total_order_price = 0
@@ -321,42 +358,107 @@ class UserCartManager(APIView):
     #     return total_order_price
 
 
+class UserCartBatchManager(APIView):
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_lines = 100
+
+    def post(self, request: Request):
+        if not has_role(request.user, 'customer'):
+            return Response({'error': 'User is not in the "customer" group.'}, status=status.HTTP_403_FORBIDDEN)
+
+        lines = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(lines, list) or not 0 < len(lines) <= self.max_lines:
+            return Response(
+                [{"message": f"please send a list of 1 to {self.max_lines} items"},
+                 {"items": [{"menuitem": "menuitem id", "quantity": "int: how many?"}]}],
+                status=status.HTTP_400_BAD_REQUEST)
+
+        results, requested = [], {}
+        for line in lines:
+            try:
+                menuitem_id = int(line['menuitem'])
+                quantity = int(line['quantity'])
+                if quantity < 1:
+                    raise ValueError
+            except (KeyError, TypeError, ValueError):
+                results.append({"menuitem": line.get('menuitem') if isinstance(line, dict) else None,
+                                "status": "error", "error": "please send valid data"})
+                continue
+            results.append({"menuitem": menuitem_id})
+            requested[menuitem_id] = requested.get(menuitem_id, 0) + quantity
+
+        menu_items = MenuItem.objects.select_related('category').in_bulk(list(requested))
+        errors = {}
+        for menuitem_id in requested:
+            if menuitem_id not in menu_items:
+                errors[menuitem_id] = 'Menu item not found.'
+            elif not menu_items[menuitem_id].featured:
+                errors[menuitem_id] = 'Sorry, this menu item is no longer available.'
+
+        with transaction.atomic():
+            cart_lines = Cart.objects.add_items(request.user, [
+                (menu_items[menuitem_id], quantity) for menuitem_id, quantity in requested.items()
+                if menuitem_id not in errors
+            ])
+
+        for result in results:
+            if 'status' in result:
+                continue
+            menuitem_id = result['menuitem']
+            if menuitem_id in errors:
+                result.update(status="error", error=errors[menuitem_id])
+            else:
+                cart_line = cart_lines[menuitem_id]
+                result.update(status="created" if cart_line.quantity == requested[menuitem_id] else "updated",
+                              item=CartSerializer(cart_line).data)
+        return Response(results, status=status.HTTP_200_OK)
+
+
 class OrderManagement(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsCustomerOrManagerReadOnly]
 
     def get(self, request: Request, pk=None):
-        if request.user.groups.filter(name='manager'):
+        if has_role(request.user, 'manager'):
             if pk:
                 queryset = get_object_or_404(Order, pk=pk)
                 ser = OrderSerializer(queryset)
                 return Response(ser.data, status=status.HTTP_200_OK)
             elif not pk:
                 queryset = Order.objects.order_by('-date', 'user').all()
-                ser = OrderSerializer(queryset, many=True)
+                paginator = KeysetPagination(('-date', 'user', 'id'))
+                if paginator.is_requested(request):
+                    page = paginator.paginate_queryset(queryset, request)
+                    return paginator.get_paginated_response(serialize_list(self, OrderSerializer, page))
+                ser = list_serializer(self, OrderSerializer)(queryset, many=True)
                 return Response(ser.data, status=status.HTTP_200_OK)
 
-        elif request.user.groups.filter(name='customer'):
+        elif has_role(request.user, 'customer'):
             if pk:
                 queryset = get_object_or_404(Order, pk=pk, user=request.user)
                 ser = OrderSerializer(queryset)
                 return Response(ser.data, status=status.HTTP_200_OK)
             elif not pk:
                 queryset = Order.objects.filter(user=request.user).order_by('date')
-                ser = OrderSerializer(queryset, many=True)
+                ser = list_serializer(self, OrderSerializer)(queryset, many=True)
                 return Response(ser.data, status=status.HTTP_200_OK)
         else:
             return Response({"error": "403 Forbidden"}, status=status.HTTP_403_FORBIDDEN)
 
     def post(self, request: Request):
-        cart_items = Cart.objects.filter(user=request.user).count()
-        if cart_items == 0:
-            return Response({"messages": "No items in your cart"}, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            user_addresses = Address.objects.filter(profile__user=request.user)
+        with transaction.atomic():
+            # The cart is read once and locked; the total, the order items and the cleanup all come from this read.
+            user_cart = list(Cart.objects.select_for_update().filter(user=request.user)
+                             .only('id', 'menuitem_id', 'quantity', 'price'))
+            if not user_cart:
+                return Response({"messages": "No items in your cart"}, status=status.HTTP_400_BAD_REQUEST)
+
+            user_addresses = list(Address.objects.filter(profile__user=request.user))
 
             if len(user_addresses) == 1:
-                user_address = user_addresses.first()
+                user_address_obj = user_addresses[0]
+                user_address = f"{user_address_obj.details}, {user_address_obj.city}, {user_address_obj.country}"
             elif len(user_addresses) > 1:
                 if "address_id" in request.data:
                     user_address_id = int(request.data["address_id"])
@@ -385,14 +487,13 @@ class OrderManagement(APIView):
                     return Response({
                         "error": "Please enter your address in true format: {'details': '', 'city': '', 'country': ''}"},
                         status=status.HTTP_400_BAD_REQUEST)
-            user_cart = Cart.objects.filter(user=request.user)
-            total_cart_price = user_cart.aggregate(total_price=Sum("price"))['total_price']
-            delivery = User.objects.filter(groups__name='delivery', is_active=True, ready_to_work=True)
-            random_delivery = random.choice(delivery).id
+            total_cart_price = sum(item.price for item in user_cart)
+            # None when nobody is ready: the order waits in the queue until a crew member turns ready.
+            delivery_crew = dispatcher.assign()
 
             order_data = {
                 "user": request.user.id,
-                "delivery_crew": random_delivery,
+                "delivery_crew": delivery_crew,
                 "status": False,
                 "total": total_cart_price,
                 "customer_address": user_address,
@@ -401,18 +502,20 @@ class OrderManagement(APIView):
 
             ser = OrderSerializer(data=order_data)
             if ser.is_valid():
-                order = ser.save()
+                order = ser.save(ordered_time=timezone.now())
 
-                for item in user_cart:
-                    order_item = OrderItem(
+                OrderItem.objects.bulk_create([
+                    OrderItem(
                         order=order,
                         menuitem_id=item.menuitem_id,
                         quantity=item.quantity,
                         price=item.price
-                    )
-                    order_item.save()
-
-                user_cart.delete()
+                    ) for item in user_cart
+                ])
+                Cart.objects.filter(pk__in=[item.pk for item in user_cart]).delete()
+                DailySales.record_order(order.date, order.total)
+                if delivery_crew is not None:
+                    events.publish_on_commit(events.delivery_channel(delivery_crew), 'assigned', ser.data)
 
                 return Response(ser.data, status=status.HTTP_200_OK)
             else:
@@ -420,7 +523,7 @@ class OrderManagement(APIView):
 
 
 class OrderDeliveryStatusManagement(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsDeliveryCrew]
 
     def get(self, request: Request, pk=None):
@@ -430,11 +533,15 @@ class OrderDeliveryStatusManagement(APIView):
             return Response(ser.data, status=status.HTTP_200_OK)
         elif not pk:
             orders = Order.objects.filter(delivery_crew__username=request.user.username)
-            ser = OrderSerializer(orders, many=True)
+            paginator = KeysetPagination(('date', 'id'))
+            if paginator.is_requested(request):
+                page = paginator.paginate_queryset(orders, request)
+                return paginator.get_paginated_response(serialize_list(self, OrderSerializer, page))
+            ser = list_serializer(self, OrderSerializer)(orders, many=True)
             return Response(ser.data, status=status.HTTP_200_OK)
 
     def post(self, request: Request, pk):
-        if request.user.groups.filter(name='delivery'):
+        if has_role(request.user, 'delivery'):
             if pk:
                 order = get_object_or_404(Order, delivery_crew__username=request.user.username, pk=pk)
 
@@ -443,10 +550,13 @@ class OrderDeliveryStatusManagement(APIView):
                     now_time = str(datetime.datetime.now())[:-7]
                     order.delivered_time = now_time
                     order.save()
+                    dispatcher.order_closed(request.user.id)
+                    publish_assignments(dispatcher.drain_queue())
                 else:
                     return Response({"message": f"Order number {order.id} has already been delivered"})
 
                 ser = OrderSerializer(order)
+                events.publish_on_commit(events.orders_channel(order.user_id), 'delivered', ser.data)
                 return Response({"order": ser.data, "message": f"Order number {order.id} delivered successfully"},
                                 status=status.HTTP_200_OK)
         else:
@@ -454,7 +564,7 @@ class OrderDeliveryStatusManagement(APIView):
 
 
 class DeliveryCrewReadyToWorkStatusManagement(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsDeliveryCrew]
 
     def post(self, request: Request):
@@ -469,12 +579,17 @@ class DeliveryCrewReadyToWorkStatusManagement(APIView):
             queryset.ready_to_work = False
 
         queryset.save()
+        if queryset.ready_to_work:
+            dispatcher.crew_ready(queryset.id, Order.objects.filter(delivery_crew=queryset, status=False).count())
+            publish_assignments(dispatcher.drain_queue())
+        else:
+            dispatcher.crew_unavailable(queryset.id)
         ser = UserSerializer(queryset)
         return Response({"ready_to_work": ser.data["ready_to_work"]}, status=status.HTTP_200_OK)
 
 
 class OrderDeliveryCrewChanger(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManager]
 
     def get(self, request: Request, pk=None):
@@ -484,7 +599,11 @@ class OrderDeliveryCrewChanger(APIView):
             return Response(ser.data, status=status.HTTP_200_OK)
         elif not pk:
             queryset = Order.objects.filter(status=False).order_by('date')
-            ser = OrderSerializer(queryset, many=True)
+            paginator = KeysetPagination(('date', 'id'))
+            if paginator.is_requested(request):
+                page = paginator.paginate_queryset(queryset, request)
+                return paginator.get_paginated_response(serialize_list(self, OrderSerializer, page))
+            ser = list_serializer(self, OrderSerializer)(queryset, many=True)
             return Response(ser.data, status=status.HTTP_200_OK)
 
     def post(self, request: Request, pk):
@@ -500,9 +619,16 @@ class OrderDeliveryCrewChanger(APIView):
 
             if alternative_delivery_crew.ready_to_work:
                 order = get_object_or_404(Order, pk=pk)
+                previous_crew_id = order.delivery_crew_id
                 order.delivery_crew = alternative_delivery_crew
                 order.save()
+                if not order.status:
+                    dispatcher.order_moved(previous_crew_id, alternative_delivery_crew.id)
                 ser = OrderSerializer(order)
+                if previous_crew_id is not None and previous_crew_id != alternative_delivery_crew.id:
+                    events.publish_on_commit(events.delivery_channel(previous_crew_id), 'unassigned', ser.data)
+                events.publish_on_commit(events.delivery_channel(alternative_delivery_crew.id), 'assigned', ser.data)
+                events.publish_on_commit(events.orders_channel(order.user_id), 'assigned', ser.data)
                 return Response([{"message": f"Order {order.id} assigned to {alternative_delivery_crew.username}"},
                                  {"order": ser.data}], status=status.HTTP_200_OK)
 
@@ -512,7 +638,7 @@ class OrderDeliveryCrewChanger(APIView):
 
 
 class DeliveredOrders(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManager]
 
     def get(self, request: Request, pk=None):
@@ -522,12 +648,55 @@ class DeliveredOrders(APIView):
             return Response(ser.data, status=status.HTTP_200_OK)
         else:
             queryset = Order.objects.filter(status=True).order_by('date')
-            ser = OrderSerializer(queryset, many=True)
+            paginator = KeysetPagination(('date', 'id'))
+            if paginator.is_requested(request):
+                page = paginator.paginate_queryset(queryset, request)
+                return paginator.get_paginated_response(serialize_list(self, OrderSerializer, page))
+            ser = list_serializer(self, OrderSerializer)(queryset, many=True)
             return Response(ser.data, status=status.HTTP_200_OK)
 
 
+class OrderExport(APIView):
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
+    permission_classes = [IsManager]
+    outputs = {
+        'csv': (iter_csv, 'text/csv', 'csv'),
+        'ndjson': (iter_ndjson, 'application/x-ndjson', 'ndjson'),
+    }
+
+    def get(self, request: Request):
+        output = request.query_params.get('output', 'csv')
+        if output not in self.outputs:
+            return Response({"error": "'output' must be 'csv' or 'ndjson'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start_date = request.query_params.get('start_date')
+            end_date = request.query_params.get('end_date')
+            start_date = datetime.date.fromisoformat(start_date) if start_date else None
+            end_date = datetime.date.fromisoformat(end_date) if end_date else None
+        except ValueError:
+            return Response({"error": "'start_date' and 'end_date' must be YYYY-MM-DD dates"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        order_status = request.query_params.get('status')
+        if order_status in ("True", "true", "1"):
+            order_status = True
+        elif order_status in ("False", "false", "0"):
+            order_status = False
+        else:
+            order_status = None
+
+        rows, content_type, extension = self.outputs[output]
+        rows = rows(export_queryset(start_date, end_date, order_status))
+        if isinstance(request._request, ASGIRequest):
+            rows = aiter_rows(rows)
+        response = StreamingHttpResponse(rows, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{extension}"'
+        return response
+
+
 class MenuItemAvailability(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManager]
 
     def get(self, request: Request, pk=None):
@@ -541,13 +710,13 @@ class MenuItemAvailability(APIView):
 
             if featured:
                 if featured in ("True", "true"):
-                    queryset = MenuItem.objects.filter(featured=True).order_by('category')
+                    queryset = MenuItem.objects.filter(featured=True).select_related('category').order_by('category')
                     queryset_name = "Available Items"
                 elif featured in ("False", "false"):
-                    queryset = MenuItem.objects.filter(featured=False).order_by('category')
+                    queryset = MenuItem.objects.filter(featured=False).select_related('category').order_by('category')
                     queryset_name = "not-available Items"
                 else:
-                    queryset = MenuItem.objects.filter(featured=True).order_by('category')
+                    queryset = MenuItem.objects.filter(featured=True).select_related('category').order_by('category')
                     queryset_name = "Available Items"
 
                 ser = MenuItemAvailabilitySerializer(queryset, many=True)
@@ -583,7 +752,7 @@ class MenuItemAvailability(APIView):
 
 
 class UserOrdersHistory(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsCustomer]
 
     def get(self, request: Request, pk=None):
@@ -591,16 +760,20 @@ class UserOrdersHistory(APIView):
             order_items = OrderItem.objects.filter(order=pk).order_by('-price')
             order_items_total_price = order_items.aggregate(total_price=Sum("price"))
             print(UserOrdersHistory)
-            ser = OrderItemSerializer(order_items, many=True)
+            ser = list_serializer(self, OrderItemSerializer)(order_items, many=True)
             return Response([ser.data, order_items_total_price], status=status.HTTP_200_OK)
         elif not pk:
             orders = Order.objects.filter(user=request.user).order_by('date')
-            ser = OrderSerializer(orders, many=True)
+            paginator = KeysetPagination(('date', 'id'))
+            if paginator.is_requested(request):
+                page = paginator.paginate_queryset(orders, request)
+                return paginator.get_paginated_response(serialize_list(self, OrderSerializer, page))
+            ser = list_serializer(self, OrderSerializer)(orders, many=True)
             return Response(ser.data, status=status.HTTP_200_OK)
 
 
 class MenuItemPriceAdjustment(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManager]
 
     def get(self, request: Request, pk=None):
@@ -641,17 +814,18 @@ class MenuItemPriceAdjustment(APIView):
 
 
 class SaleReport(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsManager]
 
     def get(self, request: Request):
         today = timezone.now()
         today_str = str(today)[:-13]
 
-        sales = Order.objects.filter(date=today)
+        sales = DailySales.objects.filter(date=today).aggregate(total_sale=Sum('revenue'),
+                                                                 sales_count=Sum('order_count'))
 
-        sales_price = sales.aggregate(total_sale=Sum('total'))['total_sale']
-        sales_count = sales.count()
+        sales_price = sales['total_sale']
+        sales_count = sales['sales_count'] or 0
 
         return Response({"message": f"Today ({today_str}) sale is {sales_price} for {sales_count} orders."},
                         status=status.HTTP_200_OK)
@@ -662,10 +836,11 @@ class SaleReport(APIView):
         start_date = request.data.get('start_date', today)
         end_date = request.data.get('end_date', today)
 
-        sales = Order.objects.filter(date__range=[start_date, end_date])
+        sales = DailySales.objects.filter(date__range=[start_date, end_date]).aggregate(
+            total_sale=Sum('revenue'), sales_count=Sum('order_count'))
 
-        sales_price = sales.aggregate(total_sale=Sum('total'))['total_sale']
-        sales_count = sales.count()
+        sales_price = sales['total_sale']
+        sales_count = sales['sales_count'] or 0
 
         if start_date == end_date:
             return_value, _status = {
@@ -680,33 +855,56 @@ class SaleReport(APIView):
         return Response(return_value, status=_status)
 
 
+class SalesAnalytics(APIView):
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
+    permission_classes = [IsManager]
+    max_days = 3660
+    max_top = 100
+
+    def get(self, request: Request):
+        today = str(timezone.now().date())
+        try:
+            start_date = datetime.date.fromisoformat(request.query_params.get('start_date', today))
+            end_date = datetime.date.fromisoformat(request.query_params.get('end_date', today))
+            top = int(request.query_params.get('top', 10))
+        except ValueError:
+            return Response({"error": "'start_date' and 'end_date' must be YYYY-MM-DD dates and 'top' an integer"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if start_date > end_date:
+            return Response({"error": "Your start_date must be earlier than the end_date"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if (end_date - start_date).days >= self.max_days:
+            return Response({"error": f"The date range can't be longer than {self.max_days} days"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        top = max(1, min(top, self.max_top))
+        return Response(sales_breakdown(start_date, end_date, top), status=status.HTTP_200_OK)
+
+
 class MenuItemRatings(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsCustomerAndHasBoughtItem]
 
     def get(self, request: Request, pk=None):
         if pk:
-            queryset = get_object_or_404(MenuItem, pk=pk)
+            queryset = get_object_or_404(MenuItem.objects.select_related('category'), pk=pk)
             ser = MenuItemSerializer(queryset)
             return Response(ser.data, status=status.HTTP_200_OK)
         else:
-            queryset = MenuItem.objects.all()
-            ser = MenuItemSerializer(queryset, many=True)
+            queryset = MenuItem.objects.all().select_related('category')
+            ser = list_serializer(self, MenuItemSerializer)(queryset, many=True)
             return Response(ser.data, status=status.HTTP_200_OK)
 
     def post(self, request: Request, pk):
-        user_past_rate_for_this_item = Rate.objects.filter(user_id=request.user.id, object_id=pk).exists()
-        if user_past_rate_for_this_item:
-            return Response({"error": "You had rate for this item before."}, status=status.HTTP_403_FORBIDDEN)
-        else:
-            try:
-                user_rate = request.data['rate']
-                menuitem = get_object_or_404(MenuItem, pk=pk).id
-            except (ValueError, KeyError):
-                return Response(
-                    {
-                        "error": "'rate' field is required. 'rate' must be an integer between 1 to 10."},
-                    status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user_rate = request.data['rate']
+            menuitem = get_object_or_404(MenuItem, pk=pk).id
+        except (ValueError, KeyError):
+            return Response(
+                {
+                    "error": "'rate' field is required. 'rate' must be an integer between 1 to 10."},
+                status=status.HTTP_400_BAD_REQUEST)
 
         content_type = ContentType.objects.get(app_label='restaurantAPI', model='menuitem').id
 
@@ -717,15 +915,20 @@ class MenuItemRatings(APIView):
             "object_id": menuitem,
         }
         ser = RateCreateSerializer(data=rate_data)
-        if ser.is_valid():
-            ser.save()
-            return Response(ser.data, status.HTTP_201_CREATED)
-        else:
+        if not ser.is_valid():
             return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            item = MenuItem.objects.select_for_update().get(pk=menuitem)
+            # Checked under the item's lock, so two concurrent first ratings can't both be counted.
+            if Rate.objects.filter(user_id=request.user.id, object_id=menuitem).exists():
+                return Response({"error": "You had rate for this item before."}, status=status.HTTP_403_FORBIDDEN)
+            rate = ser.save()
+            item.add_rate(rate.rate)
+        return Response(ser.data, status.HTTP_201_CREATED)
 
 
 class CustomerAddressManagement(APIView):
-    authentication_classes = [TokenAuthentication, BasicAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, CachedBasicAuthentication, SessionAuthentication]
     permission_classes = [IsCustomer]
 
     def get(self, request: Request, pk=None):
@@ -759,3 +962,28 @@ class CustomerAddressManagement(APIView):
             return Response(
                 {"message": f"'{address.details} {address.city} {address.country}' Deleted from your profile."},
                 status=status.HTTP_204_NO_CONTENT)
+
+
+class Metrics(View):
+    """
+    Request and cache metrics of every worker process in the Prometheus text format. A plain Django
+    view: no authentication and no database access, just METRICS_ALLOWED_IPS.
+    """
+
+    def get(self, request):
+        allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', None)
+        if allowed_ips is not None and request.META.get('REMOTE_ADDR') not in allowed_ips:
+            return HttpResponse(status=403)
+        return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class EventStreamUnavailable(View):
+    """
+    The event stream URLs outside ASGI. Streams stay open for as long as the client listens, which would
+    hold a WSGI worker each, so they are only served by the async views (core/async_urls.py).
+    """
+
+    def get(self, request):
+        return JsonResponse({'error': 'Event streams are only served when the API runs under ASGI '
+                                      '(core/asgi.py, e.g. `manage.py serve --asgi`).'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)